@@ -1,11 +1,9 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, g
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
-import os
 import sys
 import codecs
-from sqlalchemy import text
 
 # 强制使用 UTF-8 编码
 if sys.stdout.encoding != 'UTF-8':
@@ -19,8 +17,7 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
-    # 强制模板使用 UTF-8 编码
-    app.config['TEMPLATES_AUTO_RELOAD'] = True
+    # 模板只在开发模式（debug）下按修改时间自动重新加载，生产环境使用启动时编译好的缓存
     app.config['JSON_AS_ASCII'] = False  # 确保 JSON 响应使用 UTF-8
     
     # 添加自定义过滤器
@@ -32,98 +29,60 @@ def create_app(config_class=Config):
         except (ValueError, TypeError):
             return value
     
-    # 替换 before_first_request 为 before_request 并添加条件判断
-    @app.before_request
-    def check_templates_encoding():
-        """检查模板文件编码，只在第一个请求时执行"""
-        if not hasattr(g, 'encoding_checked'):
-            template_dir = os.path.join(os.path.dirname(__file__), 'templates')
-            if os.path.exists(template_dir):
-                print("检查模板文件编码...")
-                for file_name in os.listdir(template_dir):
-                    if file_name.endswith('.html'):
-                        file_path = os.path.join(template_dir, file_name)
-                        try:
-                            # 尝试以UTF-8编码读取文件
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                f.read()
-                            print(f"✓ {file_name}: UTF-8 编码正常")
-                        except UnicodeDecodeError as e:
-                            print(f"✗ {file_name}: 编码错误 - {e}")
-                            print("请运行 fix_encoding.py 修复编码问题")
-            g.encoding_checked = True  # 标记为已检查
-    
     db.init_app(app)
     
-    # 测试数据库连接
-    with app.app_context():
-        try:
-            # 尝试执行一个简单的查询来测试连接
-            result = db.session.execute(text('SELECT 1'))
-            print("数据库连接测试成功")
-        except Exception as e:
-            print(f"数据库连接测试失败: {str(e)}")
+    # 响应缓存
+    from app.cache import response_cache
+    response_cache.init_app(app)
+    
+    # 写操作的增量推送（SSE）
+    from app.live import event_broker
+    event_broker.init_app(app)
+    
+    # 变更日志：ORM 写入在 flush 后自动记录（增量同步 /api/changes）
+    from app.changes import init_change_log
+    init_change_log(app)
+    
+    # 后台任务（分摊、导出、重建汇总表、批量导入）
+    from app.jobs import job_runner
+    job_runner.init_app(app)
+    
+    # 请求性能统计（查询次数/耗时、慢查询日志、/metrics）
+    from app.metrics import init_metrics
+    init_metrics(app)
+    
+    # 响应压缩（gzip/brotli）
+    from app.compression import init_compression
+    init_compression(app)
     
     # 导入并注册路由
     from app.routes import init_routes
     init_routes(app)
     
-    # 创建数据库表和执行迁移
+    # 注册命令行命令
+    from app.commands import init_commands
+    init_commands(app)
+    
+    # 检查数据库结构版本（只读取版本号；迁移由 flask --app run.py upgrade-db 执行）
     with app.app_context():
         try:
-            # 检查并应用数据库迁移
-            print("检查数据库迁移...")
-            
-            # 检查 Contracts 表是否有 CompletionRate 字段
-            try:
-                result = db.session.execute(text("""
-                    SELECT COLUMN_NAME 
-                    FROM INFORMATION_SCHEMA.COLUMNS 
-                    WHERE TABLE_NAME = 'Contracts' AND COLUMN_NAME = 'CompletionRate'
-                """))
-                if not result.fetchone():
-                    # 添加 CompletionRate 字段
-                    db.session.execute(text("ALTER TABLE Contracts ADD CompletionRate DECIMAL(5,2) DEFAULT 0.00"))
-                    print("Added CompletionRate column to Contracts table")
-            except Exception as e:
-                print(f"Error checking/adding CompletionRate column: {e}")
-                db.session.rollback()
-            
-            # 检查 FixedCosts 表是否存在
-            try:
-                result = db.session.execute(text("""
-                    SELECT COUNT(*) 
-                    FROM INFORMATION_SCHEMA.TABLES 
-                    WHERE TABLE_NAME = 'FixedCosts'
-                """))
-                if result.scalar() == 0:
-                    # 创建 FixedCosts 表
-                    db.session.execute(text("""
-                        CREATE TABLE FixedCosts (
-                            FixedCostID INT IDENTITY(1,1) PRIMARY KEY,
-                            CostType NVARCHAR(100) NOT NULL,
-                            Amount DECIMAL(18,2) NOT NULL,
-                            CostDate DATE,
-                            Description NVARCHAR(500),
-                            Month NVARCHAR(7) NOT NULL,
-                            CreatedDate DATETIME DEFAULT GETDATE()
-                        )
-                    """))
-                    print("Created FixedCosts table")
-            except Exception as e:
-                print(f"Error checking/creating FixedCosts table: {e}")
-                db.session.rollback()
-            
-            # 提交所有更改
-            db.session.commit()
-            print("数据库迁移完成")
-            
-            # 创建其他表（如果不存在）
-            db.create_all()
-            print("数据库表已创建或确认存在")
-            
+            from app.schema import check_schema_version
+            check_schema_version()
+        except Exception as e:
+            print(f"数据库连接测试失败: {str(e)}")
+            db.session.rollback()
+        
+        # 上次运行时未完成、执行进程已退出的后台任务标记为 orphaned
+        try:
+            orphaned = job_runner.mark_orphaned()
+            if orphaned:
+                print(f"{orphaned} 个后台任务的执行进程已退出，已标记为 orphaned")
         except Exception as e:
-            print(f"数据库迁移过程中出现错误: {str(e)}")
+            print(f"检查后台任务失败: {str(e)}")
             db.session.rollback()
+        
+        # 预热：连接池、模板缓存、搜索索引（每个进程只执行一次，完成后才开始处理请求）
+        from app.warmup import warm_up
+        warm_up(app)
     
     return app
\ No newline at end of file
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""欠款/欠票账龄分析
+
+欠款 = 合同金额 - 已付款，欠票 = 合同金额 - 已开票，与客户合同明细中的
+RemainingPayment / RemainingInvoice 一致（负数即超付/超开的部分按 0 计）。
+
+账龄按先进先出计算：
+  欠款中已开票未付款的部分，付款先冲抵最早的发票，剩余的发票金额按发票日期计算账龄；
+  尚未开票的部分按合同签订日期（没有签订日期时用创建日期）计算账龄。
+  欠票同理：发票先冲抵最早的付款，未开票的付款按付款日期计算账龄，其余按签订日期。
+
+先进先出的累计和冲抵由窗口函数在数据库中完成，每张流水表只返回按 合同+账龄分段 汇总的未冲抵金额，
+再用 pandas 向量化地合并合同剩余金额、按客户/供应商汇总，不逐个合同循环；供应商维度中一个合同关联多个供应商时，合同的欠款计入每个供应商。
+include_archived 为 True 时归档的合同及其流水也计入（合同、合计、关联和流水都是流水表与归档表的 UNION ALL）。
+"""
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, select, union_all
+from app import db
+from app.models import Client, Supplier, Payment, Invoice, archived_payments, archived_invoices
+from app.summary import contract_source
+
+# 账龄分段（天）：(名称, 下限, 上限)，上限为 None 表示不封顶
+AGING_BUCKETS = (
+    ('0-30', None, 30),
+    ('31-90', 30, 90),
+    ('91-180', 90, 180),
+    ('180+', 180, None),
+)
+BUCKET_NAMES = [name for name, _, _ in AGING_BUCKETS]
+_BUCKET_EDGES = [-np.inf] + [upper for _, _, upper in AGING_BUCKETS[:-1]] + [np.inf]
+
+MEASURES = ('unpaid', 'uninvoiced')
+
+
+def parse_as_of(value):
+    """账龄计算的截止日期，默认今天"""
+    if not value:
+        return date.today()
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('as_of 格式应为 YYYY-MM-DD')
+
+
+def _ledger(model, archive, date_name, include_archived):
+    """流水表的 (ContractID, 日期, Amount)，include_archived 时与归档表 UNION ALL"""
+    if not include_archived:
+        return model.__table__
+    return union_all(*[select(table.c.ContractID, table.c[date_name], table.c.Amount)
+                       for table in (model.__table__, archive)]).subquery()
+
+
+def _load_contracts(source):
+    contracts, totals = source.contracts.c, source.totals.c
+    rows = db.session.execute(
+        select(contracts.ContractID, contracts.ClientID, contracts.TotalAmount,
+               contracts.SignDate, contracts.CreatedDate,
+               totals.TotalPayments, totals.TotalInvoices)
+        .join(source.totals, totals.ContractID == contracts.ContractID, isouter=True)
+    ).all()
+    frame = pd.DataFrame(rows, columns=['ContractID', 'ClientID', 'TotalAmount', 'SignDate', 'CreatedDate',
+                                        'TotalPayments', 'TotalInvoices'])
+    for column in ('TotalAmount', 'TotalPayments', 'TotalInvoices'):
+        frame[column] = frame[column].fillna(0).astype(float)
+    created = pd.to_datetime(frame['CreatedDate']).dt.normalize()
+    frame['BaseDate'] = pd.to_datetime(frame['SignDate']).fillna(created)
+    return frame.drop(columns=['SignDate', 'CreatedDate'])
+
+
+def _bucket_case(date_column, as_of):
+    """SQL 中的账龄分段：把分段上限换算成截止日期之前的日期再比较，不依赖数据库的日期函数"""
+    return case(
+        *[(date_column >= as_of - timedelta(days=upper), name) for name, _, upper in AGING_BUCKETS[:-1]],
+        else_=BUCKET_NAMES[-1],
+    )
+
+
+def _load_open_events(ledger, date_name, covered_name, totals, as_of):
+    """先进先出后仍未被冲抵的流水金额，按 (ContractID, Bucket) 汇总
+
+    流水按 合同+日期 汇总后用窗口函数计算累计金额，累计区间 [累计-金额, 累计) 中超过
+    已冲抵金额（合计表 totals 的 covered_name 列，如发票对应已付款合计）的部分即为未冲抵金额。
+    累计、冲抵和分段都在数据库中完成，已结清的流水不离开数据库。
+    """
+    contract_id, date_column, amount = ledger.c.ContractID, ledger.c[date_name], ledger.c.Amount
+    daily = (select(contract_id.label('ContractID'), date_column.label('Date'),
+                    func.sum(amount).label('Amount'),
+                    func.sum(func.sum(amount)).over(partition_by=contract_id,
+                                                    order_by=date_column).label('Cumulative'))
+             .where(contract_id.isnot(None))
+             .group_by(contract_id, date_column)
+             .subquery())
+    uncovered = daily.c.Cumulative - func.coalesce(totals.c[covered_name], 0)
+    open_rows = (select(daily.c.ContractID,
+                        _bucket_case(daily.c.Date, as_of).label('Bucket'),
+                        case((daily.c.Amount < uncovered, daily.c.Amount), else_=uncovered).label('Open'))
+                 .join(totals, totals.c.ContractID == daily.c.ContractID, isouter=True)
+                 .where(uncovered > 0)
+                 .subquery())
+    # 分段表达式带参数，先在子查询中算出 Bucket 列再分组（SQL Server 不能按带参数的表达式分组）
+    rows = db.session.execute(
+        select(open_rows.c.ContractID, open_rows.c.Bucket, func.sum(open_rows.c.Open))
+        .group_by(open_rows.c.ContractID, open_rows.c.Bucket)
+    ).all()
+    frame = pd.DataFrame(rows, columns=['ContractID', 'Bucket', 'Open'])
+    frame['Open'] = frame['Open'].astype(float)
+    return frame
+
+
+def _base_items(contracts, covered_column, total_column, as_of):
+    """合同金额中超过 max(本方合计, 对方合计) 的部分，按合同基准日期分段"""
+    remainder = contracts['TotalAmount'] - np.maximum(contracts[total_column], contracts[covered_column])
+    age = (pd.Timestamp(as_of) - contracts['BaseDate']).dt.days.fillna(0)
+    return pd.DataFrame({'ContractID': contracts['ContractID'],
+                         'Bucket': pd.cut(age, _BUCKET_EDGES, labels=BUCKET_NAMES).astype(str),
+                         'Open': remainder.clip(lower=0)})
+
+
+def _bucket_table(events, base):
+    """未冲抵流水和合同剩余部分合并后按合同透视：以 ContractID 为索引、列为分段名称的金额表"""
+    items = pd.concat([events, base], ignore_index=True)
+    items = items[items['Open'] > 0.005]
+    table = (items.groupby(['ContractID', 'Bucket'])['Open'].sum()
+             .unstack(fill_value=0.0)
+             .reindex(columns=BUCKET_NAMES, fill_value=0.0))
+    return table
+
+
+def contract_aging(as_of=None, include_archived=False):
+    """每个合同的欠款/欠票账龄分段
+
+    返回 DataFrame：ContractID、ClientID 以及 unpaid_<分段>、uninvoiced_<分段>、unpaid_total、uninvoiced_total 列。
+    """
+    as_of = as_of or date.today()
+    source = contract_source(include_archived)
+    contracts = _load_contracts(source)
+    invoices = _load_open_events(_ledger(Invoice, archived_invoices, 'InvoiceDate', include_archived),
+                                 'InvoiceDate', 'TotalPayments', source.totals, as_of)
+    payments = _load_open_events(_ledger(Payment, archived_payments, 'PaymentDate', include_archived),
+                                 'PaymentDate', 'TotalInvoices', source.totals, as_of)
+
+    # 欠款：已开票未付款（按发票日期）+ 未开票（按签订日期）；欠票：已付款未开票（按付款日期）+ 未付款（按签订日期）
+    tables = {
+        'unpaid': _bucket_table(invoices, _base_items(contracts, 'TotalPayments', 'TotalInvoices', as_of)),
+        'uninvoiced': _bucket_table(payments, _base_items(contracts, 'TotalInvoices', 'TotalPayments', as_of)),
+    }
+
+    result = contracts[['ContractID', 'ClientID']].set_index('ContractID')
+    for measure, table in tables.items():
+        table = table.reindex(result.index, fill_value=0.0)
+        for name in BUCKET_NAMES:
+            result[f'{measure}_{name}'] = table[name].to_numpy()
+        result[f'{measure}_total'] = table.sum(axis=1).to_numpy()
+    return result.reset_index()
+
+
+def _amount_columns():
+    return [f'{measure}_{name}' for measure in MEASURES for name in BUCKET_NAMES + ['total']]
+
+
+def _serialize_row(row, extra):
+    """把一行分段金额转换为 {'unpaid': {'0-30':..., 'total':...}, 'uninvoiced': {...}}"""
+    result = dict(extra)
+    for measure in MEASURES:
+        result[measure] = {name: round(float(row[f'{measure}_{name}']), 2) for name in BUCKET_NAMES + ['total']}
+    return result
+
+
+def aging_summary(frame):
+    totals = frame[_amount_columns()].sum()
+    return _serialize_row(totals, {'Contracts': int(len(frame))})
+
+
+def aging_by_client(frame):
+    """按客户汇总，欠款合计从大到小排序"""
+    names = dict(db.session.query(Client.ClientID, Client.ClientName))
+    grouped = frame.groupby(frame['ClientID'].fillna(0).astype(int))
+    table = grouped[_amount_columns()].sum()
+    table['Contracts'] = grouped.size()
+    table = table.sort_values(['unpaid_total', 'uninvoiced_total'], ascending=False)
+    return [
+        _serialize_row(row, {'ClientID': client_id or None,
+                             'ClientName': names.get(client_id, '未指定客户'),
+                             'Contracts': int(row['Contracts'])})
+        for client_id, row in table.iterrows()
+    ]
+
+
+def aging_by_supplier(frame, include_archived=False):
+    """按供应商汇总（合同关联多个供应商时计入每个供应商），欠款合计从大到小排序"""
+    names = dict(db.session.query(Supplier.SupplierID, Supplier.SupplierName))
+    suppliers = contract_source(include_archived).suppliers
+    links = pd.DataFrame(db.session.execute(select(suppliers.c.contract_id, suppliers.c.supplier_id)).all(),
+                         columns=['ContractID', 'SupplierID'])
+    merged = links.merge(frame, on='ContractID', how='inner')
+    grouped = merged.groupby('SupplierID')
+    table = grouped[_amount_columns()].sum()
+    table['Contracts'] = grouped.size()
+    table = table.sort_values(['unpaid_total', 'uninvoiced_total'], ascending=False)
+    return [
+        _serialize_row(row, {'SupplierID': int(supplier_id),
+                             'SupplierName': names.get(supplier_id, ''),
+                             'Contracts': int(row['Contracts'])})
+        for supplier_id, row in table.iterrows()
+    ]
+
+
+def aging_report(as_of=None, by=('clients', 'suppliers'), include_archived=False):
+    """账龄报表：汇总 + 按客户/供应商分组，仪表盘和接口共用；include_archived 为 True 时计入归档的合同"""
+    as_of = as_of or date.today()
+    frame = contract_aging(as_of, include_archived)
+    report = {'as_of': as_of.isoformat(), 'buckets': BUCKET_NAMES, 'summary': aging_summary(frame)}
+    if 'clients' in by:
+        report['clients'] = aging_by_client(frame)
+    if 'suppliers' in by:
+        report['suppliers'] = aging_by_supplier(frame, include_archived)
+    return report
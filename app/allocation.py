@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import datetime
+from decimal import Decimal
+import numpy as np
+from sqlalchemy import func, select, insert, update, delete, text
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Contract, Cost, FixedCost, AllocationRun, archived_costs
+from app.rollups import apply_contract_deltas, apply_monthly_deltas, month_of
+from app.changes import max_id, record_changes, record_changes_where
+from app.utils import chunked
+
+DEFAULT_COST_TYPE = '工资薪金'
+MAX_MONTHS = 120
+# 权重 = 合同金额 × 完工率 / 100，金额和完工率都是两位小数，权重最多 6 位小数；乘以此数后为整数
+WEIGHT_SCALE = 10 ** 6
+# 等待同一月份/成本类型上其他分摊完成的最长时间（毫秒）
+LOCK_TIMEOUT_MS = 60000
+
+
+class AllocationConflict(ValueError):
+    """同一月份/成本类型的分摊正在由其他请求或后台任务执行"""
+
+
+def _month_start(month):
+    try:
+        return datetime.strptime(month + '-01', '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(f'月份格式应为 YYYY-MM: {month}')
+
+
+def _string_list(value, name):
+    """列表参数：单个字符串视为只有一项的列表，其他非列表的值抛出 ValueError"""
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f'{name} 应为字符串列表')
+    return list(dict.fromkeys(value))
+
+
+def parse_months(data):
+    """从请求中解析月份列表：month（单月）、months（列表）或 start_month/end_month（区间）"""
+    if not isinstance(data, dict):
+        raise ValueError('请求内容应为 JSON 对象')
+    if data.get('months'):
+        months = _string_list(data['months'], 'months')
+    elif data.get('start_month'):
+        start = _month_start(data['start_month'])
+        end = _month_start(data.get('end_month') or data['start_month'])
+        if end < start:
+            raise ValueError('结束月份不能早于开始月份')
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months.append(f'{year:04d}-{month:02d}')
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    elif data.get('month'):
+        months = [data['month']]
+    else:
+        raise ValueError('请指定分摊月份')
+
+    if len(months) > MAX_MONTHS:
+        raise ValueError(f'一次最多分摊 {MAX_MONTHS} 个月')
+    for month in months:
+        _month_start(month)
+    return months
+
+
+def parse_cost_types(data):
+    """从请求中解析固定成本类型：cost_type（单个）或 cost_types（列表），默认工资薪金"""
+    if data.get('cost_types'):
+        return _string_list(data['cost_types'], 'cost_types')
+    cost_type = data.get('cost_type') or DEFAULT_COST_TYPE
+    if not isinstance(cost_type, str):
+        raise ValueError('cost_type 应为字符串')
+    return [cost_type]
+
+
+def split_cents(total_cents, weights):
+    """按整数权重把总额（分）拆分到各合同，最大余数法保证各项之和恰好等于总额
+
+    全程整数运算（Python 整数，不会溢出也没有浮点误差），结果与平台和 numpy 版本无关。
+    """
+    weights = np.asarray(weights, dtype=object)
+    total_weight = int(weights.sum())
+    products = weights * int(total_cents)
+    cents = products // total_weight
+    remainders = products % total_weight
+    # 向下取整后少分的几分钱（少于合同数）依次分给余数最大的合同，余数相同时合同ID小的优先
+    remainder = int(total_cents) - int(cents.sum())
+    if remainder:
+        order = np.argsort(-remainders, kind='stable')
+        cents[order[:remainder]] += 1
+    return cents
+
+
+def weight_value(weight):
+    """整数权重换算回元"""
+    return float(Decimal(int(weight)) / WEIGHT_SCALE)
+
+
+def load_fixed_cost_inputs(months, cost_types):
+    """读取所选月份/类型的固定成本记录，返回 {(月份, 成本类型): {'total': 总额, 'fixed_cost_ids': [...]}}"""
+    rows = (db.session.query(FixedCost.FixedCostID, FixedCost.Month, FixedCost.CostType, FixedCost.Amount)
+            .filter(FixedCost.Month.in_(months), FixedCost.CostType.in_(cost_types))
+            .order_by(FixedCost.FixedCostID))
+    inputs = {}
+    for fixed_cost_id, month, cost_type, amount in rows:
+        item = inputs.setdefault((month, cost_type), {'total': Decimal(0), 'fixed_cost_ids': []})
+        item['total'] += amount or 0
+        item['fixed_cost_ids'].append(fixed_cost_id)
+    return inputs
+
+
+def load_weighted_contracts():
+    """读取有完工率的合同，返回 (合同ID数组, 名称列表, 金额数组, 完工率数组, 权重数组)
+
+    权重由 Decimal 金额和完工率精确计算，以 WEIGHT_SCALE 为单位的整数表示。
+    """
+    rows = (db.session.query(Contract.ContractID, Contract.ProjectName,
+                             Contract.TotalAmount, Contract.CompletionRate)
+            .filter(Contract.CompletionRate > 0)
+            .order_by(Contract.ContractID)
+            .all())
+    contract_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    names = [row[1] for row in rows]
+    amounts = np.array([float(row[2]) for row in rows], dtype=np.float64)
+    completion_rates = np.array([float(row[3] or 0) for row in rows], dtype=np.float64)
+    # 权重 = 合同金额 × 完工率 / 100
+    weights = np.array([int(Decimal(row[2]) * Decimal(row[3] or 0) / 100 * WEIGHT_SCALE) for row in rows],
+                       dtype=object)
+    return contract_ids, names, amounts, completion_rates, weights
+
+
+def allocation_cost_type(fixed_cost_type):
+    return f"固定成本分摊-{fixed_cost_type}"
+
+
+def _lock_allocations(keys):
+    """按 (月份, 成本类型) 取排他的应用锁，同一批次的分摊/撤销依次执行，锁随事务释放
+
+    两个分摊同时计算同一批次时会基于相同的已有记录求差异，重复插入成本记录、重复累加合计；
+    首次分摊时两边都会新建 AllocationRun。SQL Server 上用 sp_getapplock（与迁移相同），按固定顺序加锁避免死锁，
+    超时抛出 AllocationConflict；其他数据库（测试用的 SQLite）不加锁，只由批次的唯一约束拦截重复的首次分摊。
+    """
+    connection = db.session.connection()
+    if connection.dialect.name != 'mssql':
+        return
+    for month, cost_type in sorted(set(keys)):
+        result = connection.execute(text(
+            "SET NOCOUNT ON; DECLARE @result INT; "
+            "EXEC @result = sp_getapplock @Resource = :resource, @LockMode = 'Exclusive', "
+            "@LockOwner = 'Transaction', @LockTimeout = :timeout; SELECT @result"
+        ), {'resource': f'allocation:{month}:{cost_type}', 'timeout': LOCK_TIMEOUT_MS}).scalar()
+        if result is None or result < 0:
+            raise AllocationConflict(f'{month}月份{cost_type}分摊正在执行，请稍后再试')
+
+
+def _load_runs(months, cost_types):
+    runs = AllocationRun.query.filter(
+        AllocationRun.Month.in_(months),
+        AllocationRun.CostType.in_(cost_types)
+    ).all()
+    return {(run.Month, run.CostType): run for run in runs}
+
+
+def _load_existing_rows(runs, months, cost_types):
+    """读取各批次已生成的成本记录 {(月份, 成本类型): [(CostID, ContractID, Amount)]}
+
+    没有批次记录的旧分摊数据（按成本类型、日期和描述识别）也一并纳入，首次重算时接管并去重。
+    """
+    existing = {}
+    run_keys = {run.AllocationRunID: key for key, run in runs.items()}
+    for ids in chunked(run_keys):
+        rows = (db.session.query(Cost.CostID, Cost.ContractID, Cost.Amount, Cost.AllocationRunID)
+                .filter(Cost.AllocationRunID.in_(ids)))
+        for cost_id, contract_id, amount, run_id in rows:
+            existing.setdefault(run_keys[run_id], []).append((cost_id, contract_id, amount))
+
+    legacy_keys = {
+        (allocation_cost_type(cost_type), _month_start(month), f"{month}月份{cost_type}分摊"): (month, cost_type)
+        for month in months for cost_type in cost_types
+        if (month, cost_type) not in runs
+    }
+    if legacy_keys:
+        rows = (db.session.query(Cost.CostID, Cost.ContractID, Cost.Amount,
+                                 Cost.CostType, Cost.CostDate, Cost.Description)
+                .filter(Cost.AllocationRunID.is_(None),
+                        Cost.CostType.in_({key[0] for key in legacy_keys}),
+                        Cost.CostDate.in_({key[1] for key in legacy_keys})))
+        for cost_id, contract_id, amount, cost_type, cost_date, description in rows:
+            key = legacy_keys.get((cost_type, cost_date, description))
+            if key is not None:
+                existing.setdefault(key, []).append((cost_id, contract_id, amount))
+    return existing
+
+
+def _archived_allocations(runs, months, cost_types):
+    """已有成本记录随合同归档的批次 {(月份, 成本类型): 归档合同数}
+
+    归档的合同不再参与权重计算，重算这些批次会把它们的份额分给其他合同，与归档表中的记录重复计入，
+    所以这些批次冻结不再重算，恢复合同后恢复正常。没有批次记录的旧分摊数据同样按成本类型、日期和描述识别。
+    """
+    costs = archived_costs.c
+    archived = {}
+    run_keys = {run.AllocationRunID: key for key, run in runs.items()}
+    for ids in chunked(run_keys):
+        for run_id, count in db.session.execute(
+                select(costs.AllocationRunID, func.count(func.distinct(costs.ContractID)))
+                .where(costs.AllocationRunID.in_(ids))
+                .group_by(costs.AllocationRunID)):
+            archived[run_keys[run_id]] = count
+
+    legacy_keys = {
+        (allocation_cost_type(cost_type), _month_start(month), f"{month}月份{cost_type}分摊"): (month, cost_type)
+        for month in months for cost_type in cost_types
+        if (month, cost_type) not in runs
+    }
+    if legacy_keys:
+        for cost_type, cost_date, description, count in db.session.execute(
+                select(costs.CostType, costs.CostDate, costs.Description, func.count(func.distinct(costs.ContractID)))
+                .where(costs.AllocationRunID.is_(None),
+                       costs.CostType.in_({key[0] for key in legacy_keys}),
+                       costs.CostDate.in_({key[1] for key in legacy_keys}))
+                .group_by(costs.CostType, costs.CostDate, costs.Description)):
+            key = legacy_keys.get((cost_type, cost_date, description))
+            if key is not None:
+                archived[key] = count
+    return archived
+
+
+def _frozen_message(month, cost_type):
+    return f'{month}月份{cost_type}分摊包含已归档合同的成本记录，不能重算或撤销，请先恢复这些合同'
+
+
+def _diff_rows(existing_rows, allocation):
+    """比较已有成本记录和新的分摊结果，返回 (新增合同, 更新[(CostID, 新金额)], 删除CostID, 不变数)
+
+    allocation 为 {ContractID: 金额}，金额为0的合同不保留记录；同一合同的重复记录只保留一条。
+    """
+    kept, updates, deletes = {}, [], []
+    unchanged = 0
+    for cost_id, contract_id, amount in existing_rows:
+        new_amount = allocation.get(contract_id)
+        if not new_amount or contract_id in kept:
+            deletes.append(cost_id)
+            continue
+        kept[contract_id] = cost_id
+        if amount != new_amount:
+            updates.append((cost_id, new_amount))
+        else:
+            unchanged += 1
+    inserts = [contract_id for contract_id, amount in allocation.items() if amount and contract_id not in kept]
+    return inserts, updates, deletes, unchanged
+
+
+def allocate_fixed_costs(months, cost_types, progress=None):
+    """计算多个月份、多个成本类型的固定成本分摊，并以差异方式写入成本记录（不提交）
+
+    每个月份/成本类型对应一个 AllocationRun。重复执行时只新增、修改、删除金额有变化的成本记录，
+    输入和权重都没有变化的批次直接跳过；成本记录随合同归档的批次冻结不变（见 _archived_allocations），
+    只分摊一个月份、一个类型时抛出 ValueError。返回 (批次列表, 跳过列表)。
+    progress(已完成月数, 总月数) 在每个月份算完后调用（后台任务据此报告进度）。
+    同一批次的并发分摊依次执行（见 _lock_allocations），仍然冲突时抛出 AllocationConflict。
+    """
+    _lock_allocations([(month, cost_type) for month in months for cost_type in cost_types])
+    fixed_inputs = load_fixed_cost_inputs(months, cost_types)
+    runs = _load_runs(months, cost_types)
+    frozen = _archived_allocations(runs, months, cost_types)
+    if frozen and len(months) == 1 and len(cost_types) == 1:
+        raise ValueError(_frozen_message(months[0], cost_types[0]))
+
+    if not fixed_inputs and not runs:
+        if len(months) == 1 and len(cost_types) == 1:
+            raise ValueError(f'当月没有{cost_types[0]}记录')
+        raise ValueError('所选月份没有固定成本记录')
+
+    contract_ids, names, amounts, completion_rates, weights = load_weighted_contracts()
+    total_weight = weight_value(weights.sum())
+    if fixed_inputs and len(contract_ids) == 0:
+        raise ValueError('没有找到有完工率的合同')
+    if fixed_inputs and total_weight == 0:
+        raise ValueError('总权重为0，无法分摊成本')
+
+    weight_values = [weight_value(weight) for weight in weights]
+    snapshot = json.dumps(dict(zip(map(str, contract_ids.tolist()), weight_values)), sort_keys=True)
+    existing = _load_existing_rows(runs, months, cost_types)
+
+    batches, skipped, deltas, monthly_deltas = [], [], {}, {}
+    inserts, updates, deletes, removed_runs = [], [], [], []
+
+    def add_delta(contract_id, month, amount):
+        # 分摊生成的成本日期都是当月1日，月度合计记在分摊月份
+        deltas.setdefault(contract_id, {'TotalCosts': Decimal(0)})['TotalCosts'] += amount
+        monthly_deltas.setdefault((contract_id, month), {'TotalCosts': Decimal(0)})['TotalCosts'] += amount
+
+    for month_index, month in enumerate(months, start=1):
+        cost_date = _month_start(month)
+        for fixed_cost_type in cost_types:
+            key = (month, fixed_cost_type)
+            if key in frozen:
+                skipped.append({'month': month, 'cost_type': fixed_cost_type, 'deleted': 0,
+                                'archived_contracts': frozen[key]})
+                continue
+            fixed = fixed_inputs.get(key)
+            run = runs.get(key)
+            total_fixed_cost = fixed['total'] if fixed else Decimal(0)
+            old_rows = existing.get(key, [])
+            old_amounts = {cost_id: (contract_id, amount) for cost_id, contract_id, amount in old_rows}
+
+            if total_fixed_cost == 0:
+                # 固定成本已删除或为0：撤销原有的分摊
+                for cost_id, contract_id, amount in old_rows:
+                    deletes.append(cost_id)
+                    add_delta(contract_id, month, -amount)
+                if run is not None:
+                    removed_runs.append(run)
+                skipped.append({'month': month, 'cost_type': fixed_cost_type, 'deleted': len(old_rows)})
+                continue
+
+            inputs = json.dumps({'total_fixed_cost': str(total_fixed_cost),
+                                 'fixed_cost_ids': fixed['fixed_cost_ids']}, sort_keys=True)
+            cents = split_cents(int(total_fixed_cost * 100), weights)
+            allocation = {
+                contract_id: Decimal(int(cents[i])) / 100
+                for i, contract_id in enumerate(contract_ids.tolist())
+            }
+
+            if run is not None and run.Inputs == inputs and run.WeightsSnapshot == snapshot:
+                batch_inserts, batch_updates, batch_deletes, unchanged = [], [], [], len(old_rows)
+            else:
+                batch_inserts, batch_updates, batch_deletes, unchanged = _diff_rows(old_rows, allocation)
+                if run is None:
+                    run = AllocationRun(Month=month, CostType=fixed_cost_type)
+                    db.session.add(run)
+                run.TotalFixedCost = total_fixed_cost
+                run.TotalWeight = total_weight
+                run.Inputs = inputs
+                run.WeightsSnapshot = snapshot
+                try:
+                    db.session.flush()
+                except IntegrityError:
+                    # 没有取得应用锁的数据库上，另一个请求先创建了同一月份/类型的批次
+                    raise AllocationConflict(f'{month}月份{fixed_cost_type}分摊正在执行，请稍后再试')
+
+                cost_type = allocation_cost_type(fixed_cost_type)
+                description = f"{month}月份{fixed_cost_type}分摊"
+                for contract_id in batch_inserts:
+                    inserts.append({
+                        'ContractID': contract_id,
+                        'CostType': cost_type,
+                        'Amount': allocation[contract_id],
+                        'CostDate': cost_date,
+                        'Description': description,
+                        'AllocationRunID': run.AllocationRunID
+                    })
+                    add_delta(contract_id, month, allocation[contract_id])
+                for cost_id, new_amount in batch_updates:
+                    contract_id, old_amount = old_amounts[cost_id]
+                    updates.append({'CostID': cost_id, 'Amount': new_amount,
+                                    'AllocationRunID': run.AllocationRunID})
+                    add_delta(contract_id, month, new_amount - old_amount)
+                for cost_id in batch_deletes:
+                    contract_id, old_amount = old_amounts[cost_id]
+                    deletes.append(cost_id)
+                    add_delta(contract_id, month, -old_amount)
+                # 接管的旧数据中金额未变的记录也关联到批次
+                linked = {cost_id for cost_id, _ in batch_updates} | set(batch_deletes)
+                updates.extend({'CostID': cost_id, 'AllocationRunID': run.AllocationRunID}
+                               for cost_id, _, _ in old_rows if cost_id not in linked)
+
+            results = []
+            for i, contract_id in enumerate(contract_ids.tolist()):
+                results.append({
+                    'contract_id': contract_id,
+                    'contract_name': names[i],
+                    'amount': float(amounts[i]),
+                    'completion_rate': float(completion_rates[i]),
+                    'weight': weight_values[i],
+                    'allocated_cost': float(allocation[contract_id])
+                })
+
+            batches.append({
+                'run_id': run.AllocationRunID,
+                'month': month,
+                'cost_type': fixed_cost_type,
+                'total_fixed_cost': float(total_fixed_cost),
+                'total_weight': total_weight,
+                'allocation_rate': float(total_fixed_cost) / total_weight,
+                'inserted': len(batch_inserts),
+                'updated': len(batch_updates),
+                'deleted': len(batch_deletes),
+                'unchanged': unchanged,
+                'results': results
+            })
+        if progress:
+            progress(month_index, len(months))
+
+    # 差异以批量语句写入，并记录变更日志
+    last_cost_id = max_id(Cost) if inserts else None
+    for rows in chunked(inserts):
+        db.session.execute(insert(Cost), rows)
+    if inserts:
+        record_changes_where(Cost, Cost.CostID > last_cost_id)
+    record_changes(Cost, [row['CostID'] for row in updates])
+    record_changes(Cost, deletes, action='delete')
+    for rows in chunked([row for row in updates if 'Amount' in row]):
+        db.session.execute(update(Cost), rows)
+    for rows in chunked([row for row in updates if 'Amount' not in row]):
+        db.session.execute(update(Cost), rows)
+    for ids in chunked(deletes):
+        db.session.execute(delete(Cost).where(Cost.CostID.in_(ids)).execution_options(synchronize_session=False))
+    # 成本记录删除后再删除批次，避免外键冲突
+    for run in removed_runs:
+        db.session.delete(run)
+    apply_contract_deltas({cid: d for cid, d in deltas.items() if d['TotalCosts']})
+    apply_monthly_deltas({key: d for key, d in monthly_deltas.items() if d['TotalCosts']})
+    return batches, skipped
+
+
+def allocation_response(batches, skipped):
+    """分摊接口（以及后台分摊任务）的返回内容：单月单类型时保持原有的格式"""
+    response = dict(batches[0]) if len(batches) == 1 else {}
+    response.update({'batches': batches, 'skipped': skipped})
+    return response
+
+
+def delete_allocation_run(run):
+    """撤销一个分摊批次：删除其生成的成本记录并同步合同合计（不提交）
+
+    批次的成本记录有随合同归档的（见 _archived_allocations）时抛出 ValueError。
+    """
+    _lock_allocations([(run.Month, run.CostType)])
+    if db.session.execute(select(archived_costs.c.CostID)
+                          .where(archived_costs.c.AllocationRunID == run.AllocationRunID).limit(1)).first():
+        raise ValueError(_frozen_message(run.Month, run.CostType))
+    rows = db.session.query(Cost.ContractID, Cost.CostDate, func.sum(Cost.Amount)).filter(
+        Cost.AllocationRunID == run.AllocationRunID).group_by(Cost.ContractID, Cost.CostDate).all()
+    deltas, monthly_deltas = {}, {}
+    for contract_id, cost_date, total in rows:
+        deltas.setdefault(contract_id, {'TotalCosts': Decimal(0)})['TotalCosts'] -= total
+        monthly_deltas.setdefault((contract_id, month_of(cost_date)), {'TotalCosts': Decimal(0)})['TotalCosts'] -= total
+    apply_contract_deltas(deltas)
+    apply_monthly_deltas(monthly_deltas)
+    record_changes_where(Cost, Cost.AllocationRunID == run.AllocationRunID, action='delete')
+    db.session.execute(delete(Cost).where(Cost.AllocationRunID == run.AllocationRunID)
+                       .execution_options(synchronize_session=False))
+    db.session.delete(run)
+
+
+def serialize_run(run):
+    return {
+        'run_id': run.AllocationRunID,
+        'month': run.Month,
+        'cost_type': run.CostType,
+        'total_fixed_cost': float(run.TotalFixedCost),
+        'total_weight': run.TotalWeight,
+        'inputs': json.loads(run.Inputs) if run.Inputs else None,
+        'weights': json.loads(run.WeightsSnapshot) if run.WeightsSnapshot else None,
+        'created_date': run.CreatedDate.isoformat() if run.CreatedDate else None,
+        'updated_date': run.UpdatedDate.isoformat() if run.UpdatedDate else None
+    }
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""已结清合同的冷热分离
+
+已结清（完工率 100%、已全额收款、已全额开票）的合同按结清所在的财年归档：合同、合同-供应商关联、
+付款/发票/成本流水、合同合计和月度合计搬到归档表（ArchivedContracts 等，合同记 FiscalYear）。
+流水表、合计表只保留仍在进行中的业务，合同列表、汇总、账龄、分摊等默认查询不需要任何改动，
+数据量随在办业务增长，而不是随公司年限增长；月度趋势是历史报表，始终同时读取归档的月度合计。
+
+  flask --app run.py archive-contracts [--through-year 2023] [--dry-run]   归档结清财年不晚于指定财年的合同（默认上一个财年）
+  flask --app run.py restore-contracts --year 2023 | --ids 1,2,3          恢复归档的合同及其流水和合计
+  flask --app run.py archive-status                                        各财年已归档的合同数
+
+归档的数据只在明确要求时读取：GET /api/archive、/api/archive/contracts[/<id>]；合同列表、客户/供应商合同、
+客户汇总、账龄和导出加 include_archived=1 时同时读取流水表和归档表（见 app/summary.py 的 contract_source）。
+归档/恢复也可以通过 POST /api/archive、/api/archive/restore 或后台任务执行（见 app/jobs.py）。
+每 1000 个合同一个事务，中途失败时已完成的块保持归档（或恢复）后的状态，重新执行即可继续。
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import select, insert, delete, func, text
+from app import db
+from app.models import (Contract, Client, Supplier, Payment, Invoice, Cost, ContractTotal, AllocationRun,
+                        archived_contracts, archived_contract_suppliers,
+                        archived_payments, archived_invoices, archived_costs, archived_contract_totals)
+from app.cache import response_cache, contract_tags
+from app.changes import record_changes_where
+from app.contract_bulk import ARCHIVE_TABLES, fiscal_year, closing_fiscal_years, remove_contracts
+from app.utils import chunked
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# 主键为自增列的表（合同-供应商关联表没有自增列）
+_IDENTITY_TABLES = {'Contracts', 'Payments', 'Invoices', 'Costs'}
+
+# 归档流水表 -> (合计字段, 日期列名)
+ARCHIVED_LEDGERS = (
+    (archived_payments, 'TotalPayments', 'PaymentDate'),
+    (archived_invoices, 'TotalInvoices', 'InvoiceDate'),
+    (archived_costs, 'TotalCosts', 'CostDate'),
+)
+
+
+def current_fiscal_year():
+    return fiscal_year(date.today())
+
+
+def parse_fiscal_year(value, name='fiscal_year'):
+    try:
+        year = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} 必须是年份')
+    if not 1900 <= year <= 9999:
+        raise ValueError(f'{name} 必须是年份')
+    return year
+
+
+# ---------- 归档 ----------
+
+def closed_contracts(through_year):
+    """已结清、且结清财年不晚于 through_year 的合同 {ContractID: 财年}"""
+    candidates = [contract_id for contract_id, in
+                  db.session.query(Contract.ContractID)
+                  .join(ContractTotal, ContractTotal.ContractID == Contract.ContractID)
+                  .filter(Contract.CompletionRate >= 100,
+                          ContractTotal.TotalPayments >= Contract.TotalAmount,
+                          ContractTotal.TotalInvoices >= Contract.TotalAmount)
+                  .order_by(Contract.ContractID)]
+    return {contract_id: year for contract_id, year in closing_fiscal_years(candidates).items()
+            if year <= through_year}
+
+
+def archive_closed_contracts(through_year=None, dry_run=False, progress=None):
+    """归档结清财年不晚于 through_year（默认上一个财年）的已结清合同，每 1000 个合同提交一次
+
+    返回 {'through_year', 'dry_run', 'fiscal_years': {财年: 合同数}, 'contracts', 'payments', 'invoices', 'costs'}；
+    dry_run 为 True 时只统计不归档。progress(已处理合同数, 总数) 在每块提交后调用。
+    """
+    if through_year is None:
+        through_year = current_fiscal_year() - 1
+    years = closed_contracts(through_year)
+    per_year = {}
+    for year in years.values():
+        per_year[year] = per_year.get(year, 0) + 1
+    result = {'through_year': through_year, 'dry_run': dry_run,
+              'fiscal_years': dict(sorted(per_year.items())),
+              'contracts': len(years), 'payments': 0, 'invoices': 0, 'costs': 0}
+    if dry_run or not years:
+        return result
+
+    contract_ids = sorted(years)
+    result['contracts'] = 0
+    done = 0
+    for ids in chunked(contract_ids):
+        stale_tags = contract_tags(ids)
+        try:
+            counts = remove_contracts(ids, archive=True, fiscal_years=years)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        response_cache.invalidate(*stale_tags)
+        for name, count in counts.items():
+            result[name] += count
+        done += len(ids)
+        if progress:
+            progress(done, len(contract_ids))
+    return result
+
+
+# ---------- 恢复 ----------
+
+def archived_contract_ids(fiscal_year=None, contract_ids=None):
+    """归档表中的合同ID（升序），按财年或合同ID筛选"""
+    query = select(archived_contracts.c.ContractID).order_by(archived_contracts.c.ContractID)
+    if fiscal_year is not None:
+        return [contract_id for contract_id, in
+                db.session.execute(query.where(archived_contracts.c.FiscalYear == fiscal_year))]
+    found = []
+    for ids in chunked(sorted(set(contract_ids or ()))):
+        found.extend(contract_id for contract_id, in
+                     db.session.execute(query.where(archived_contracts.c.ContractID.in_(ids))))
+    return found
+
+
+def _identity_insert(connection, table_name, enabled):
+    # 恢复时沿用原主键：SQL Server 需要对自增列打开 IDENTITY_INSERT（同一时间只能对一张表打开）
+    if connection.dialect.name == 'mssql':
+        connection.execute(text(f"SET IDENTITY_INSERT {table_name} {'ON' if enabled else 'OFF'}"))
+
+
+def _restore_chunk(ids):
+    connection = db.session.connection()
+    for source, target, contract_column in ARCHIVE_TABLES:
+        columns = []
+        for column in source.columns:
+            value = target.c[column.name]
+            if source is Cost.__table__ and column.name == 'AllocationRunID':
+                # 分摊批次在归档期间被撤销时不再关联
+                value = (select(AllocationRun.AllocationRunID)
+                         .where(AllocationRun.AllocationRunID == target.c.AllocationRunID)
+                         .scalar_subquery())
+            columns.append(value)
+        identity = source.name in _IDENTITY_TABLES
+        if identity:
+            _identity_insert(connection, source.name, True)
+        db.session.execute(
+            insert(source).from_select(
+                [column.name for column in source.columns],
+                select(*columns).where(target.c[contract_column.name].in_(ids))
+            )
+        )
+        if identity:
+            _identity_insert(connection, source.name, False)
+
+    record_changes_where(Contract, Contract.ContractID.in_(ids))
+    for model in (Payment, Invoice, Cost):
+        record_changes_where(model, model.ContractID.in_(ids))
+
+    counts = {}
+    for name, (_, target, contract_column) in zip(('contracts', 'suppliers', 'payments', 'invoices', 'costs',
+                                                   'totals', 'monthly'), ARCHIVE_TABLES):
+        counts[name] = db.session.execute(delete(target).where(target.c[contract_column.name].in_(ids))).rowcount
+    for name in ('suppliers', 'totals', 'monthly'):
+        counts.pop(name)
+    return counts
+
+
+def restore_contracts(contract_ids, progress=None):
+    """把归档的合同及其流水、合计搬回流水表，每 1000 个合同提交一次
+
+    合同编号已被新合同使用等冲突时抛出数据库异常，该块回滚，之前的块保持已恢复。
+    返回 {'contracts', 'payments', 'invoices', 'costs'}。
+    """
+    result = dict.fromkeys(('contracts', 'payments', 'invoices', 'costs'), 0)
+    done = 0
+    for ids in chunked(contract_ids):
+        try:
+            counts = _restore_chunk(ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        response_cache.invalidate(*contract_tags(ids))
+        for name, count in counts.items():
+            result[name] += count
+        done += len(ids)
+        if progress:
+            progress(done, len(contract_ids))
+    return result
+
+
+# ---------- 读取归档数据 ----------
+
+def _value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _row(mapping):
+    return {key: _value(value) for key, value in mapping.items()}
+
+
+def archive_summary():
+    """各财年已归档的合同数，一条分组查询"""
+    rows = db.session.execute(
+        select(archived_contracts.c.FiscalYear, func.count())
+        .group_by(archived_contracts.c.FiscalYear)
+        .order_by(archived_contracts.c.FiscalYear))
+    return [{'fiscal_year': year, 'contracts': count} for year, count in rows]
+
+
+def _archived_totals(contract_ids):
+    """归档合同的付款/发票/成本合计 {ContractID: {...}}，读取归档的合同合计，一条查询"""
+    totals = {contract_id: {field: Decimal(0) for _, field, _ in ARCHIVED_LEDGERS} for contract_id in contract_ids}
+    table = archived_contract_totals
+    for contract_id, *amounts in db.session.execute(
+            select(table.c.ContractID, *[table.c[field] for _, field, _ in ARCHIVED_LEDGERS])
+            .where(table.c.ContractID.in_(contract_ids))):
+        totals[contract_id] = dict(zip([field for _, field, _ in ARCHIVED_LEDGERS], amounts))
+    return totals
+
+
+def archived_contract_rows(args):
+    """归档合同列表（按 ContractID 升序分页），返回 (当前页, 下一页游标或 None)
+
+    参数：fiscal_year、client_id、cursor（上一页最后一个 ContractID）、limit。
+    每页 3 条查询：合同、合同合计、供应商名称。
+    """
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        after = int(args.get('cursor') or 0)
+        client_id = int(args['client_id']) if args.get('client_id') else None
+    except ValueError:
+        raise ValueError('limit、cursor、client_id 必须是整数')
+    contracts = archived_contracts.c
+    stmt = (select(contracts.ContractID, contracts.ProjectName, contracts.ContractNumber, contracts.TotalAmount,
+                   contracts.ClientID, Client.ClientName.label('Client'), contracts.SignDate,
+                   contracts.CompletionRate, contracts.FiscalYear, contracts.ArchivedDate)
+            .outerjoin(Client, Client.ClientID == contracts.ClientID)
+            .where(contracts.ContractID > after)
+            .order_by(contracts.ContractID)
+            .limit(limit + 1))
+    if args.get('fiscal_year'):
+        stmt = stmt.where(contracts.FiscalYear == parse_fiscal_year(args['fiscal_year']))
+    if client_id is not None:
+        stmt = stmt.where(contracts.ClientID == client_id)
+    rows = db.session.execute(stmt).mappings().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], None
+
+    ids = [row['ContractID'] for row in rows]
+    totals = _archived_totals(ids)
+    suppliers = {}
+    for contract_id, name in db.session.execute(
+            select(archived_contract_suppliers.c.contract_id, Supplier.SupplierName)
+            .join(Supplier, Supplier.SupplierID == archived_contract_suppliers.c.supplier_id)
+            .where(archived_contract_suppliers.c.contract_id.in_(ids))
+            .order_by(archived_contract_suppliers.c.contract_id, Supplier.SupplierID)):
+        suppliers.setdefault(contract_id, []).append(name)
+
+    result = []
+    for row in rows:
+        item = _row(dict(row, **totals[row['ContractID']]))
+        item['Client'] = item['Client'] or ''
+        item['Supplier'] = ', '.join(suppliers.get(row['ContractID'], []))
+        result.append(item)
+    return result, (rows[-1]['ContractID'] if has_more else None)
+
+
+def archived_contract(contract_id):
+    """一个归档合同及其全部流水，不存在时返回 None"""
+    contract = db.session.execute(
+        select(archived_contracts).where(archived_contracts.c.ContractID == contract_id)).mappings().first()
+    if contract is None:
+        return None
+    result = _row(contract)
+    result['SupplierIDs'] = [supplier_id for supplier_id, in db.session.execute(
+        select(archived_contract_suppliers.c.supplier_id)
+        .where(archived_contract_suppliers.c.contract_id == contract_id)
+        .order_by(archived_contract_suppliers.c.supplier_id))]
+    for (table, field, date_name), name in zip(ARCHIVED_LEDGERS, ('payments', 'invoices', 'costs')):
+        key = table.primary_key.columns.values()[0]
+        result[name] = [_row(row) for row in db.session.execute(
+            select(table).where(table.c.ContractID == contract_id).order_by(table.c[date_name], key)).mappings()]
+        result[field] = sum((row['Amount'] for row in result[name]), 0)
+    return result
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""只读 JSON 接口的响应缓存
+
+缓存键为 (端点, 路径参数, 查询参数)，每个进程内有一个 LRU + TTL 的缓存。
+每条缓存依赖若干标签（如 "contracts"、"client:3"、"supplier:5"），写接口提交后
+调用 invalidate 把相关标签的版本号加一，依赖这些标签的缓存随即失效。
+标签版本号保存在后端中：默认是进程内的 LocalBackend；多进程部署时配置 CACHE_REDIS_URL，
+各进程共享标签版本，一个进程的写操作能让所有进程的缓存失效。
+
+命中缓存时带 ETag/Last-Modified 返回，浏览器再次请求时若内容未变直接返回 304，不查询数据库。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import Response, request
+from app import db
+from app.models import Contract, contract_supplier
+from app.utils import chunked
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 1024
+
+# 需要随缓存一起保存的响应头
+_CACHED_HEADERS = ('X-Next-Cursor', 'Link')
+
+CachedResponse = namedtuple('CachedResponse', 'body mimetype headers etag last_modified versions expires')
+
+
+class LocalBackend:
+    """进程内的标签版本表，单进程部署或本地开发使用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def get_versions(self, tags):
+        with self._lock:
+            return [self._versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        """各标签版本号加一，返回加一后的版本号"""
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+            return [self._versions[tag] for tag in tags]
+
+
+class RedisBackend:
+    """保存在 Redis 中的标签版本表，多个工作进程共享"""
+
+    def __init__(self, url, prefix='contract-cache:tag:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get_versions(self, tags):
+        values = self._client.mget([self._prefix + tag for tag in tags])
+        return [int(value or 0) for value in values]
+
+    def bump(self, tags):
+        pipeline = self._client.pipeline()
+        for tag in tags:
+            pipeline.incr(self._prefix + tag)
+        return [int(value) for value in pipeline.execute()]
+
+
+class ResponseCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.backend = LocalBackend()
+        self.enabled = True
+        self.ttl = DEFAULT_TTL
+        self.max_entries = DEFAULT_MAX_ENTRIES
+        self.hits = self.misses = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        self.ttl = app.config.get('CACHE_TTL', DEFAULT_TTL)
+        self.max_entries = app.config.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        redis_url = app.config.get('CACHE_REDIS_URL')
+        if redis_url:
+            try:
+                self.backend = RedisBackend(redis_url)
+            except ImportError:
+                print("未安装 redis，响应缓存使用进程内标签版本")
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self, *tags):
+        """写操作提交后调用：依赖这些标签的缓存全部失效"""
+        tags = sorted({tag for tag in tags if tag})
+        if tags:
+            self.backend.bump(tags)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _key():
+        return (request.endpoint,
+                tuple(sorted((request.view_args or {}).items())),
+                tuple(sorted(request.args.items(multi=True))))
+
+    @staticmethod
+    def _respond(entry):
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.headers.extend(entry.headers)
+        response.set_etag(entry.etag)
+        response.last_modified = entry.last_modified
+        # 浏览器每次都来验证，写操作之后能立即看到新数据
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+
+    def cached(self, *tag_templates):
+        """缓存视图的 200 响应；标签模板用路径参数格式化，例如 'client:{client_id}'"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                tags = [template.format(**kwargs) for template in tag_templates]
+                versions = self.backend.get_versions(tags)
+                key = self._key()
+                entry = self._get(key)
+                if entry is not None and entry.versions == versions:
+                    self.hits += 1
+                    return self._respond(entry)
+
+                self.misses += 1
+                response = view(*args, **kwargs)
+                # 元组形式的返回值（如错误响应）和非 200 响应不缓存
+                if not isinstance(response, Response) or response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = CachedResponse(
+                    body=body,
+                    mimetype=response.mimetype,
+                    headers=[(name, response.headers[name]) for name in _CACHED_HEADERS if name in response.headers],
+                    etag=hashlib.sha1(body).hexdigest(),
+                    last_modified=int(time.time()),
+                    # 使用执行视图之前读取的版本号：执行期间如有写操作，这条缓存下次就会失效
+                    versions=versions,
+                    expires=time.time() + self.ttl,
+                )
+                self._put(key, entry)
+                return self._respond(entry)
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache()
+
+
+# ---------- 写操作涉及的缓存标签 ----------
+
+def contract_tags(contract_ids):
+    """合同及其所属客户、供应商的缓存标签（合同列表、客户合同、供应商合同）"""
+    contract_ids = [contract_id for contract_id in set(contract_ids) if contract_id is not None]
+    tags = {'contracts'}
+    if not contract_ids:
+        return tags
+    for ids in chunked(contract_ids):
+        tags.update(f'client:{client_id}' for client_id, in
+                    db.session.query(Contract.ClientID).filter(Contract.ContractID.in_(ids)).distinct()
+                    if client_id is not None)
+        tags.update(f'supplier:{supplier_id}' for supplier_id, in
+                    db.session.query(contract_supplier.c.supplier_id)
+                    .filter(contract_supplier.c.contract_id.in_(ids)).distinct())
+    return tags
+
+
+def contract_object_tags(contract):
+    """已载入的合同对象的缓存标签，不需要额外查询"""
+    tags = {'contracts'}
+    if contract.ClientID is not None:
+        tags.add(f'client:{contract.ClientID}')
+    tags.update(f'supplier:{supplier.SupplierID}' for supplier in contract.suppliers)
+    return tags
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""变更日志和增量同步
+
+合同、付款、发票、成本、固定成本、对账记录、客户、供应商的每次新增/修改/删除都在 ChangeLog 中记一行，
+Version 由数据库自增。客户端保存上次同步到的版本号，GET /api/changes?since=<版本号> 只返回之后的变化：
+  {'version': 本次同步到的版本号, 'has_more': 是否还有未返回的变更,
+   'changes': [{'entity', 'id', 'version', 'action': 'upsert'/'delete', 'row': 当前行（删除时为 None）}]}
+同一条记录在一批中多次变化时只返回最后一次；upsert 返回读取时的最新行，合同行另附 SupplierIDs。
+since=0 返回全部现有记录（迁移时为已有数据各记一条 upsert），之后按版本号增量同步。
+
+记录方式：
+  经 ORM 会话写入的对象在每次 flush 后自动记录（after_flush 事件）；
+  绕过会话的集合语句（批量导入、固定成本分摊、批量删除合同）调用 record_changes / record_changes_where 显式记录。
+日志与业务数据在同一事务中写入，回滚时一起回滚。
+
+并发写入时版本号按插入顺序分配，但按提交顺序可见，较小的版本号可能晚于较大的版本号提交
+（批量导入、归档、多月分摊等长事务尤其如此）。写事务在分配第一个版本号之前，先在独立连接上
+登记到 ChangeLogWriters（FloorVersion 为当时已分配的最大版本号减一），事务结束后删除。
+读取时依次取得：已分配的最大版本号、仍在进行中的写事务的最小 FloorVersion、不超过该最大版本号的日志；
+版本号缺口中有大于最小 FloorVersion 的版本时可能是尚未提交的变更，只返回缺口之前的部分，
+其余的缺口（回滚或压缩留下的）直接跳过。超过 writer_timeout 秒仍未结束的登记视为进程已退出，不再等待。
+SQLite 的写事务依次执行，版本号按提交顺序分配，不需要登记。
+"""
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, insert, select, delete, literal, func, text
+from sqlalchemy.orm import aliased
+from app import db
+from app.models import (ChangeLog, ChangeLogWriter, Contract, Payment, Invoice, Cost, FixedCost,
+                        SupplierReconciliation, Client, Supplier, contract_supplier)
+from app.utils import chunked
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 5000
+DEFAULT_WRITER_TIMEOUT = 3600
+
+_WRITER_KEY = 'change_log_writer'
+
+# 实体名 -> 模型
+ENTITIES = {
+    'contract': Contract,
+    'payment': Payment,
+    'invoice': Invoice,
+    'cost': Cost,
+    'fixed_cost': FixedCost,
+    'reconciliation': SupplierReconciliation,
+    'client': Client,
+    'supplier': Supplier,
+}
+_ENTITY_NAMES = {model: name for name, model in ENTITIES.items()}
+
+
+def _primary_key(model):
+    return model.__table__.primary_key.columns.values()[0]
+
+
+def _allocated_version(connection):
+    """已分配的最大版本号（包括尚未提交的）；SQL Server 读取自增列的当前值，不等待未提交的事务"""
+    if connection.dialect.name == 'mssql':
+        return int(connection.execute(text("SELECT IDENT_CURRENT('ChangeLog')")).scalar() or 0)
+    return connection.execute(select(func.coalesce(func.max(ChangeLog.Version), 0))).scalar()
+
+
+def _register_writer(session):
+    """当前事务第一次写变更日志前登记为进行中的写事务（独立连接上提交），同一事务只登记一次"""
+    if _WRITER_KEY in session.info or session.connection().dialect.name == 'sqlite':
+        return
+    with db.engine.begin() as connection:
+        # 减一：表中还没有日志时 IDENT_CURRENT 返回的是下一个将要分配的版本号
+        floor = _allocated_version(connection) - 1
+        result = connection.execute(insert(ChangeLogWriter.__table__)
+                                    .values(FloorVersion=floor, StartedDate=datetime.utcnow()))
+        session.info[_WRITER_KEY] = result.inserted_primary_key[0]
+
+
+def _unregister_writer(session, transaction):
+    # 只在最外层事务（提交或回滚）结束时删除登记，保存点结束时不处理
+    if transaction.parent is not None or _WRITER_KEY not in session.info:
+        return
+    writer_id = session.info.pop(_WRITER_KEY)
+    with db.engine.begin() as connection:
+        connection.execute(delete(ChangeLogWriter.__table__).where(ChangeLogWriter.WriterID == writer_id))
+
+
+def record_changes(model, ids, action='upsert'):
+    """显式记录一批已知主键的变更（在当前事务中执行，不提交）"""
+    _register_writer(db.session())
+    now = datetime.utcnow()
+    entity = _ENTITY_NAMES[model]
+    rows = [{'Entity': entity, 'EntityID': entity_id, 'Action': action, 'ChangedDate': now}
+            for entity_id in sorted(set(ids))]
+    for chunk in chunked(rows):
+        db.session.execute(insert(ChangeLog), chunk)
+
+
+def record_changes_where(model, *criteria, action='upsert'):
+    """为满足条件的记录各记一条变更，INSERT ... SELECT 一条语句完成
+
+    删除前调用记录墓碑，批量插入后调用记录新行（主键由数据库生成、事先不知道时）。
+    """
+    _register_writer(db.session())
+    table = ChangeLog.__table__
+    db.session.execute(
+        insert(ChangeLog).from_select(
+            ['Entity', 'EntityID', 'Action', 'ChangedDate'],
+            select(literal(_ENTITY_NAMES[model], table.c.Entity.type), _primary_key(model),
+                   literal(action, table.c.Action.type), literal(datetime.utcnow(), table.c.ChangedDate.type))
+            .where(*criteria)
+        )
+    )
+
+
+def max_id(model):
+    """当前最大主键，批量插入前读取，插入后用 record_changes_where(model, 主键 > max_id) 记录新行"""
+    return db.session.query(func.coalesce(func.max(_primary_key(model)), 0)).scalar()
+
+
+def _log_flush(session, flush_context):
+    # after_flush 中 new/dirty/deleted 仍是 flush 前的状态，新对象已分配主键
+    now = datetime.utcnow()
+    rows = []
+    for objects, action in ((session.new, 'upsert'), (session.dirty, 'upsert'), (session.deleted, 'delete')):
+        for obj in objects:
+            entity = _ENTITY_NAMES.get(type(obj))
+            if entity is None or (objects is session.dirty and not session.is_modified(obj)):
+                continue
+            rows.append({'Entity': entity, 'EntityID': getattr(obj, _primary_key(type(obj)).name),
+                         'Action': action, 'ChangedDate': now})
+    if rows:
+        _register_writer(session)
+        rows.sort(key=lambda row: (row['Entity'], row['EntityID']))
+        # 直接在会话的连接上执行，避免在 flush 过程中再次触发 flush
+        session.connection().execute(insert(ChangeLog.__table__), rows)
+
+
+def init_change_log(app):
+    if not event.contains(db.session, 'after_flush', _log_flush):
+        event.listen(db.session, 'after_flush', _log_flush)
+    if not event.contains(db.session, 'after_transaction_end', _unregister_writer):
+        event.listen(db.session, 'after_transaction_end', _unregister_writer)
+
+
+# ---------- 读取 ----------
+
+def _open_floor(writer_timeout):
+    """仍在进行中的写事务的最小 FloorVersion，没有时返回 None；超时的登记不计入"""
+    started = datetime.utcnow() - timedelta(seconds=writer_timeout)
+    return db.session.query(func.min(ChangeLogWriter.FloorVersion)).filter(
+        ChangeLogWriter.StartedDate > started).scalar()
+
+
+def _settled(entries, since, floor):
+    """截掉可能还有未提交变更的缺口之后的部分，返回 (可返回的日志, 是否截断)
+
+    缺口中的版本号都不大于 floor（或没有进行中的写事务）时，缺口来自回滚或压缩，不影响返回。
+    """
+    previous = since
+    for index, entry in enumerate(entries):
+        if entry.Version != previous + 1 and floor is not None and entry.Version - 1 > floor:
+            return entries[:index], True
+        previous = entry.Version
+    return entries, False
+
+
+def _current_rows(entity, ids):
+    """按主键读取当前行 {主键: 行}，每 1000 个一条查询"""
+    from app.live import record_row
+    model = ENTITIES[entity]
+    key = _primary_key(model)
+    rows = {}
+    for chunk in chunked(ids):
+        for record in model.query.filter(key.in_(chunk)):
+            rows[getattr(record, key.name)] = record_row(record)
+    if entity == 'contract' and rows:
+        for row in rows.values():
+            row['SupplierIDs'] = []
+        for chunk in chunked(list(rows)):
+            for contract_id, supplier_id in db.session.execute(
+                    select(contract_supplier.c.contract_id, contract_supplier.c.supplier_id)
+                    .where(contract_supplier.c.contract_id.in_(chunk))
+                    .order_by(contract_supplier.c.contract_id, contract_supplier.c.supplier_id)):
+                rows[contract_id]['SupplierIDs'].append(supplier_id)
+    return rows
+
+
+def read_changes(since=0, limit=DEFAULT_LIMIT, writer_timeout=DEFAULT_WRITER_TIMEOUT):
+    """版本号 since 之后的变更，最多 limit 条日志（合并同一记录的多次变化后可能更少）"""
+    # 顺序不能调换：之后才登记的写事务，版本号一定大于这里读到的最大版本号
+    allocated = _allocated_version(db.session.connection())
+    floor = _open_floor(writer_timeout)
+    entries = (db.session.query(ChangeLog.Version, ChangeLog.Entity, ChangeLog.EntityID,
+                                ChangeLog.Action, ChangeLog.ChangedDate)
+               .filter(ChangeLog.Version > since, ChangeLog.Version <= allocated)
+               .order_by(ChangeLog.Version)
+               .limit(limit + 1)
+               .all())
+    has_more = len(entries) > limit
+    entries, truncated = _settled(entries[:limit], since, floor)
+
+    # 同一记录只保留最后一次变化
+    latest = {}
+    for entry in entries:
+        latest[(entry.Entity, entry.EntityID)] = entry
+
+    upserts = {}
+    for (entity, entity_id), entry in latest.items():
+        if entry.Action == 'upsert' and entity in ENTITIES:
+            upserts.setdefault(entity, []).append(entity_id)
+    rows = {entity: _current_rows(entity, ids) for entity, ids in upserts.items()}
+
+    changes = []
+    for entry in sorted(latest.values(), key=lambda entry: entry.Version):
+        row = rows.get(entry.Entity, {}).get(entry.EntityID)
+        # 记录在读取前已被删除：按删除返回，之后的墓碑会再确认一次
+        changes.append({
+            'entity': entry.Entity,
+            'id': entry.EntityID,
+            'version': entry.Version,
+            'action': 'upsert' if row is not None else 'delete',
+            'row': row,
+        })
+
+    return {
+        'version': entries[-1].Version if entries else since,
+        'has_more': has_more or truncated,
+        'changes': changes,
+    }
+
+
+def compact_change_log():
+    """删除已被同一记录更新版本取代的日志，返回删除的行数
+
+    客户端无论从哪个版本开始同步，都会收到每条记录的最后一次变化，结果不变；墓碑保留。
+    同时清除超时未结束的写事务登记（进程退出时留下的）。
+    """
+    started = datetime.utcnow() - timedelta(seconds=current_app.config.get('CHANGE_FEED_WRITER_TIMEOUT',
+                                                                             DEFAULT_WRITER_TIMEOUT))
+    db.session.execute(delete(ChangeLogWriter).where(ChangeLogWriter.StartedDate <= started)
+                       .execution_options(synchronize_session=False))
+    newer = aliased(ChangeLog)
+    result = db.session.execute(
+        delete(ChangeLog)
+        .where(select(newer.Version)
+               .where(newer.Entity == ChangeLog.Entity,
+                      newer.EntityID == ChangeLog.EntityID,
+                      newer.Version > ChangeLog.Version)
+               .exists())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
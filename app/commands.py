@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import click
+from app.rollups import rebuild_contract_totals, rebuild_monthly_totals
+from app.template_cache import compile_templates
+from app.changes import compact_change_log
+from app.jobs import purge_jobs
+from app.archive import (parse_fiscal_year, archive_closed_contracts, archived_contract_ids, restore_contracts,
+                         archive_summary)
+from app.schema import upgrade, current_version, head_version, available_migrations
+
+
+def init_commands(app):
+    # 重建/校验合同合计汇总表：flask --app run.py rebuild-contract-totals [--verify-only]
+    @app.cli.command('rebuild-contract-totals')
+    @click.option('--verify-only', is_flag=True, help='只报告差异，不修改汇总表')
+    def rebuild_contract_totals_command(verify_only):
+        drift = rebuild_contract_totals(verify_only=verify_only)
+        for item in drift:
+            print(f"合同 {item['ContractID']} {item['Field']}: 汇总表 {item['Stored']} / 实际 {item['Actual']}")
+        if not drift:
+            print("合同合计汇总表与流水一致")
+        elif verify_only:
+            print(f"发现 {len(drift)} 处差异（未修改）")
+        else:
+            print(f"已修正 {len(drift)} 处差异")
+    
+    # 重建/校验合同月度合计表：flask --app run.py rebuild-monthly-totals [--verify-only]
+    @app.cli.command('rebuild-monthly-totals')
+    @click.option('--verify-only', is_flag=True, help='只报告差异，不修改月度合计表')
+    def rebuild_monthly_totals_command(verify_only):
+        drift = rebuild_monthly_totals(verify_only=verify_only)
+        for item in drift[:100]:
+            print(f"合同 {item['ContractID']} {item['Month']} {item['Field']}: "
+                  f"汇总表 {item['Stored']} / 实际 {item['Actual']}")
+        if len(drift) > 100:
+            print(f"... 共 {len(drift)} 处差异")
+        if not drift:
+            print("合同月度合计表与流水一致")
+        elif verify_only:
+            print(f"发现 {len(drift)} 处差异（未修改）")
+        else:
+            print(f"已修正 {len(drift)} 处差异")
+    
+    # 压缩变更日志（删除已被同一记录的更新版本取代的日志）：flask --app run.py compact-change-log
+    @app.cli.command('compact-change-log')
+    def compact_change_log_command():
+        removed = compact_change_log()
+        print(f"已删除 {removed} 条被取代的变更日志")
+    
+    # 删除已结束的旧后台任务及其导出文件：flask --app run.py purge-jobs [--days 7]
+    @app.cli.command('purge-jobs')
+    @click.option('--days', type=int, default=7, help='删除多少天前结束的任务')
+    def purge_jobs_command(days):
+        removed = purge_jobs(days)
+        print(f"已删除 {removed} 个 {days} 天前结束的后台任务")
+    
+    # 归档已结清的合同：flask --app run.py archive-contracts [--through-year 2023] [--dry-run]
+    @app.cli.command('archive-contracts')
+    @click.option('--through-year', type=int, default=None, help='归档结清财年不晚于此财年的合同（默认上一个财年）')
+    @click.option('--dry-run', is_flag=True, help='只统计，不归档')
+    def archive_contracts_command(through_year, dry_run):
+        result = archive_closed_contracts(through_year, dry_run=dry_run,
+                                          progress=lambda done, total: print(f"  已归档 {done}/{total} 个合同"))
+        for year, count in result['fiscal_years'].items():
+            print(f"财年 {year}: {count} 个已结清合同")
+        if dry_run:
+            print(f"共 {result['contracts']} 个合同可归档（未修改）")
+        else:
+            print(f"已归档 {result['contracts']} 个合同（财年 {result['through_year']} 及以前），"
+                  f"付款 {result['payments']}、发票 {result['invoices']}、成本 {result['costs']} 条")
+    
+    # 恢复归档的合同：flask --app run.py restore-contracts --year 2023 或 --ids 1,2,3
+    @app.cli.command('restore-contracts')
+    @click.option('--year', 'fiscal_year', type=int, default=None, help='恢复该财年归档的全部合同')
+    @click.option('--ids', default=None, help='逗号分隔的合同ID')
+    def restore_contracts_command(fiscal_year, ids):
+        if (fiscal_year is None) == (ids is None):
+            raise click.UsageError('请指定 --year 或 --ids 其中之一')
+        try:
+            contract_ids = archived_contract_ids(
+                parse_fiscal_year(fiscal_year) if fiscal_year is not None else None,
+                [int(contract_id) for contract_id in ids.split(',') if contract_id.strip()] if ids else None)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        if not contract_ids:
+            print("没有符合条件的归档合同")
+            return
+        result = restore_contracts(contract_ids,
+                                   progress=lambda done, total: print(f"  已恢复 {done}/{total} 个合同"))
+        print(f"已恢复 {result['contracts']} 个合同，付款 {result['payments']}、发票 {result['invoices']}、"
+              f"成本 {result['costs']} 条")
+    
+    # 查看各财年归档的合同数：flask --app run.py archive-status
+    @app.cli.command('archive-status')
+    def archive_status_command():
+        summary = archive_summary()
+        for item in summary:
+            print(f"财年 {item['fiscal_year']}: {item['contracts']} 个合同")
+        if not summary:
+            print("还没有归档的合同")
+    
+    # 执行数据库迁移：flask --app run.py upgrade-db [--to 版本号]
+    @app.cli.command('upgrade-db')
+    @click.option('--to', 'target', type=int, default=None, help='升级到指定版本（默认最新）')
+    def upgrade_db_command(target):
+        applied = upgrade(target)
+        if applied:
+            print(f"已执行 {len(applied)} 个迁移，当前版本 {current_version()}")
+        else:
+            print(f"数据库已是版本 {current_version()}，无需迁移")
+    
+    # 查看数据库结构版本和待执行的迁移：flask --app run.py db-version
+    @app.cli.command('db-version')
+    def db_version_command():
+        version = current_version()
+        print(f"数据库版本 {version}，最新版本 {head_version()}")
+        for migration_version, name, _ in available_migrations():
+            if migration_version > version:
+                print(f"  待执行: {migration_version:04d}_{name}")
+    
+    # 检查模板编码和语法：flask --app run.py check-templates
+    @app.cli.command('check-templates')
+    def check_templates_command():
+        if compile_templates(app):
+            raise SystemExit(1)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""响应压缩：按请求头 Accept-Encoding 协商 br（安装了 brotli 时）或 gzip
+
+只压缩超过 COMPRESS_MIN_SIZE 字节的 JSON/文本响应；流式响应（导出、SSE）、304 和已编码的响应不处理。
+压缩后的 ETag 改为弱 ETag（同一内容的不同编码），浏览器带 If-None-Match 再次请求时仍能得到 304。
+"""
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/csv', 'text/plain', 'text/css',
+                      'application/javascript', 'text/javascript')
+
+
+def choose_encoding(accept_encodings):
+    """客户端接受的编码中优先 br，其次 gzip，都不接受时返回 None"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding, gzip_level=DEFAULT_GZIP_LEVEL, brotli_quality=DEFAULT_BROTLI_QUALITY):
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    # mtime 固定为 0，同样的内容压缩结果相同
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+def init_compression(app):
+    if not app.config.get('COMPRESS_ENABLED', True):
+        return
+    min_size = app.config.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)
+    gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', DEFAULT_GZIP_LEVEL)
+    brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY)
+
+    @app.after_request
+    def compress_response(response):
+        if (response.mimetype not in COMPRESSIBLE_TYPES
+                or response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        response.set_data(compress(body, encoding, gzip_level, brotli_quality))
+        response.headers['Content-Encoding'] = encoding
+        etag, _ = response.get_etag()
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
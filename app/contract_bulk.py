@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""批量删除/归档合同
+
+先确定要处理的合同ID，再按 1000 个一块用集合语句处理：
+  归档时先把合同、合同-供应商关联、付款/发票/成本流水、合同合计和月度合计 INSERT ... SELECT 到归档表；
+  然后删除流水、关联、合同合计和月度合计，最后删除合同。
+全部在同一事务中完成，不把合同或流水对象载入会话（也就不会触发 delete-orphan 级联逐条删除）；
+删除前为被删的合同和流水记录墓碑（变更日志，见 app/changes.py）。
+被处理合同的全部流水都离开了流水表，删除它们的合计行后，合计表与流水表仍然一致；
+归档的合计保存在 ArchivedContractTotals、ArchivedMonthlyContractTotals 中，月度趋势等历史报表照常计入（见 app/trends.py），
+只有删除合同才会让它们从历史中消失。
+归档的合同记下结清所在的财年（FiscalYear），按财年归档/恢复见 app/archive.py。
+"""
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import select, delete, insert, literal, func
+from app import db
+from app.models import (Contract, Payment, Invoice, Cost, ContractTotal, MonthlyContractTotal, contract_supplier,
+                        archived_contracts, archived_contract_suppliers, archived_payments, archived_invoices,
+                        archived_costs, archived_contract_totals, archived_monthly_totals)
+from app.contract_list import contract_filters
+from app.changes import record_changes_where
+from app.rollups import remove_contract_totals, remove_monthly_totals
+from app.utils import chunked
+
+MAX_IDS = 10000
+
+# (原表, 归档表, 合同ID列)，按归档时的插入顺序排列
+ARCHIVE_TABLES = (
+    (Contract.__table__, archived_contracts, Contract.__table__.c.ContractID),
+    (contract_supplier, archived_contract_suppliers, contract_supplier.c.contract_id),
+    (Payment.__table__, archived_payments, Payment.__table__.c.ContractID),
+    (Invoice.__table__, archived_invoices, Invoice.__table__.c.ContractID),
+    (Cost.__table__, archived_costs, Cost.__table__.c.ContractID),
+    (ContractTotal.__table__, archived_contract_totals, ContractTotal.__table__.c.ContractID),
+    (MonthlyContractTotal.__table__, archived_monthly_totals, MonthlyContractTotal.__table__.c.ContractID),
+)
+
+
+# 计算结清财年用到的表：(合同表, [(流水表, 日期列名)])
+_HOT_DATES = (Contract.__table__, ((Payment.__table__, 'PaymentDate'), (Invoice.__table__, 'InvoiceDate'),
+                                   (Cost.__table__, 'CostDate')))
+_ARCHIVED_DATES = (archived_contracts, ((archived_payments, 'PaymentDate'), (archived_invoices, 'InvoiceDate'),
+                                        (archived_costs, 'CostDate')))
+
+
+def fiscal_year(day):
+    """日期所在的财年，以开始的年份命名（财年开始月份见 FISCAL_YEAR_START_MONTH，默认 1 月即自然年）"""
+    start_month = current_app.config.get('FISCAL_YEAR_START_MONTH', 1)
+    return day.year if day.month >= start_month else day.year - 1
+
+
+def closing_fiscal_years(contract_ids, archived=False, connection=None):
+    """合同结清所在的财年 {ContractID: 财年}
+
+    取签订日期和付款/发票/成本日期中最晚的一天，都没有时按今天；archived 为 True 时从归档表读取。
+    每 1000 个合同 4 条查询。
+    """
+    contracts, ledgers = _ARCHIVED_DATES if archived else _HOT_DATES
+    executor = connection if connection is not None else db.session
+    latest = {}
+    for ids in chunked(contract_ids):
+        latest.update(executor.execute(
+            select(contracts.c.ContractID, contracts.c.SignDate).where(contracts.c.ContractID.in_(ids))).all())
+        for table, date_name in ledgers:
+            for contract_id, day in executor.execute(
+                    select(table.c.ContractID, func.max(table.c[date_name]))
+                    .where(table.c.ContractID.in_(ids))
+                    .group_by(table.c.ContractID)):
+                if day is not None and contract_id in latest and (latest[contract_id] is None
+                                                                  or day > latest[contract_id]):
+                    latest[contract_id] = day
+    today = date.today()
+    return {contract_id: fiscal_year(day or today) for contract_id, day in latest.items()}
+
+
+def resolve_contract_ids(data):
+    """从请求中解析要处理的合同：ids（合同ID列表）或 filters（筛选条件，参数同合同列表）
+
+    返回存在的合同ID（升序）。筛选条件不能为空，避免误删全部合同。
+    """
+    if data.get('ids') is not None:
+        try:
+            ids = sorted({int(contract_id) for contract_id in data['ids']})
+        except (TypeError, ValueError):
+            raise ValueError('ids 必须是合同ID列表')
+        if len(ids) > MAX_IDS:
+            raise ValueError(f'一次最多处理 {MAX_IDS} 个合同')
+        existing = []
+        for chunk in chunked(ids):
+            existing.extend(contract_id for contract_id, in
+                            db.session.query(Contract.ContractID).filter(Contract.ContractID.in_(chunk)))
+        return sorted(existing)
+
+    if data.get('filters'):
+        criteria = contract_filters(data['filters'])
+        if not criteria:
+            raise ValueError('筛选条件不能为空')
+        ids = [contract_id for contract_id, in
+               db.session.query(Contract.ContractID).filter(*criteria).order_by(Contract.ContractID)
+               .limit(MAX_IDS + 1)]
+        if len(ids) > MAX_IDS:
+            raise ValueError(f'一次最多处理 {MAX_IDS} 个合同，请缩小筛选范围')
+        return ids
+
+    raise ValueError('请指定 ids 或 filters')
+
+
+def _archive_chunk(ids, archived_date, fiscal_years):
+    # 合同按财年分组插入，每组一条 INSERT ... SELECT
+    by_year = {}
+    for contract_id in ids:
+        by_year.setdefault(fiscal_years.get(contract_id), []).append(contract_id)
+    contracts = Contract.__table__
+    for year, year_ids in sorted(by_year.items(), key=lambda item: item[0] or 0):
+        db.session.execute(
+            insert(archived_contracts).from_select(
+                [column.name for column in contracts.columns] + ['ArchivedDate', 'FiscalYear'],
+                select(*contracts.columns, literal(archived_date, archived_contracts.c.ArchivedDate.type),
+                       literal(year, archived_contracts.c.FiscalYear.type))
+                .where(contracts.c.ContractID.in_(year_ids))
+            )
+        )
+    for source, target, contract_column in ARCHIVE_TABLES[1:]:
+        columns = [column.name for column in source.columns]
+        db.session.execute(
+            insert(target).from_select(
+                columns + ['ArchivedDate'],
+                select(*source.columns, literal(archived_date, target.c.ArchivedDate.type))
+                .where(contract_column.in_(ids))
+            )
+        )
+
+
+def remove_contracts(contract_ids, archive=False, fiscal_years=None):
+    """删除（archive 为 True 时归档）合同及其流水，在当前事务中执行，不提交
+
+    归档时 fiscal_years 为 {ContractID: 结清财年}，不提供时按 closing_fiscal_years 计算。
+    返回各表处理的行数 {'contracts', 'payments', 'invoices', 'costs'}。
+    """
+    counts = dict.fromkeys(('contracts', 'payments', 'invoices', 'costs'), 0)
+    archived_date = datetime.utcnow()
+    for ids in chunked(contract_ids):
+        if archive:
+            _archive_chunk(ids, archived_date, fiscal_years if fiscal_years is not None
+                           else closing_fiscal_years(ids))
+        for name, model in (('payments', Payment), ('invoices', Invoice), ('costs', Cost)):
+            record_changes_where(model, model.ContractID.in_(ids), action='delete')
+            result = db.session.execute(delete(model).where(model.ContractID.in_(ids))
+                                        .execution_options(synchronize_session=False))
+            counts[name] += result.rowcount
+        db.session.execute(delete(contract_supplier).where(contract_supplier.c.contract_id.in_(ids)))
+        remove_contract_totals(ids)
+        remove_monthly_totals(ids)
+        record_changes_where(Contract, Contract.ContractID.in_(ids), action='delete')
+        result = db.session.execute(delete(Contract).where(Contract.ContractID.in_(ids))
+                                    .execution_options(synchronize_session=False))
+        counts['contracts'] += result.rowcount
+    return counts
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import func, case, exists, select, and_, or_
+from app import db
+from app.models import Contract, Client, Supplier
+from app.summary import (get_contract_totals, serialize_contract, select_contracts, HOT_CONTRACTS,
+                         contract_source, archived_requested)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# 允许的排序字段；排序值相同的合同再按 ContractID 排序，保证游标唯一
+SORT_COLUMNS = ('ContractID', 'SignDate')
+
+
+def over_budget(source=HOT_CONTRACTS):
+    """超预算：合计表中的总成本大于合同总额（没有合计行表示成本为0）
+
+    子查询使用别名，外层查询关联了合计表时也不会被自动关联掉。
+    """
+    totals, contracts = source.totals.alias(), source.contracts.c
+    return exists().where(
+        totals.c.ContractID == contracts.ContractID,
+        totals.c.TotalCosts > contracts.TotalAmount
+    )
+
+
+def has_supplier(condition, source=HOT_CONTRACTS):
+    """合同关联了满足 condition（Supplier 表上的条件）的供应商"""
+    links = source.suppliers.c
+    return source.contracts.c.ContractID.in_(
+        select(links.contract_id).join(Supplier, Supplier.SupplierID == links.supplier_id).where(condition))
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{name} 日期格式应为 YYYY-MM-DD')
+
+
+def _parse_number(value, name):
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'{name} 必须是数字')
+
+
+def contract_filters(args, source=HOT_CONTRACTS):
+    """把查询参数转换为合同筛选条件列表（使用 source 的列，默认为合同表）
+
+    支持 q（项目名称/合同编号）、client_id、client、supplier_id、supplier、
+    sign_date_from、sign_date_to、completion_min、completion_max、amount_min、over_budget。
+    """
+    contracts = source.contracts.c
+    criteria = []
+
+    if args.get('q'):
+        term = f"%{args['q']}%"
+        criteria.append(or_(contracts.ProjectName.ilike(term), contracts.ContractNumber.ilike(term)))
+
+    if args.get('client_id'):
+        criteria.append(contracts.ClientID == int(_parse_number(args['client_id'], 'client_id')))
+    if args.get('client'):
+        criteria.append(contracts.ClientID.in_(
+            select(Client.ClientID).where(Client.ClientName.ilike(f"%{args['client']}%"))))
+
+    if args.get('supplier_id'):
+        supplier_id = int(_parse_number(args['supplier_id'], 'supplier_id'))
+        criteria.append(has_supplier(Supplier.SupplierID == supplier_id, source))
+    if args.get('supplier'):
+        criteria.append(has_supplier(Supplier.SupplierName.ilike(f"%{args['supplier']}%"), source))
+
+    if args.get('sign_date_from'):
+        criteria.append(contracts.SignDate >= _parse_date(args['sign_date_from'], 'sign_date_from'))
+    if args.get('sign_date_to'):
+        criteria.append(contracts.SignDate <= _parse_date(args['sign_date_to'], 'sign_date_to'))
+
+    if args.get('completion_min'):
+        criteria.append(contracts.CompletionRate >= _parse_number(args['completion_min'], 'completion_min'))
+    if args.get('completion_max'):
+        criteria.append(contracts.CompletionRate <= _parse_number(args['completion_max'], 'completion_max'))
+
+    if args.get('amount_min'):
+        criteria.append(contracts.TotalAmount >= _parse_number(args['amount_min'], 'amount_min'))
+
+    over_budget_arg = args.get('over_budget', '')
+    if over_budget_arg in ('1', 'true'):
+        criteria.append(over_budget(source))
+    elif over_budget_arg in ('0', 'false'):
+        criteria.append(~over_budget(source))
+
+    return criteria
+
+
+def encode_cursor(contract, sort):
+    value = getattr(contract, sort)
+    if value is not None and sort == 'SignDate':
+        value = value.isoformat()
+    raw = json.dumps([sort, value, contract.ContractID]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor, sort):
+    try:
+        cursor_sort, value, contract_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('cursor 无效')
+    if cursor_sort != sort:
+        raise ValueError('cursor 与排序字段不一致')
+    if value is not None and sort == 'SignDate':
+        value = _parse_date(value, 'cursor')
+    return value, contract_id
+
+
+def _keyset_condition(sort, descending, value, contract_id, source=HOT_CONTRACTS):
+    """游标之后的记录条件（SQL Server 中 NULL 在升序时排最前、降序时排最后）"""
+    column, key = source.contracts.c[sort], source.contracts.c.ContractID
+    if sort == 'ContractID':
+        return key < contract_id if descending else key > contract_id
+
+    if descending:
+        if value is None:
+            return and_(column.is_(None), key < contract_id)
+        return or_(
+            column < value,
+            and_(column == value, key < contract_id),
+            column.is_(None)
+        )
+    if value is None:
+        return or_(
+            and_(column.is_(None), key > contract_id),
+            column.isnot(None)
+        )
+    return or_(column > value, and_(column == value, key > contract_id))
+
+
+def _page_params(args):
+    sort = args.get('sort', 'ContractID')
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f'不支持的排序字段: {sort}')
+    descending = args.get('order', 'asc') == 'desc'
+    limit = int(_parse_number(args.get('limit', DEFAULT_PAGE_SIZE), 'limit'))
+    if limit < 1:
+        raise ValueError('limit 必须大于0')
+    return sort, descending, min(limit, MAX_PAGE_SIZE)
+
+
+def paginate_contracts(args, fields, options=(), columns=False):
+    """按游标分页查询合同，返回 (当前页数据, 下一页游标或 None)
+
+    排序参数 sort（ContractID/SignDate）、order（asc/desc）、limit、cursor，
+    筛选参数见 contract_filters。合计只为当前页的合同读取。
+    columns 为 True 时只读取 fields 用到的列、不载入 Contract 对象（JSON 接口的 fields 参数），options 不再需要。
+    include_archived=1 时同时列出归档的合同（归档合同没有 Contract 对象，总是按列读取）。
+    """
+    source = contract_source(archived_requested(args))
+    columns = columns or source is not HOT_CONTRACTS
+    criteria = contract_filters(args, source)
+    sort, descending, limit = _page_params(args)
+
+    if args.get('cursor'):
+        value, contract_id = decode_cursor(args['cursor'], sort)
+        criteria.append(_keyset_condition(sort, descending, value, contract_id, source))
+
+    column, key = source.contracts.c[sort], source.contracts.c.ContractID
+    if descending:
+        order_by = (column.desc(), key.desc())
+    else:
+        order_by = (column.asc(), key.asc())
+
+    if columns:
+        contracts, totals = select_contracts(fields, *criteria, order_by=order_by, limit=limit + 1,
+                                             extra_columns=(sort,), source=source)
+    else:
+        contracts = (Contract.query.options(*options)
+                     .filter(*criteria)
+                     .order_by(*order_by)
+                     .limit(limit + 1)
+                     .all())
+    has_more = len(contracts) > limit
+    contracts = contracts[:limit]
+
+    if not columns:
+        totals = get_contract_totals([c.ContractID for c in contracts]) if contracts else {}
+    rows = [serialize_contract(contract, totals, fields) for contract in contracts]
+    next_cursor = encode_cursor(contracts[-1], sort) if has_more else None
+    return rows, next_cursor
+
+
+def contract_stats(args):
+    """筛选条件下的合同统计（合同数、合同总额、已付款总额、超预算数），一条聚合查询"""
+    source = contract_source(archived_requested(args))
+    contracts, totals = source.contracts.c, source.totals.c
+    total_costs = func.coalesce(totals.TotalCosts, 0)
+    count, total_amount, total_payments, over_budget_count = db.session.execute(
+        select(
+            func.count(contracts.ContractID),
+            func.coalesce(func.sum(contracts.TotalAmount), 0),
+            func.coalesce(func.sum(totals.TotalPayments), 0),
+            func.coalesce(func.sum(case((total_costs > contracts.TotalAmount, 1), else_=0)), 0)
+        )
+        .select_from(source.contracts)
+        .outerjoin(source.totals, totals.ContractID == contracts.ContractID)
+        .where(*contract_filters(args, source))
+    ).one()
+    return {
+        'Count': count,
+        'TotalAmount': float(total_amount),
+        'TotalPayments': float(total_payments),
+        'OverBudgetCount': int(over_budget_count),
+    }
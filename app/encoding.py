@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""列表接口的字段选择和按列编码
+
+fields=ContractID,ProjectName   只返回这些字段（按请求的顺序），接口同时只读取这些字段用到的列
+format=columns                  按列返回，每个字段一个数组：
+  {'format': 'columns', 'count': 行数, 'fields': [字段, ...], 'columns': {字段: [值, ...]},
+   'dictionaries': {字段: [不重复的值, ...]}}
+  出现在 dictionaries 中的字段（客户、供应商名称等大量重复的文本）在 columns 中存放下标，
+  按 dictionaries[字段][下标] 还原。
+不带 format（或 format=rows）时仍返回对象数组，与原来的格式相同。
+"""
+from flask import jsonify
+
+FORMATS = ('rows', 'columns')
+
+
+def parse_fields(value, allowed):
+    """解析 fields 参数（逗号分隔），为空时返回全部 allowed；有不支持的字段时抛出 ValueError"""
+    if not value:
+        return tuple(allowed)
+    fields = []
+    for field in value.split(','):
+        field = field.strip()
+        if field and field not in fields:
+            if field not in allowed:
+                raise ValueError(f'不支持的字段: {field}（可用字段: {", ".join(allowed)}）')
+            fields.append(field)
+    if not fields:
+        raise ValueError('fields 不能为空')
+    return tuple(fields)
+
+
+def parse_format(args):
+    value = args.get('format') or 'rows'
+    if value not in FORMATS:
+        raise ValueError(f'不支持的格式: {value}（可用格式: {", ".join(FORMATS)}）')
+    return value
+
+
+def encode_columns(rows, fields, dictionary=()):
+    """对象数组 -> 按列编码，dictionary 中的字段做字典编码"""
+    columns, dictionaries = {}, {}
+    for field in fields:
+        values = [row[field] for row in rows]
+        if field in dictionary:
+            codes, distinct = {}, []
+            for value in values:
+                if value not in codes:
+                    codes[value] = len(distinct)
+                    distinct.append(value)
+            values = [codes[value] for value in values]
+            dictionaries[field] = distinct
+        columns[field] = values
+    return {
+        'format': 'columns',
+        'count': len(rows),
+        'fields': list(fields),
+        'columns': columns,
+        'dictionaries': dictionaries,
+    }
+
+
+def list_response(rows, fields, format='rows', dictionary=()):
+    """按请求的格式返回列表"""
+    if format == 'columns':
+        return jsonify(encode_columns(rows, fields, dictionary))
+    return jsonify(rows)
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import itertools
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from sqlalchemy import select, func, union_all
+from app import db
+from app.models import (Contract, Client, Supplier, Payment, Invoice, Cost, FixedCost, SupplierReconciliation,
+                        archived_contracts, archived_payments, archived_invoices, archived_costs)
+from app.contract_list import contract_filters
+from app.summary import contract_source, archived_requested
+from app.reconciliation import balance_before
+
+YIELD_PER = 1000
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{name} 日期格式应为 YYYY-MM-DD')
+
+
+def _int_arg(args, name):
+    try:
+        return int(args[name])
+    except ValueError:
+        raise ValueError(f'{name} 必须是整数')
+
+
+def _stream(stmt):
+    """以 yield_per 分批读取查询结果，按块返回行，内存占用与总行数无关"""
+    result = db.session.execute(stmt.execution_options(yield_per=YIELD_PER))
+    for partition in result.partitions():
+        yield partition
+
+
+# ---------- 各类导出数据 ----------
+
+def _contract_rows(args):
+    """合同导出；include_archived=1 时合同、合计和供应商关联都同时读取归档表（见 contract_source）"""
+    source = contract_source(archived_requested(args))
+    contracts, totals, links = source.contracts.c, source.totals.c, source.suppliers.c
+    total_payments = func.coalesce(totals.TotalPayments, 0)
+    total_invoices = func.coalesce(totals.TotalInvoices, 0)
+    total_costs = func.coalesce(totals.TotalCosts, 0)
+    stmt = (select(contracts.ContractID, contracts.ProjectName, contracts.ContractNumber, contracts.TotalAmount,
+                   Client.ClientName, contracts.SignDate, contracts.CompletionRate,
+                   total_payments, total_invoices, total_costs)
+            .select_from(source.contracts)
+            .outerjoin(Client, Client.ClientID == contracts.ClientID)
+            .outerjoin(source.totals, totals.ContractID == contracts.ContractID)
+            .where(*contract_filters(args, source))
+            .order_by(contracts.ContractID)
+            .limit(YIELD_PER))
+    # 每块还要再查一次供应商名称，SQL Server 连接上不能同时保持两个未读完的结果集，
+    # 所以这里按 ContractID 分块读取，每块读完再查下一块
+    last_id = 0
+    while True:
+        partition = db.session.execute(stmt.where(contracts.ContractID > last_id)).all()
+        if not partition:
+            break
+        last_id = partition[-1][0]
+        ids = [row[0] for row in partition]
+        suppliers = {}
+        for contract_id, name in db.session.execute(
+                select(links.contract_id, Supplier.SupplierName)
+                .join(Supplier, Supplier.SupplierID == links.supplier_id)
+                .where(links.contract_id.in_(ids))):
+            suppliers.setdefault(contract_id, []).append(name)
+        yield [
+            [contract_id, project, number, amount, client or '', ', '.join(suppliers.get(contract_id, [])),
+             sign_date, completion or 0, payments, invoices, costs, (amount or 0) - payments,
+             '是' if costs > (amount or 0) else '否']
+            for contract_id, project, number, amount, client, sign_date, completion, payments, invoices, costs
+            in partition
+        ]
+
+
+def _ledger_rows(model, id_column, date_column, type_column, extra_columns=(), archive=None):
+    """付款/发票/成本导出；include_archived=1 时同时读取归档表（archive），两部分 UNION ALL 后按日期排序"""
+    def build(ledger, contracts, contract_id, start_date, end_date):
+        columns = ledger.c
+        stmt = (select(columns[id_column.key], contracts.c.ContractNumber, contracts.c.ProjectName,
+                       columns[date_column.key], columns.Amount, columns[type_column.key],
+                       *[columns[column.key] for column in extra_columns])
+                .outerjoin(contracts, contracts.c.ContractID == columns.ContractID))
+        if contract_id is not None:
+            stmt = stmt.where(columns.ContractID == contract_id)
+        if start_date is not None:
+            stmt = stmt.where(columns[date_column.key] >= start_date)
+        if end_date is not None:
+            stmt = stmt.where(columns[date_column.key] <= end_date)
+        return stmt
+
+    def rows(args):
+        contract_id = _int_arg(args, 'contract_id') if args.get('contract_id') else None
+        start_date = _parse_date(args['start_date'], 'start_date') if args.get('start_date') else None
+        end_date = _parse_date(args['end_date'], 'end_date') if args.get('end_date') else None
+        stmt = build(model.__table__, Contract.__table__, contract_id, start_date, end_date)
+        if archived_requested(args):
+            combined = union_all(
+                stmt, build(archive, archived_contracts, contract_id, start_date, end_date)).subquery()
+            stmt = select(combined).order_by(combined.c[date_column.key], combined.c[id_column.key])
+        else:
+            stmt = stmt.order_by(date_column, id_column)
+        for partition in _stream(stmt):
+            yield [list(row) for row in partition]
+    return rows
+
+
+def _fixed_cost_rows(args):
+    stmt = select(FixedCost.FixedCostID, FixedCost.Month, FixedCost.CostType, FixedCost.Amount,
+                  FixedCost.CostDate, FixedCost.Description)
+    if args.get('cost_type'):
+        stmt = stmt.where(FixedCost.CostType == args['cost_type'])
+    stmt = stmt.order_by(FixedCost.Month, FixedCost.FixedCostID)
+    for partition in _stream(stmt):
+        yield [list(row) for row in partition]
+
+
+def _reconciliation_rows(args):
+    if not args.get('supplier_id'):
+        raise ValueError('请指定 supplier_id')
+    supplier_id = _int_arg(args, 'supplier_id')
+    stmt = (select(SupplierReconciliation.ReconciliationID, SupplierReconciliation.TransactionDate,
+                   SupplierReconciliation.PaymentAmount, SupplierReconciliation.InvoiceAmount,
+                   SupplierReconciliation.Description, SupplierReconciliation.CustomField1,
+                   SupplierReconciliation.CustomField2, SupplierReconciliation.CustomField3)
+            .where(SupplierReconciliation.SupplierID == supplier_id))
+    balance = Decimal(0)
+    if args.get('start_date'):
+        start_date = _parse_date(args['start_date'], 'start_date')
+        stmt = stmt.where(SupplierReconciliation.TransactionDate >= start_date)
+        balance = balance_before(supplier_id, start_date)
+    if args.get('end_date'):
+        stmt = stmt.where(SupplierReconciliation.TransactionDate <= _parse_date(args['end_date'], 'end_date'))
+    stmt = stmt.order_by(SupplierReconciliation.TransactionDate, SupplierReconciliation.ReconciliationID)
+    for partition in _stream(stmt):
+        chunk = []
+        for recon_id, day, payment, invoice, description, field1, field2, field3 in partition:
+            balance += (payment or 0) - (invoice or 0)
+            chunk.append([recon_id, day, payment, invoice, balance, description, field1, field2, field3])
+        yield chunk
+
+
+# 数据集名称 -> (工作表名称, 表头, 行生成函数)
+DATASETS = {
+    'contracts': ('合同', ['合同ID', '项目名称', '合同编号', '合同总额', '客户', '供应商', '签订日期', '完工率',
+                          '已付款', '已开票', '总成本', '未付款', '超预算'], _contract_rows),
+    'payments': ('付款记录', ['付款ID', '合同编号', '项目名称', '付款日期', '金额', '付款类型'],
+                 _ledger_rows(Payment, Payment.PaymentID, Payment.PaymentDate, Payment.PaymentType,
+                              archive=archived_payments)),
+    'invoices': ('发票记录', ['发票ID', '合同编号', '项目名称', '开票日期', '金额', '发票类型'],
+                 _ledger_rows(Invoice, Invoice.InvoiceID, Invoice.InvoiceDate, Invoice.InvoiceType,
+                              archive=archived_invoices)),
+    'costs': ('成本记录', ['成本ID', '合同编号', '项目名称', '成本日期', '金额', '成本类型', '描述'],
+              _ledger_rows(Cost, Cost.CostID, Cost.CostDate, Cost.CostType, (Cost.Description,),
+                           archive=archived_costs)),
+    'fixed_costs': ('固定成本', ['固定成本ID', '月份', '成本类型', '金额', '日期', '描述'], _fixed_cost_rows),
+    'reconciliation': ('对账单', ['对账ID', '交易日期', '付款金额', '发票金额', '余额', '描述',
+                                 '自定义字段1', '自定义字段2', '自定义字段3'], _reconciliation_rows),
+}
+
+
+# ---------- 输出格式 ----------
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_stream(headers, chunks):
+    """逐块输出 CSV（带 BOM，Excel 可直接识别中文）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    yield buffer.getvalue().encode('utf-8')
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_text(value) for value in row] for row in chunk)
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ZipSink(io.RawIOBase):
+    """只写的输出流：zipfile 写入的字节暂存在这里，由生成器逐块取走"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_text(value))}</t></is></c>'
+
+
+def _xlsx_row(row):
+    return '<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>'
+
+
+def xlsx_stream(sheet_name, headers, chunks):
+    """逐块输出 XLSX：工作表 XML 直接写入 zip 流，不需要先在内存中生成整个文件"""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', _XLSX_WORKBOOK.format(name=escape(sheet_name)))
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                         '<sheetData>' + _xlsx_row(headers)).encode('utf-8'))
+            yield sink.take()
+            for chunk in chunks:
+                sheet.write(''.join(_xlsx_row(row) for row in chunk).encode('utf-8'))
+                yield sink.take()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.take()
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', csv_stream),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', xlsx_stream),
+}
+
+
+def check_export(dataset, fmt):
+    if dataset not in DATASETS:
+        raise ValueError(f'不支持的导出类型: {dataset}')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'不支持的导出格式: {fmt}')
+
+
+def export_stream(dataset, fmt, args, on_rows=None):
+    """返回 (mimetype, 文件名, 字节生成器)；参数错误抛出 ValueError
+
+    第一个数据块在返回前生成，参数错误能在响应开始之前被发现。
+    on_rows(行数) 在每块数据写出前调用（后台导出任务据此报告进度）。
+    """
+    check_export(dataset, fmt)
+    sheet_name, headers, row_source = DATASETS[dataset]
+    mimetype, writer = EXPORT_FORMATS[fmt]
+
+    chunks = row_source(args)
+    first = next(chunks, [])
+
+    def all_chunks():
+        for chunk in itertools.chain([first], chunks):
+            if on_rows:
+                on_rows(len(chunk))
+            yield chunk
+
+    if fmt == 'xlsx':
+        stream = writer(sheet_name, headers, all_chunks())
+    else:
+        stream = writer(headers, all_chunks())
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    return mimetype, filename, stream
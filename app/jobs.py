@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+"""后台任务
+
+耗时的操作（多月固定成本分摊、大批量导出、重建汇总表、批量导入、合同归档/恢复）不占用请求线程：
+接口写入一条 Jobs 记录后立即返回 202 和任务状态，由进程内的线程池执行，页面轮询任务状态。
+  POST /api/jobs                {'type': 任务类型, 'params': {...}} 提交任务，类型见 JOB_TYPES
+  GET  /api/jobs/<id>           状态和进度 {'status', 'progress', 'total', 'percent', 'message', 'error', ...}
+  POST /api/jobs/<id>/cancel    取消：排队中的任务直接取消，执行中的任务在下一次报告进度时停止并回滚
+  GET  /api/jobs/<id>/result    结果：导出任务返回文件，其他任务返回与同步接口相同的 JSON
+分摊、导出、导入接口带 async=1 时也以任务方式执行。
+
+状态：queued -> running -> succeeded/failed/cancelled。任务对业务数据的修改与同步接口相同，在一个事务中提交，
+失败或取消时整批回滚（重建汇总表分合同合计、月度合计两步，各自提交；归档/恢复每 1000 个合同提交一次）。
+任务记录的状态和进度经独立的连接立即提交，不受任务事务影响，其他请求随时可以读取。
+
+执行任务的进程每隔 JOB_HEARTBEAT_SECONDS 秒更新一次心跳时间。进程退出（重启、崩溃）后，
+排队中或执行中、心跳超过 JOB_ORPHAN_SECONDS 秒未更新的任务标记为 orphaned（进程启动时和查询任务状态时检查），
+不会自动重新执行，需要时重新提交。
+"""
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import update, select, delete
+from sqlalchemy.exc import DBAPIError
+from app import db
+from app.models import Job
+from app.archive import (parse_fiscal_year, archive_closed_contracts, archived_contract_ids,
+                         restore_contracts)
+from app.allocation import parse_months, parse_cost_types, allocate_fixed_costs, allocation_response
+from app.cache import response_cache, contract_tags
+from app.export import check_export, export_stream
+from app.ledger_import import LEDGERS, import_records, invalidate_import_caches
+from app.rollups import rebuild_contract_totals, rebuild_monthly_totals
+from app.utils import chunked
+
+ACTIVE = ('queued', 'running')
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 20
+DEFAULT_HEARTBEAT = 30
+DEFAULT_ORPHAN_SECONDS = 120
+PROGRESS_INTERVAL = 1.0  # 两次写入进度的最短间隔（秒），完成时总会写入
+MAX_DRIFT_ITEMS = 100
+
+
+class JobCancelled(Exception):
+    """任务已被请求取消，由 JobContext.progress 抛出"""
+
+
+class JobFailed(Exception):
+    """任务失败，result 为随失败一起保存的结果（如导入的校验错误）"""
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+class JobQueueFull(Exception):
+    """本进程排队和执行中的任务已达上限"""
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'无法序列化 {type(value).__name__}')
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=_json_default)
+
+
+class JobContext:
+    """传给任务函数：参数、不保存到任务记录的数据（如导入的记录）、进度报告"""
+
+    def __init__(self, runner, job_id, params, payload):
+        self.runner = runner
+        self.job_id = job_id
+        self.params = params
+        self.payload = payload
+        self.result_file = None
+        self._last_report = 0.0
+
+    def progress(self, done, total=None, message=None):
+        """报告进度（经独立连接立即提交，间隔不足 PROGRESS_INTERVAL 秒时跳过）
+
+        任务已被请求取消时抛出 JobCancelled，任务函数不需要捕获，由执行器回滚事务。
+        """
+        now = time.monotonic()
+        if now - self._last_report < PROGRESS_INTERVAL and (total is None or done < total):
+            return
+        self._last_report = now
+        values = {'Progress': done}
+        if total is not None:
+            values['Total'] = total
+        if message is not None:
+            values['Message'] = message[:500]
+        try:
+            cancel_requested = self.runner.report(self.job_id, **values)
+        except DBAPIError as e:
+            # 进度只是提示，写入失败（如锁等待超时）不影响任务本身
+            print(f"任务 {self.job_id} 更新进度失败: {str(e)}")
+            return
+        if cancel_requested:
+            raise JobCancelled()
+
+    def result_path(self, filename):
+        """任务结果文件的路径（放在 JOB_RESULT_DIR 下，文件名前加任务号）"""
+        os.makedirs(self.runner.result_dir, exist_ok=True)
+        self.result_file = os.path.join(self.runner.result_dir, f'{self.job_id}_{filename}')
+        return self.result_file
+
+
+class JobRunner:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = set()
+        self._executor = None
+        self._heartbeat_thread = None
+        self.app = None
+        self.workers = DEFAULT_WORKERS
+        self.max_pending = DEFAULT_MAX_PENDING
+        self.heartbeat = DEFAULT_HEARTBEAT
+        self.orphan_seconds = DEFAULT_ORPHAN_SECONDS
+        self.result_dir = None
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('JOB_WORKERS', DEFAULT_WORKERS)
+        self.max_pending = app.config.get('JOB_MAX_PENDING', DEFAULT_MAX_PENDING)
+        self.heartbeat = app.config.get('JOB_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT)
+        self.orphan_seconds = app.config.get('JOB_ORPHAN_SECONDS', DEFAULT_ORPHAN_SECONDS)
+        self.result_dir = app.config.get('JOB_RESULT_DIR') or os.path.join(app.instance_path, 'jobs')
+
+    @staticmethod
+    def worker_name():
+        # 每次读取进程号：gunicorn 等在 fork 之后才执行任务
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def _start(self):
+        """第一次提交任务时才创建线程池和心跳线程"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        if self._heartbeat_thread is None:
+            self._heartbeat_thread = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+
+    # ---------- 提交 ----------
+
+    def submit(self, job_type, params):
+        """校验参数、写入任务记录并交给线程池，返回 Job；参数错误抛出 ValueError，队列已满抛出 JobQueueFull"""
+        if job_type not in JOB_TYPES:
+            raise ValueError(f'不支持的任务类型: {job_type}（可用类型: {", ".join(JOB_TYPES)}）')
+        validate, _ = JOB_TYPES[job_type]
+        params, payload = validate(params or {})
+
+        with self._lock:
+            if len(self._active) >= self.max_pending:
+                raise JobQueueFull(f'排队和执行中的任务已有 {len(self._active)} 个，请稍后再提交')
+            now = datetime.utcnow()
+            job = Job(JobType=job_type, Status='queued', Params=_dumps(params), Progress=0,
+                      CancelRequested=False, Worker=self.worker_name(), CreatedDate=now, HeartbeatDate=now)
+            db.session.add(job)
+            db.session.commit()
+            self._active.add(job.JobID)
+            self._start()
+        self._executor.submit(self._run, job.JobID, job_type, params, payload)
+        return job
+
+    # ---------- 执行 ----------
+
+    def report(self, job_id, **values):
+        """更新任务记录（独立连接、立即提交），返回是否已请求取消"""
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(Job.JobID == job_id)
+                               .values(HeartbeatDate=datetime.utcnow(), **values))
+            return bool(connection.execute(select(Job.CancelRequested).where(Job.JobID == job_id)).scalar())
+
+    def _run(self, job_id, job_type, params, payload):
+        try:
+            with self.app.app_context():
+                now = datetime.utcnow()
+                with db.engine.begin() as connection:
+                    # 排队期间已被取消的任务不再执行
+                    started = connection.execute(
+                        update(Job).where(Job.JobID == job_id, Job.Status == 'queued')
+                        .values(Status='running', StartedDate=now, HeartbeatDate=now)
+                    ).rowcount
+                if not started:
+                    return
+                self._execute(job_id, job_type, params, payload)
+        except Exception:
+            # 任务记录本身无法更新（如数据库断开），任务由心跳超时标记为 orphaned
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _execute(self, job_id, job_type, params, payload):
+        _, run = JOB_TYPES[job_type]
+        context = JobContext(self, job_id, params, payload)
+        result, error = None, None
+        try:
+            result = run(context)
+            status = 'succeeded'
+        except JobCancelled:
+            status = 'cancelled'
+        except JobFailed as e:
+            status, error, result = 'failed', str(e), e.result
+        except ValueError as e:
+            status, error = 'failed', str(e)
+        except Exception as e:
+            traceback.print_exc()
+            status, error = 'failed', f'{type(e).__name__}: {e}'
+        if status != 'succeeded':
+            db.session.rollback()
+            if context.result_file and os.path.exists(context.result_file):
+                os.remove(context.result_file)
+            context.result_file = None
+
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(Job.JobID == job_id).values(
+                Status=status,
+                Result=_dumps(result) if result is not None else None,
+                ResultFile=context.result_file,
+                Error=error,
+                FinishedDate=now,
+                HeartbeatDate=now,
+            ))
+
+    def _beat(self):
+        """心跳：定期更新本进程排队和执行中的任务，其他进程据此判断任务是否已无人执行"""
+        while True:
+            time.sleep(self.heartbeat)
+            with self._lock:
+                job_ids = sorted(self._active)
+            if not job_ids:
+                continue
+            try:
+                with self.app.app_context(), db.engine.begin() as connection:
+                    for ids in chunked(job_ids):
+                        connection.execute(update(Job).where(Job.JobID.in_(ids))
+                                           .values(HeartbeatDate=datetime.utcnow()))
+            except Exception as e:
+                print(f"更新任务心跳失败: {str(e)}")
+
+    # ---------- 查询和取消 ----------
+
+    def mark_orphaned(self, job_id=None):
+        """把心跳超时的排队/执行中任务标记为 orphaned（本进程正在执行的除外），返回标记的个数"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.orphan_seconds)
+        stmt = (update(Job)
+                .where(Job.Status.in_(ACTIVE), Job.HeartbeatDate < cutoff)
+                .values(Status='orphaned', FinishedDate=datetime.utcnow(),
+                        Error='执行任务的进程已退出，任务未完成，请重新提交')
+                .execution_options(synchronize_session=False))
+        if job_id is not None:
+            stmt = stmt.where(Job.JobID == job_id)
+        with self._lock:
+            active = sorted(self._active)  # 最多 JOB_MAX_PENDING 个
+        if active:
+            stmt = stmt.where(Job.JobID.notin_(active))
+        count = db.session.execute(stmt).rowcount
+        db.session.commit()
+        return count
+
+    def get(self, job_id):
+        """读取任务；心跳已超时的未完成任务先标记为 orphaned"""
+        job = db.session.get(Job, job_id)
+        if (job is not None and job.Status in ACTIVE and job.HeartbeatDate is not None
+                and job.HeartbeatDate < datetime.utcnow() - timedelta(seconds=self.orphan_seconds)
+                and self.mark_orphaned(job_id)):
+            db.session.refresh(job)
+        return job
+
+    def cancel(self, job):
+        """排队中的任务直接取消；执行中的任务记下取消请求，由任务在下一次报告进度时停止"""
+        if job.Status == 'queued':
+            cancelled = db.session.execute(
+                update(Job).where(Job.JobID == job.JobID, Job.Status == 'queued')
+                .values(Status='cancelled', CancelRequested=True, FinishedDate=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if cancelled:
+                db.session.commit()
+                db.session.refresh(job)
+                return job
+        db.session.execute(
+            update(Job).where(Job.JobID == job.JobID, Job.Status.in_(ACTIVE))
+            .values(CancelRequested=True)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        db.session.refresh(job)
+        return job
+
+
+job_runner = JobRunner()
+
+
+def serialize_job(job):
+    percent = None
+    if job.Status == 'succeeded':
+        percent = 100
+    elif job.Total:
+        percent = round(min(job.Progress * 100 / job.Total, 100), 1)
+    return {
+        'id': job.JobID,
+        'type': job.JobType,
+        'status': job.Status,
+        'params': json.loads(job.Params) if job.Params else None,
+        'progress': job.Progress,
+        'total': job.Total,
+        'percent': percent,
+        'message': job.Message,
+        'error': job.Error,
+        'cancel_requested': bool(job.CancelRequested),
+        'has_result': job.Result is not None or job.ResultFile is not None,
+        'worker': job.Worker,
+        'created_date': job.CreatedDate.isoformat() if job.CreatedDate else None,
+        'started_date': job.StartedDate.isoformat() if job.StartedDate else None,
+        'finished_date': job.FinishedDate.isoformat() if job.FinishedDate else None,
+    }
+
+
+def purge_jobs(days):
+    """删除 days 天前已结束的任务及其结果文件，返回删除的个数"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    rows = (db.session.query(Job.JobID, Job.ResultFile)
+            .filter(Job.Status.notin_(ACTIVE), Job.FinishedDate < cutoff)
+            .all())
+    for _, result_file in rows:
+        if result_file and os.path.exists(result_file):
+            os.remove(result_file)
+    for ids in chunked([job_id for job_id, _ in rows]):
+        db.session.execute(delete(Job).where(Job.JobID.in_(ids)).execution_options(synchronize_session=False))
+    db.session.commit()
+    return len(rows)
+
+
+# ---------- 任务类型：参数校验 (params) -> (保存的参数, 不保存的数据)，执行 (context) -> 结果 ----------
+
+def _allocation_params(params):
+    return {'months': parse_months(params), 'cost_types': parse_cost_types(params)}, None
+
+
+def _run_allocation(context):
+    batches, skipped = allocate_fixed_costs(context.params['months'], context.params['cost_types'],
+                                            progress=context.progress)
+    db.session.commit()
+    response_cache.invalidate('contracts')
+    return allocation_response(batches, skipped)
+
+
+def _export_params(params):
+    dataset, fmt = params.get('dataset'), params.get('format') or 'csv'
+    check_export(dataset, fmt)
+    args = params.get('args') or {}
+    if not isinstance(args, dict):
+        raise ValueError('args 应为筛选参数对象')
+    return {'dataset': dataset, 'format': fmt, 'args': {str(k): str(v) for k, v in args.items()}}, None
+
+
+def _run_export(context):
+    params = context.params
+    rows = 0
+
+    def on_rows(count):
+        nonlocal rows
+        rows += count
+        context.progress(rows, message=f'已导出 {rows} 行')
+
+    mimetype, filename, stream = export_stream(params['dataset'], params['format'], params['args'],
+                                               on_rows=on_rows)
+    path = context.result_path(filename)
+    with open(path, 'wb') as output:
+        for data in stream:
+            output.write(data)
+    context.progress(rows, rows, f'已导出 {rows} 行')
+    return {'filename': filename, 'mimetype': mimetype, 'rows': rows, 'size': os.path.getsize(path)}
+
+
+def _rebuild_params(params):
+    return {'verify_only': bool(params.get('verify_only'))}, None
+
+
+def _run_rebuild(context):
+    verify_only = context.params['verify_only']
+    context.progress(0, 2, '重建合同合计')
+    contract_drift = rebuild_contract_totals(verify_only=verify_only)
+    context.progress(1, 2, '重建合同月度合计')
+    monthly_drift = rebuild_monthly_totals(verify_only=verify_only)
+    context.progress(2, 2)
+    if not verify_only and (contract_drift or monthly_drift):
+        response_cache.invalidate(*contract_tags(
+            {item['ContractID'] for item in contract_drift} | {item['ContractID'] for item in monthly_drift}))
+    return {
+        'verify_only': verify_only,
+        'contract_totals': {'drift': len(contract_drift), 'items': contract_drift[:MAX_DRIFT_ITEMS]},
+        'monthly_totals': {'drift': len(monthly_drift), 'items': monthly_drift[:MAX_DRIFT_ITEMS]},
+    }
+
+
+def _import_params(params):
+    ledger = params.get('ledger')
+    if ledger not in LEDGERS:
+        raise ValueError(f'不支持的导入类型: {ledger}')
+    records = params.get('records')
+    if not isinstance(records, list):
+        raise ValueError('records 应为记录数组')
+    contract_id = params.get('contract_id')
+    if contract_id in (None, ''):
+        contract_id = None
+    else:
+        try:
+            contract_id = int(contract_id)
+        except (TypeError, ValueError):
+            raise ValueError('contract_id 必须是整数')
+    # 记录本身不写入任务表（可能有几万行），只在内存中交给任务线程
+    return {'ledger': ledger, 'rows': len(records), 'contract_id': contract_id,
+            'skip_invalid': bool(params.get('skip_invalid'))}, records
+
+
+def _run_import(context):
+    params = context.params
+    result = import_records(params['ledger'], context.payload, params['contract_id'], params['skip_invalid'],
+                            progress=context.progress)
+    if result['errors'] and not result['inserted'] and not params['skip_invalid']:
+        raise JobFailed('数据校验失败，未导入任何记录', result)
+    invalidate_import_caches(params['ledger'], result)
+    return dict(result, message=f"成功导入 {result['inserted']} 条记录")
+
+
+def _archive_params(params):
+    through_year = params.get('through_year')
+    return {'through_year': None if through_year in (None, '') else parse_fiscal_year(through_year, 'through_year'),
+            'dry_run': bool(params.get('dry_run'))}, None
+
+
+def _run_archive(context):
+    return archive_closed_contracts(context.params['through_year'], context.params['dry_run'],
+                                    progress=context.progress)
+
+
+def _restore_params(params):
+    if params.get('fiscal_year') not in (None, ''):
+        return {'fiscal_year': parse_fiscal_year(params['fiscal_year'])}, None
+    if params.get('ids') is not None:
+        try:
+            ids = sorted({int(contract_id) for contract_id in params['ids']})
+        except (TypeError, ValueError):
+            raise ValueError('ids 必须是合同ID列表')
+        return {'ids': ids}, None
+    raise ValueError('请指定 fiscal_year 或 ids')
+
+
+def _run_restore(context):
+    contract_ids = archived_contract_ids(context.params.get('fiscal_year'), context.params.get('ids'))
+    if not contract_ids:
+        raise ValueError('没有符合条件的归档合同')
+    return restore_contracts(contract_ids, progress=context.progress)
+
+
+# 任务类型 -> (参数校验, 执行函数)
+JOB_TYPES = {
+    'allocate_fixed_costs': (_allocation_params, _run_allocation),
+    'export': (_export_params, _run_export),
+    'rebuild_totals': (_rebuild_params, _run_rebuild),
+    'import': (_import_params, _run_import),
+    'archive_contracts': (_archive_params, _run_archive),
+    'restore_contracts': (_restore_params, _run_restore),
+}
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import zipfile
+from datetime import date, datetime
+from decimal import InvalidOperation
+from sqlalchemy import insert
+from app import db
+from app.models import Contract, Payment, Invoice, Cost
+from app.cache import response_cache, contract_tags
+from app.changes import max_id, record_changes_where
+from app.rollups import apply_contract_deltas, apply_monthly_deltas, month_of, to_amount
+from app.utils import chunked
+
+MAX_IMPORT_ROWS = 50000
+
+# 流水类型 -> (模型, 日期字段, 类型字段, 合计字段, 必填字段, 其他文本字段)
+LEDGERS = {
+    'payments': (Payment, 'PaymentDate', 'PaymentType', 'TotalPayments', ('PaymentDate',), ()),
+    'invoices': (Invoice, 'InvoiceDate', 'InvoiceType', 'TotalInvoices', ('InvoiceDate',), ()),
+    'costs': (Cost, 'CostDate', 'CostType', 'TotalCosts', ('CostType',), ('Description',)),
+}
+
+# 上传文件的列名：兼容导出文件的中文表头
+COLUMN_ALIASES = {
+    '合同ID': 'ContractID',
+    '合同编号': 'ContractNumber',
+    '金额': 'Amount',
+    '付款日期': 'PaymentDate',
+    '付款类型': 'PaymentType',
+    '开票日期': 'InvoiceDate',
+    '发票类型': 'InvoiceType',
+    '成本日期': 'CostDate',
+    '成本类型': 'CostType',
+    '描述': 'Description',
+}
+
+_STRING_LIMITS = {'PaymentType': 50, 'InvoiceType': 50, 'CostType': 100, 'Description': 500}
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip()) or value != value  # NaN
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in ('%Y-%m-%d', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f'日期格式应为 YYYY-MM-DD: {text}')
+
+
+def _parse_int(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return int(str(value).strip())
+
+
+# ---------- 读取上传文件 ----------
+
+def _normalize_record(record):
+    return {COLUMN_ALIASES.get(str(key).strip(), str(key).strip()): value
+            for key, value in record.items() if key is not None}
+
+
+def read_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return [_normalize_record(record) for record in csv.DictReader(text)]
+
+
+def read_xlsx(stream):
+    try:
+        import pandas as pd
+        frame = pd.read_excel(stream, dtype=object)
+    except ImportError:
+        raise ValueError('读取 XLSX 文件需要安装 openpyxl')
+    except zipfile.BadZipFile:
+        raise ValueError('XLSX 文件已损坏')
+    return [_normalize_record(record) for record in frame.to_dict('records')]
+
+
+def read_upload(file_storage):
+    """按扩展名读取上传的 CSV/XLSX 文件，返回记录列表"""
+    name = (file_storage.filename or '').lower()
+    if name.endswith('.csv'):
+        return read_csv(file_storage.stream)
+    if name.endswith('.xlsx'):
+        return read_xlsx(file_storage.stream)
+    raise ValueError('只支持 .csv 或 .xlsx 文件')
+
+
+# ---------- 校验与写入 ----------
+
+def _resolve_contracts(records, default_contract_id):
+    """一次性查出批次中引用的合同，返回 (存在的合同ID集合, 合同编号 -> 合同ID)"""
+    ids, numbers = set(), set()
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        if not _blank(record.get('ContractID')):
+            try:
+                ids.add(_parse_int(record['ContractID']))
+            except ValueError:
+                pass
+        elif not _blank(record.get('ContractNumber')):
+            numbers.add(str(record['ContractNumber']).strip())
+    if default_contract_id is not None:
+        ids.add(default_contract_id)
+
+    existing = set()
+    for chunk in chunked(ids):
+        existing.update(contract_id for contract_id, in
+                        db.session.query(Contract.ContractID).filter(Contract.ContractID.in_(chunk)))
+    by_number = {}
+    for chunk in chunked(numbers):
+        by_number.update(db.session.query(Contract.ContractNumber, Contract.ContractID)
+                         .filter(Contract.ContractNumber.in_(chunk)))
+    return existing, by_number
+
+
+def validate_records(ledger, records, default_contract_id=None):
+    """校验整批记录，返回 (可写入的行, 错误列表)
+
+    每条错误为 {'row': 行号（从1开始）, 'errors': [说明, ...]}。合同可用 ContractID 或 ContractNumber 指定，
+    都没有时使用 default_contract_id。
+    """
+    model, date_field, type_field, _, required, text_fields = LEDGERS[ledger]
+    if len(records) > MAX_IMPORT_ROWS:
+        raise ValueError(f'单次最多导入 {MAX_IMPORT_ROWS} 行')
+    existing, by_number = _resolve_contracts(records, default_contract_id)
+
+    rows, errors = [], []
+    for index, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            errors.append({'row': index, 'errors': ['记录必须是对象']})
+            continue
+        row, problems = {}, []
+
+        if not _blank(record.get('ContractID')):
+            try:
+                contract_id = _parse_int(record['ContractID'])
+            except ValueError:
+                contract_id = None
+                problems.append('ContractID 必须是整数')
+            else:
+                if contract_id not in existing:
+                    problems.append(f'合同不存在: {contract_id}')
+        elif not _blank(record.get('ContractNumber')):
+            number = str(record['ContractNumber']).strip()
+            contract_id = by_number.get(number)
+            if contract_id is None:
+                problems.append(f'合同编号不存在: {number}')
+        elif default_contract_id is not None:
+            contract_id = default_contract_id
+            if contract_id not in existing:
+                problems.append(f'合同不存在: {contract_id}')
+        else:
+            contract_id = None
+            problems.append('缺少 ContractID 或 ContractNumber')
+        row['ContractID'] = contract_id
+
+        try:
+            if _blank(record.get('Amount')):
+                raise InvalidOperation
+            amount = to_amount(record['Amount'])
+            if not amount.is_finite() or abs(amount) >= 10 ** 16:
+                raise InvalidOperation
+            row['Amount'] = amount
+        except (InvalidOperation, ValueError):
+            problems.append('Amount 必须是有效金额')
+
+        for field in required:
+            if _blank(record.get(field)):
+                problems.append(f'缺少 {field}')
+
+        if not _blank(record.get(date_field)):
+            try:
+                row[date_field] = _parse_date(record[date_field])
+            except ValueError as e:
+                problems.append(f'{date_field} {e}')
+        else:
+            row[date_field] = None
+
+        for field in (type_field,) + text_fields:
+            value = None if _blank(record.get(field)) else str(record[field]).strip()
+            if value is not None and len(value) > _STRING_LIMITS[field]:
+                problems.append(f'{field} 超过 {_STRING_LIMITS[field]} 个字符')
+            row[field] = value
+
+        if problems:
+            errors.append({'row': index, 'errors': problems})
+        else:
+            rows.append(row)
+    return rows, errors
+
+
+def import_records(ledger, records, default_contract_id=None, skip_invalid=False, progress=None):
+    """校验并批量写入一批流水，合同合计在同一事务中只更新一次
+
+    有错误且 skip_invalid 为 False 时整批不写入。返回
+    {'inserted', 'errors', 'contracts'}，contracts 为各合同本批新增的金额合计。
+    progress(已写入行数, 总行数) 在每块写入后调用；其中抛出的异常会回滚整批。
+    """
+    if ledger not in LEDGERS:
+        raise ValueError(f'不支持的导入类型: {ledger}')
+    model, date_field, _, total_field, _, _ = LEDGERS[ledger]
+    rows, errors = validate_records(ledger, records, default_contract_id)
+    if errors and not skip_invalid:
+        return {'inserted': 0, 'errors': errors, 'contracts': {}}
+
+    now = datetime.utcnow()
+    deltas, monthly_deltas = {}, {}
+    for row in rows:
+        row['CreatedDate'] = now
+        deltas.setdefault(row['ContractID'], {total_field: 0})[total_field] += row['Amount']
+        month_key = (row['ContractID'], month_of(row.get(date_field)))
+        monthly_deltas.setdefault(month_key, {total_field: 0})[total_field] += row['Amount']
+
+    try:
+        # 批量插入不返回主键：插入前记下最大主键，插入后为更大的主键记录变更（并发插入的行一并记录，不影响同步结果）
+        last_id = max_id(model)
+        done = 0
+        for chunk in chunked(rows):
+            db.session.execute(insert(model), chunk)
+            done += len(chunk)
+            if progress:
+                progress(done, len(rows))
+        if rows:
+            record_changes_where(model, model.__table__.primary_key.columns.values()[0] > last_id)
+        apply_contract_deltas(deltas)
+        apply_monthly_deltas(monthly_deltas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        'inserted': len(rows),
+        'errors': errors,
+        'contracts': {contract_id: float(fields[total_field]) for contract_id, fields in deltas.items()},
+    }
+
+
+def invalidate_import_caches(ledger, result):
+    """导入提交后使相关的缓存失效：成本只影响合同列表，付款/发票还影响所属客户/供应商的合同接口"""
+    if ledger == 'costs':
+        response_cache.invalidate('contracts')
+    elif result['contracts']:
+        response_cache.invalidate(*contract_tags(result['contracts']))
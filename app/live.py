@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""写操作的增量推送
+
+写接口提交后返回一条"变更"，页面据此就地更新表格，不再整页刷新：
+  {'entity': 'payment'/'invoice'/'cost'/'contract'/'client'/'reconciliation',
+   'action': 'created'/'updated'/'deleted', 'id': 主键,
+   'row': 变更后的行（删除时为 None）, 'previous': 变更前的行（页面需要旧值时才提供）,
+   'html': 按 templates/_rows.html 渲染的表格行, 以及各实体附带的合计：
+   'contract'/'contract_html'（合同列表的一行）、'clients'（客户欠款/欠票汇总）、'supplier'（对账最终余额）}
+同一条变更通过 GET /api/events（server-sent events）推送给其他打开的页面。
+
+推送通道默认在进程内；配置了 CACHE_REDIS_URL 时经 Redis 发布/订阅转发，多进程部署时各进程的页面都能收到。
+每个 SSE 连接占用一个工作线程，连接数上限由 LIVE_MAX_STREAMS 控制，超过时返回 503，页面照常工作，只是收不到其他页面的变更。
+"""
+import itertools
+import json
+import queue
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from flask import get_template_attribute, request
+from app.loaders import contract_loader
+from app.models import Contract
+from app.summary import summarize_contracts, client_summaries, INDEX_FIELDS
+
+DEFAULT_MAX_STREAMS = 4
+DEFAULT_HEARTBEAT = 15
+QUEUE_SIZE = 256
+RETRY_MS = 3000
+REDIS_CHANNEL = 'contract-live:changes'
+
+# 合同列表一行的字段，另加 ClientID 供客户页面定位
+CONTRACT_CHANGE_FIELDS = INDEX_FIELDS + ('ClientID',)
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'无法序列化 {type(value).__name__}')
+
+
+class _Subscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.closed = False
+
+
+class RedisRelay:
+    """经 Redis 发布/订阅转发变更；每个进程一个订阅线程，收到后分发给本进程的连接"""
+
+    def __init__(self, url, dispatch):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._dispatch = dispatch
+        self._thread = None
+
+    def publish(self, message):
+        self._client.publish(REDIS_CHANNEL, message)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(REDIS_CHANNEL)
+
+        def listen():
+            for item in pubsub.listen():
+                self._dispatch(item['data'].decode('utf-8'))
+
+        self._thread = threading.Thread(target=listen, name='live-relay', daemon=True)
+        self._thread.start()
+
+
+class EventBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self.relay = None
+        self.enabled = True
+        self.max_streams = DEFAULT_MAX_STREAMS
+        self.heartbeat = DEFAULT_HEARTBEAT
+
+    def init_app(self, app):
+        self.enabled = app.config.get('LIVE_EVENTS_ENABLED', True)
+        self.max_streams = app.config.get('LIVE_MAX_STREAMS', DEFAULT_MAX_STREAMS)
+        self.heartbeat = app.config.get('LIVE_HEARTBEAT', DEFAULT_HEARTBEAT)
+        redis_url = app.config.get('CACHE_REDIS_URL')
+        if self.enabled and redis_url:
+            try:
+                self.relay = RedisRelay(redis_url, self._dispatch)
+                self.relay.start()
+            except ImportError:
+                print("未安装 redis，实时推送只在本进程内转发")
+
+    def publish(self, change):
+        """把变更推送给所有连接（包括其他进程的），没有连接时不做任何事"""
+        if not self.enabled:
+            return
+        message = json.dumps(change, ensure_ascii=False, default=_json_default)
+        if self.relay is not None:
+            self.relay.publish(message)
+        else:
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        with self._lock:
+            if not self._subscribers:
+                return
+            # 每条变更只格式化一次，所有连接共用
+            event = f"id: {next(self._ids)}\nevent: change\ndata: {message}\n\n"
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.queue.put_nowait(event)
+                except queue.Full:
+                    # 长时间读不走的连接直接断开，浏览器重连后重新开始接收
+                    subscriber.closed = True
+                    self._subscribers.discard(subscriber)
+
+    def subscribe(self):
+        """新建一个连接，超过连接数上限时返回 None"""
+        with self._lock:
+            if not self.enabled or len(self._subscribers) >= self.max_streams:
+                return None
+            subscriber = _Subscriber()
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscriber.closed = True
+            self._subscribers.discard(subscriber)
+
+    def stream(self, subscriber):
+        """SSE 响应体：变更事件，空闲时定期发送注释行保活（也借此发现已断开的连接）"""
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while not subscriber.closed:
+                try:
+                    yield subscriber.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+event_broker = EventBroker()
+
+
+# ---------- 变更内容 ----------
+
+def record_row(record):
+    """模型对象的全部字段（金额转为浮点数、日期转为字符串）"""
+    row = {}
+    for column in record.__table__.columns:
+        value = getattr(record, column.name)
+        row[column.name] = _json_default(value) if isinstance(value, (Decimal, date, datetime)) else value
+    return row
+
+
+def render_row(macro, *args):
+    return str(get_template_attribute('_rows.html', macro)(*args))
+
+
+def contract_snapshot(contract_id):
+    """合同列表中的一行及其 HTML，合同不存在时返回 (None, None)"""
+    rows = summarize_contracts(CONTRACT_CHANGE_FIELDS, Contract.ContractID == contract_id,
+                               options=contract_loader('list'))
+    if not rows:
+        return None, None
+    return rows[0], render_row('contract_row', rows[0])
+
+
+def client_snapshots(*client_ids):
+    """客户欠款/欠票汇总 {ClientID: 汇总}，一条分组查询"""
+    client_ids = sorted({client_id for client_id in client_ids if client_id is not None})
+    return client_summaries(client_ids) if client_ids else {}
+
+
+def ledger_change(entity, action, record, previous=None):
+    """付款/发票/成本的变更，附带所属合同在合同列表中的一行；付款/发票另附客户汇总（成本不影响欠款/欠票）"""
+    contract, contract_html = contract_snapshot(record.ContractID) if record.ContractID else (None, None)
+    clients = client_snapshots(contract['ClientID']) if contract and entity != 'cost' else {}
+    deleted = action == 'deleted'
+    return publish_change(entity, action, getattr(record, f'{entity.capitalize()}ID'),
+                          row=None if deleted else record_row(record),
+                          previous=previous,
+                          html=None if deleted else render_row(f'{entity}_row', record),
+                          contract=contract, contract_html=contract_html, clients=clients)
+
+
+def publish_change(entity, action, entity_id, row=None, previous=None, html=None, **extra):
+    """组装变更并推送；返回的变更同时作为写接口的响应内容
+
+    请求头 X-Client-ID 原样放在 origin 中，发起写操作的页面据此忽略自己的推送。
+    """
+    change = dict(extra, entity=entity, action=action, id=entity_id,
+                  row=row, previous=previous, html=html,
+                  origin=request.headers.get('X-Client-ID'))
+    event_broker.publish(change)
+    return change
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""合同查询的关系加载方案
+
+Contract.suppliers / Contract.client 默认都是按需懒加载，由各路由按用途选择加载方案：
+  list    列表页/列表接口，要显示供应商和客户名称：和合同一起 joinedload，一页只需一条查询
+          （实测比 selectinload 多发一条查询更快）
+  detail  单个合同的修改/删除，要根据关联供应商计算缓存标签：只用 selectinload 载入供应商
+  ledger  付款/发票/成本页面、客户/供应商合同明细等只用到合同自身字段：不载入任何关系
+"""
+from sqlalchemy.orm import joinedload, selectinload
+from app.models import Contract
+
+CONTRACT_LOADERS = {
+    'list': (joinedload(Contract.suppliers), joinedload(Contract.client)),
+    'detail': (selectinload(Contract.suppliers),),
+    'ledger': (),
+}
+
+
+def contract_loader(profile):
+    """加载方案对应的查询选项，未知的方案名直接报错，避免拼错后悄悄退回懒加载"""
+    return CONTRACT_LOADERS[profile]
+
+
+def contract_query(profile):
+    """按加载方案构造的 Contract 查询"""
+    return Contract.query.options(*contract_loader(profile))
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""请求级别的性能统计
+
+通过 SQLAlchemy 引擎事件和 Flask 请求钩子记录每个请求的查询次数、数据库耗时、
+JSON 序列化耗时和模板渲染耗时，按端点汇总成直方图，由 /metrics 接口（登录用户或持 METRICS_TOKEN 的监控系统）输出。
+超过 SLOW_QUERY_MS 的语句连同参数写入慢查询日志；GET 请求的查询次数超过 QUERY_BUDGETS 中
+该端点的预算时记录警告，QUERY_BUDGET_STRICT 为 True（测试环境）时直接抛出异常。
+"""
+import hmac
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request, session, jsonify, abort, before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from app import db
+
+# 直方图分桶上限：耗时（毫秒）和查询次数，最后一桶为无穷大
+TIME_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, float('inf'))
+
+_PARAMS_LIMIT = 500
+
+slow_query_logger = logging.getLogger('app.slow_query')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """请求的查询次数超过预算"""
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for index, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[index] += 1
+                break
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        return {
+            'count': self.total,
+            'sum': round(self.sum, 3),
+            'avg': round(self.sum / self.total, 3) if self.total else 0,
+            'max': round(self.max, 3),
+            'buckets': [['+Inf' if upper == float('inf') else upper, count]
+                        for upper, count in zip(self.buckets, self.counts)],
+        }
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.budget_exceeded = 0
+        self.total_ms = Histogram(TIME_BUCKETS_MS)
+        self.db_ms = Histogram(TIME_BUCKETS_MS)
+        self.serialize_ms = Histogram(TIME_BUCKETS_MS)
+        self.render_ms = Histogram(TIME_BUCKETS_MS)
+        self.queries = Histogram(QUERY_BUCKETS)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'budget_exceeded': self.budget_exceeded,
+            'total_ms': self.total_ms.to_dict(),
+            'db_ms': self.db_ms.to_dict(),
+            'serialize_ms': self.serialize_ms.to_dict(),
+            'render_ms': self.render_ms.to_dict(),
+            'queries': self.queries.to_dict(),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, stats, status_code, budget_exceeded):
+        with self._lock:
+            metrics = self._endpoints.setdefault(endpoint, EndpointMetrics())
+            metrics.requests += 1
+            metrics.errors += status_code >= 500
+            metrics.budget_exceeded += budget_exceeded
+            metrics.total_ms.observe(stats['total_ms'])
+            metrics.db_ms.observe(stats['db_ms'])
+            metrics.serialize_ms.observe(stats['serialize_ms'])
+            metrics.render_ms.observe(stats['render_ms'])
+            metrics.queries.observe(stats['queries'])
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: metrics.to_dict() for endpoint, metrics in sorted(self._endpoints.items())}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _request_stats():
+    """当前请求的统计（不在请求中时返回 None）"""
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """在默认 JSON 序列化外计时，jsonify 的耗时计入 serialize_ms"""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            stats = _request_stats()
+            if stats is not None:
+                stats['serialize_ms'] += (time.perf_counter() - start) * 1000
+
+
+def _format_params(parameters):
+    text = repr(parameters)
+    return text if len(text) <= _PARAMS_LIMIT else text[:_PARAMS_LIMIT] + '...'
+
+
+def _install_engine_events(engine, slow_query_ms):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+        stats = _request_stats()
+        if stats is not None:
+            stats['queries'] += 1
+            stats['db_ms'] += elapsed_ms
+        if slow_query_ms is not None and elapsed_ms >= slow_query_ms:
+            endpoint = request.endpoint if has_request_context() else '-'
+            slow_query_logger.warning("慢查询 %.1fms [%s]\n%s\n参数: %s",
+                                      elapsed_ms, endpoint, statement, _format_params(parameters))
+
+
+def init_metrics(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    app.json = TimedJSONProvider(app)
+    budgets = app.config.get('QUERY_BUDGETS', {})
+    strict = app.config.get('QUERY_BUDGET_STRICT', False)
+
+    if app.config.get('SLOW_QUERY_LOG'):
+        handler = logging.FileHandler(app.config['SLOW_QUERY_LOG'], encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_logger.addHandler(handler)
+    slow_query_logger.setLevel(logging.WARNING)
+
+    with app.app_context():
+        _install_engine_events(db.engine, app.config.get('SLOW_QUERY_MS', 200))
+
+    def _before_render(sender, template, context, **extra):
+        stats = _request_stats()
+        if stats is not None:
+            stats['render_started'] = time.perf_counter()
+
+    def _rendered(sender, template, context, **extra):
+        stats = _request_stats()
+        if stats is not None and stats.get('render_started') is not None:
+            stats['render_ms'] += (time.perf_counter() - stats.pop('render_started')) * 1000
+
+    before_render_template.connect(_before_render, app, weak=False)
+    template_rendered.connect(_rendered, app, weak=False)
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = {
+            'started': time.perf_counter(),
+            'queries': 0,
+            'db_ms': 0.0,
+            'serialize_ms': 0.0,
+            'render_ms': 0.0,
+        }
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = g.pop('request_stats', None)
+        if stats is None or request.endpoint in (None, 'static', 'metrics'):
+            return response
+        stats['total_ms'] = (time.perf_counter() - stats['started']) * 1000
+
+        budget = budgets.get(request.endpoint) if request.method == 'GET' else None
+        exceeded = budget is not None and stats['queries'] > budget
+        registry.record(request.endpoint, stats, response.status_code, exceeded)
+
+        response.headers['X-Query-Count'] = str(stats['queries'])
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name};dur={stats[key]:.1f}"
+            for name, key in (('db', 'db_ms'), ('serialize', 'serialize_ms'),
+                              ('render', 'render_ms'), ('total', 'total_ms'))
+        )
+        if exceeded:
+            message = f"{request.endpoint} 执行了 {stats['queries']} 条查询，超过预算 {budget}"
+            if strict:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
+
+    def _authorized():
+        # 不按来源地址判断：经 waitress/反向代理转发后所有请求都来自本机
+        if session.get('logged_in'):
+            return True
+        token = app.config.get('METRICS_TOKEN')
+        if not token:
+            return False
+        scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(value.strip().encode(), token.encode())
+
+    # 汇总指标：GET /metrics，?reset=1 读取后清零；登录用户可以访问，监控系统用 METRICS_TOKEN 免登录读取
+    @app.route('/metrics')
+    def metrics():
+        if not _authorized():
+            abort(404)
+        snapshot = registry.snapshot()
+        if request.args.get('reset') == '1':
+            registry.reset()
+        return jsonify({
+            'endpoints': snapshot,
+            'query_budgets': budgets,
+            'slow_query_ms': app.config.get('SLOW_QUERY_MS', 200),
+        })
+
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """测试和基准脚本使用：代码块内执行的查询超过 limit 条时抛出 QueryBudgetExceeded
+
+        with assert_max_queries(3):
+            client.get('/api/clients/1/contracts')
+    """
+    engine = engine or db.engine
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    if len(statements) > limit:
+        raise QueryBudgetExceeded(f"执行了 {len(statements)} 条查询，超过预算 {limit}:\n" + '\n'.join(statements))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""基础结构：创建最初版本的业务表，并补上早期数据库缺少的 Contracts.CompletionRate 字段
+
+表结构固定为引入迁移之前的模型，不随 app/models.py 变化；之后增加的表、字段和索引
+都由各自的迁移脚本创建，新数据库和早期由 create_all 建立的数据库按同样的步骤升级。
+"""
+from sqlalchemy import MetaData, Table, Column, Integer, String, Numeric, Date, DateTime, ForeignKey
+from app.schema import add_column
+
+metadata = MetaData()
+
+Table('Suppliers', metadata,
+      Column('SupplierID', Integer, primary_key=True),
+      Column('SupplierName', String(255), nullable=False),
+      Column('ContactInfo', String(500)),
+      Column('CreatedDate', DateTime))
+
+Table('Clients', metadata,
+      Column('ClientID', Integer, primary_key=True),
+      Column('ClientName', String(255), nullable=False),
+      Column('ContactInfo', String(500)),
+      Column('CreatedDate', DateTime))
+
+Table('Contracts', metadata,
+      Column('ContractID', Integer, primary_key=True),
+      Column('ProjectName', String(255), nullable=False),
+      Column('ContractNumber', String(100), unique=True, nullable=False),
+      Column('TotalAmount', Numeric(18, 2), nullable=False),
+      Column('ClientID', Integer, ForeignKey('Clients.ClientID')),
+      Column('SignDate', Date),
+      Column('CompletionRate', Numeric(5, 2)),
+      Column('CreatedDate', DateTime))
+
+Table('contract_supplier', metadata,
+      Column('contract_id', Integer, ForeignKey('Contracts.ContractID'), primary_key=True),
+      Column('supplier_id', Integer, ForeignKey('Suppliers.SupplierID'), primary_key=True))
+
+Table('Payments', metadata,
+      Column('PaymentID', Integer, primary_key=True),
+      Column('ContractID', Integer, ForeignKey('Contracts.ContractID')),
+      Column('PaymentDate', Date, nullable=False),
+      Column('Amount', Numeric(18, 2), nullable=False),
+      Column('PaymentType', String(50)),
+      Column('CreatedDate', DateTime))
+
+Table('Invoices', metadata,
+      Column('InvoiceID', Integer, primary_key=True),
+      Column('ContractID', Integer, ForeignKey('Contracts.ContractID')),
+      Column('InvoiceDate', Date, nullable=False),
+      Column('Amount', Numeric(18, 2), nullable=False),
+      Column('InvoiceType', String(50)),
+      Column('CreatedDate', DateTime))
+
+Table('Costs', metadata,
+      Column('CostID', Integer, primary_key=True),
+      Column('ContractID', Integer, ForeignKey('Contracts.ContractID')),
+      Column('CostType', String(100), nullable=False),
+      Column('Amount', Numeric(18, 2), nullable=False),
+      Column('CostDate', Date),
+      Column('Description', String(500)),
+      Column('CreatedDate', DateTime))
+
+Table('FixedCosts', metadata,
+      Column('FixedCostID', Integer, primary_key=True),
+      Column('CostType', String(100), nullable=False),
+      Column('Amount', Numeric(18, 2), nullable=False),
+      Column('CostDate', Date),
+      Column('Description', String(500)),
+      Column('Month', String(7), nullable=False),
+      Column('CreatedDate', DateTime))
+
+Table('SupplierReconciliations', metadata,
+      Column('ReconciliationID', Integer, primary_key=True),
+      Column('SupplierID', Integer, ForeignKey('Suppliers.SupplierID'), nullable=False),
+      Column('TransactionDate', Date, nullable=False),
+      Column('PaymentAmount', Numeric(18, 2)),
+      Column('InvoiceAmount', Numeric(18, 2)),
+      Column('Description', String(500)),
+      Column('CustomField1', String(100)),
+      Column('CustomField2', String(100)),
+      Column('CustomField3', String(100)),
+      Column('CreatedDate', DateTime))
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
+    add_column(connection, 'Contracts', 'CompletionRate', 'CompletionRate DECIMAL(5,2) DEFAULT 0.00')
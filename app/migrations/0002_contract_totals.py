@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""合同合计汇总表 ContractTotals，并从流水表初始化"""
+from sqlalchemy import insert
+from app.models import ContractTotal
+from app.schema import create_tables
+from app.summary import compute_contract_totals
+from app.utils import chunked
+
+
+def upgrade(connection):
+    create_tables(connection, 'ContractTotals')
+    if connection.execute(ContractTotal.__table__.select().limit(1)).first() is not None:
+        return
+    totals = compute_contract_totals()
+    totals.pop(None, None)  # 未关联合同的流水不计入合计
+    rows = [dict(fields, ContractID=contract_id) for contract_id, fields in totals.items()]
+    for chunk in chunked(rows):
+        connection.execute(insert(ContractTotal), chunk)
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""固定成本分摊批次表 AllocationRuns，以及 Costs.AllocationRunID 字段"""
+from app.schema import create_tables, add_column
+
+
+def upgrade(connection):
+    create_tables(connection, 'AllocationRuns')
+    add_column(connection, 'Costs', 'AllocationRunID',
+               'AllocationRunID INT NULL REFERENCES AllocationRuns(AllocationRunID)')
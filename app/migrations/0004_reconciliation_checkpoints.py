@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""供应商对账月初余额表 ReconciliationCheckpoints，以及对账记录的 (SupplierID, TransactionDate) 索引"""
+from app.schema import create_tables, create_index
+
+
+def upgrade(connection):
+    create_tables(connection, 'ReconciliationCheckpoints')
+    create_index(connection, 'SupplierReconciliations', 'IX_SupplierReconciliations_Supplier_Date')
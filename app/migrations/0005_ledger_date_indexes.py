@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""付款、发票的 (ContractID, 日期) 索引，账龄分析按合同和日期累计金额时使用"""
+from app.schema import create_index
+
+
+def upgrade(connection):
+    create_index(connection, 'Payments', 'IX_Payments_Contract_Date')
+    create_index(connection, 'Invoices', 'IX_Invoices_Contract_Date')
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""合同月度合计表 MonthlyContractTotals，并从流水表初始化"""
+from sqlalchemy import insert
+from app.models import MonthlyContractTotal
+from app.rollups import compute_monthly_totals
+from app.schema import create_tables
+from app.utils import chunked
+
+
+def upgrade(connection):
+    create_tables(connection, 'MonthlyContractTotals')
+    if connection.execute(MonthlyContractTotal.__table__.select().limit(1)).first() is not None:
+        return
+    rows = [dict(fields, ContractID=contract_id, Month=month)
+            for (contract_id, month), fields in compute_monthly_totals().items()]
+    for chunk in chunked(rows):
+        connection.execute(insert(MonthlyContractTotal), chunk)
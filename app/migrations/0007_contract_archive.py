@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""合同归档表：批量归档的合同、合同-供应商关联和付款/发票/成本流水"""
+from app.schema import create_tables
+
+
+def upgrade(connection):
+    create_tables(connection, 'ArchivedContracts', 'ArchivedContractSuppliers',
+                  'ArchivedPayments', 'ArchivedInvoices', 'ArchivedCosts')
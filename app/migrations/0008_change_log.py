@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""变更日志表 ChangeLog，已有数据各记一条 upsert，客户端从 since=0 同步时得到完整数据"""
+from datetime import datetime
+from sqlalchemy import insert, select, literal
+from app.models import ChangeLog
+from app.changes import ENTITIES
+from app.schema import create_tables
+
+
+def upgrade(connection):
+    create_tables(connection, 'ChangeLog')
+    table = ChangeLog.__table__
+    if connection.execute(table.select().limit(1)).first() is not None:
+        return
+    now = datetime.utcnow()
+    for entity, model in ENTITIES.items():
+        key = model.__table__.primary_key.columns.values()[0]
+        connection.execute(
+            insert(table).from_select(
+                ['Entity', 'EntityID', 'Action', 'ChangedDate'],
+                select(literal(entity, table.c.Entity.type), key,
+                       literal('upsert', table.c.Action.type), literal(now, table.c.ChangedDate.type))
+            )
+        )
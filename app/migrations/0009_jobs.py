@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""后台任务表 Jobs"""
+from app.schema import create_tables
+
+
+def upgrade(connection):
+    create_tables(connection, 'Jobs')
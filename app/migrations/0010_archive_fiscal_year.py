@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""ArchivedContracts.FiscalYear：归档合同结清所在的财年，已归档的合同按归档表中的流水补齐"""
+from sqlalchemy import select, update
+from app.models import archived_contracts
+from app.contract_bulk import closing_fiscal_years
+from app.schema import add_column, create_index
+from app.utils import chunked
+
+
+def upgrade(connection):
+    add_column(connection, 'ArchivedContracts', 'FiscalYear', 'FiscalYear INT NULL')
+    table = archived_contracts
+    ids = [contract_id for contract_id, in
+           connection.execute(select(table.c.ContractID).where(table.c.FiscalYear.is_(None)))]
+    by_year = {}
+    for contract_id, year in closing_fiscal_years(ids, archived=True, connection=connection).items():
+        by_year.setdefault(year, []).append(contract_id)
+    for year, year_ids in sorted(by_year.items()):
+        for chunk in chunked(year_ids):
+            connection.execute(update(table).where(table.c.ContractID.in_(chunk)).values(FiscalYear=year))
+    create_index(connection, 'ArchivedContracts', 'IX_ArchivedContracts_FiscalYear')
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""Suppliers.ReconciliationVersion：对账记录的版本号，防止并发写入时保存按旧数据算出的月初余额快照"""
+from app.schema import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'Suppliers', 'ReconciliationVersion',
+               'ReconciliationVersion INT NOT NULL DEFAULT 0')
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""归档合同的月度合计表 ArchivedMonthlyContractTotals，已归档的合同按归档表中的流水补齐"""
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import select, insert, func, extract
+from app.models import archived_monthly_totals, archived_payments, archived_invoices, archived_costs
+from app.rollups import TOTAL_FIELDS
+from app.schema import create_tables
+from app.utils import chunked
+
+# 归档流水表 -> (日期列名, 合计字段)
+_LEDGERS = (
+    (archived_payments, 'PaymentDate', 'TotalPayments'),
+    (archived_invoices, 'InvoiceDate', 'TotalInvoices'),
+    (archived_costs, 'CostDate', 'TotalCosts'),
+)
+
+
+def upgrade(connection):
+    create_tables(connection, 'ArchivedMonthlyContractTotals')
+    archived = {contract_id for contract_id, in
+                connection.execute(select(archived_monthly_totals.c.ContractID).distinct())}
+    totals = {}
+    for table, date_name, field in _LEDGERS:
+        day = table.c[date_name]
+        year, month = extract('year', day), extract('month', day)
+        rows = connection.execute(
+            select(table.c.ContractID, year, month, func.sum(table.c.Amount))
+            .where(table.c.ContractID.isnot(None), day.isnot(None))
+            .group_by(table.c.ContractID, year, month))
+        for contract_id, year_value, month_value, amount in rows:
+            if contract_id in archived:
+                continue
+            key = (contract_id, f'{int(year_value):04d}-{int(month_value):02d}')
+            totals.setdefault(key, {f: Decimal(0) for f in TOTAL_FIELDS})[field] = amount or 0
+
+    now = datetime.utcnow()
+    rows = [dict(values, ContractID=contract_id, Month=month, UpdatedDate=now, ArchivedDate=now)
+            for (contract_id, month), values in sorted(totals.items())]
+    for chunk in chunked(rows):
+        connection.execute(insert(archived_monthly_totals), chunk)
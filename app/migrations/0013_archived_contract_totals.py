@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""归档合同的合计表 ArchivedContractTotals，已归档的合同按归档表中的流水补齐"""
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import select, insert, func
+from app.models import archived_contracts, archived_contract_totals, archived_payments, archived_invoices, archived_costs
+from app.rollups import TOTAL_FIELDS
+from app.schema import create_tables
+from app.utils import chunked
+
+# 归档流水表 -> 合计字段
+_LEDGERS = (
+    (archived_payments, 'TotalPayments'),
+    (archived_invoices, 'TotalInvoices'),
+    (archived_costs, 'TotalCosts'),
+)
+
+
+def upgrade(connection):
+    create_tables(connection, 'ArchivedContractTotals')
+    existing = {contract_id for contract_id, in connection.execute(select(archived_contract_totals.c.ContractID))}
+    totals = {contract_id: {field: Decimal(0) for field in TOTAL_FIELDS}
+              for contract_id, in connection.execute(select(archived_contracts.c.ContractID))
+              if contract_id not in existing}
+    for table, field in _LEDGERS:
+        for contract_id, amount in connection.execute(
+                select(table.c.ContractID, func.sum(table.c.Amount))
+                .where(table.c.ContractID.isnot(None))
+                .group_by(table.c.ContractID)):
+            if contract_id in totals:
+                totals[contract_id][field] = amount or 0
+
+    now = datetime.utcnow()
+    rows = [dict(values, ContractID=contract_id, UpdatedDate=now, ArchivedDate=now)
+            for contract_id, values in sorted(totals.items())]
+    for chunk in chunked(rows):
+        connection.execute(insert(archived_contract_totals), chunk)
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""正在写变更日志的事务登记表 ChangeLogWriters，增量同步据此判断版本号缺口是否可能尚未提交"""
+from app.schema import create_tables
+
+
+def upgrade(connection):
+    create_tables(connection, 'ChangeLogWriters')
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+# 按版本号排序执行的数据库迁移脚本，由 app/schema.py 加载
@@ -14,6 +14,8 @@ class Supplier(db.Model):
     SupplierName = db.Column(db.String(255), nullable=False)
     ContactInfo = db.Column(db.String(500))
     CreatedDate = db.Column(db.DateTime, default=datetime.utcnow)
+    # 对账记录每次变动加一，补齐月初余额快照时据此判断读取期间有没有写操作，见 app/reconciliation.py
+    ReconciliationVersion = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     def __repr__(self):
         return f'<Supplier {self.SupplierName}>'
@@ -39,8 +41,8 @@ class Contract(db.Model):
     CompletionRate = db.Column(db.Numeric(5,2), default=0.00)  # 新增完工率字段，百分比格式
     CreatedDate = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # 多对多关系：一个合同对应多个供应商
-    suppliers = db.relationship('Supplier', secondary=contract_supplier, lazy='subquery',
+    # 多对多关系：一个合同对应多个供应商（按需加载，批量加载方案见 app/loaders.py）
+    suppliers = db.relationship('Supplier', secondary=contract_supplier, lazy='select',
         backref=db.backref('contracts', lazy=True))
     # 与客户的一对多关系
     client = db.relationship('Client', backref='contracts')
@@ -63,6 +65,10 @@ class Contract(db.Model):
 
 class Payment(db.Model):
     __tablename__ = 'Payments'
+    __table_args__ = (
+        # 按合同、日期顺序读取付款（账龄先进先出），Amount 作为包含列，不用回表
+        db.Index('IX_Payments_Contract_Date', 'ContractID', 'PaymentDate', mssql_include=['Amount']),
+    )
     PaymentID = db.Column(db.Integer, primary_key=True)
     ContractID = db.Column(db.Integer, db.ForeignKey('Contracts.ContractID'))  # 关联Contracts表
     PaymentDate = db.Column(db.Date, nullable=False)
@@ -75,6 +81,9 @@ class Payment(db.Model):
 
 class Invoice(db.Model):
     __tablename__ = 'Invoices'
+    __table_args__ = (
+        db.Index('IX_Invoices_Contract_Date', 'ContractID', 'InvoiceDate', mssql_include=['Amount']),
+    )
     InvoiceID = db.Column(db.Integer, primary_key=True)
     ContractID = db.Column(db.Integer, db.ForeignKey('Contracts.ContractID'))  # 关联Contracts表
     InvoiceDate = db.Column(db.Date, nullable=False)
@@ -93,11 +102,42 @@ class Cost(db.Model):
     Amount = db.Column(db.Numeric(18,2), nullable=False)
     CostDate = db.Column(db.Date)
     Description = db.Column(db.String(500))
+    AllocationRunID = db.Column(db.Integer, db.ForeignKey('AllocationRuns.AllocationRunID'))  # 由固定成本分摊生成时关联分摊批次
     CreatedDate = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
         return f'<Cost {self.CostID} for Contract {self.ContractID}>'
     
+# 合同合计汇总表：每个合同一行，随付款/发票/成本的增删在同一事务中更新
+class ContractTotal(db.Model):
+    __tablename__ = 'ContractTotals'
+    ContractID = db.Column(db.Integer, db.ForeignKey('Contracts.ContractID'), primary_key=True)
+    TotalPayments = db.Column(db.Numeric(18,2), nullable=False, default=0)
+    TotalInvoices = db.Column(db.Numeric(18,2), nullable=False, default=0)
+    TotalCosts = db.Column(db.Numeric(18,2), nullable=False, default=0)
+    UpdatedDate = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ContractTotal for Contract {self.ContractID}>'
+    
+# 合同月度合计：每个合同每个月一行（月份按付款/发票/成本日期），随流水增删在同一事务中更新，
+# 月度趋势报表只读取这张表，不扫描流水表
+class MonthlyContractTotal(db.Model):
+    __tablename__ = 'MonthlyContractTotals'
+    __table_args__ = (
+        db.Index('IX_MonthlyContractTotals_Month', 'Month', 'ContractID',
+                 mssql_include=['TotalPayments', 'TotalInvoices', 'TotalCosts']),
+    )
+    ContractID = db.Column(db.Integer, db.ForeignKey('Contracts.ContractID'), primary_key=True)
+    Month = db.Column(db.String(7), primary_key=True)  # 月份，格式: YYYY-MM
+    TotalPayments = db.Column(db.Numeric(18,2), nullable=False, default=0)
+    TotalInvoices = db.Column(db.Numeric(18,2), nullable=False, default=0)
+    TotalCosts = db.Column(db.Numeric(18,2), nullable=False, default=0)
+    UpdatedDate = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MonthlyContractTotal {self.ContractID} {self.Month}>'
+    
 # 添加FixedCost模型
 class FixedCost(db.Model):
     __tablename__ = 'FixedCosts'
@@ -112,8 +152,30 @@ class FixedCost(db.Model):
     def __repr__(self):
         return f'<FixedCost {self.CostType} {self.Month}>'
     
+# 固定成本分摊批次：每个月份、每种固定成本类型一条，记录输入和权重快照
+class AllocationRun(db.Model):
+    __tablename__ = 'AllocationRuns'
+    __table_args__ = (db.UniqueConstraint('Month', 'CostType'),)
+    AllocationRunID = db.Column(db.Integer, primary_key=True)
+    Month = db.Column(db.String(7), nullable=False)  # 月份，格式: YYYY-MM
+    CostType = db.Column(db.String(100), nullable=False)  # 固定成本类型，如"工资薪金"
+    TotalFixedCost = db.Column(db.Numeric(18,2), nullable=False)
+    TotalWeight = db.Column(db.Float, nullable=False)
+    Inputs = db.Column(db.Text)  # JSON: 参与分摊的固定成本记录
+    WeightsSnapshot = db.Column(db.Text)  # JSON: {合同ID: 权重}
+    CreatedDate = db.Column(db.DateTime, default=datetime.utcnow)
+    UpdatedDate = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    costs = db.relationship('Cost', backref='allocation_run', lazy=True)
+    
+    def __repr__(self):
+        return f'<AllocationRun {self.CostType} {self.Month}>'
+    
 class SupplierReconciliation(db.Model):
     __tablename__ = 'SupplierReconciliations'
+    __table_args__ = (
+        db.Index('IX_SupplierReconciliations_Supplier_Date', 'SupplierID', 'TransactionDate', 'ReconciliationID'),
+    )
     ReconciliationID = db.Column(db.Integer, primary_key=True)
     SupplierID = db.Column(db.Integer, db.ForeignKey('Suppliers.SupplierID'), nullable=False)
     TransactionDate = db.Column(db.Date, nullable=False)
@@ -132,4 +194,103 @@ class SupplierReconciliation(db.Model):
         return f'<SupplierReconciliation {self.ReconciliationID} for Supplier {self.SupplierID}>'
     
     def get_balance(self, previous_balance=0):
-        return previous_balance + self.PaymentAmount - self.InvoiceAmount
\ No newline at end of file
+        return previous_balance + self.PaymentAmount - self.InvoiceAmount
+    
+# 供应商对账月初余额快照：某供应商在某月第一天之前的累计余额
+class ReconciliationCheckpoint(db.Model):
+    __tablename__ = 'ReconciliationCheckpoints'
+    SupplierID = db.Column(db.Integer, db.ForeignKey('Suppliers.SupplierID'), primary_key=True)
+    Month = db.Column(db.String(7), primary_key=True)  # 月份，格式: YYYY-MM
+    OpeningBalance = db.Column(db.Numeric(18,2), nullable=False)
+    CreatedDate = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReconciliationCheckpoint {self.SupplierID} {self.Month}>'
+    
+# 数据库结构版本：每执行一个迁移脚本记录一行，见 app/schema.py
+class SchemaVersion(db.Model):
+    __tablename__ = 'SchemaVersions'
+    Version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    Name = db.Column(db.String(200), nullable=False)
+    AppliedDate = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaVersion {self.Version} {self.Name}>'
+    
+# 变更日志：业务表每次新增/修改/删除记一行，Version 单调递增，GET /api/changes 据此返回增量，见 app/changes.py
+class ChangeLog(db.Model):
+    __tablename__ = 'ChangeLog'
+    __table_args__ = (
+        db.Index('IX_ChangeLog_Entity', 'Entity', 'EntityID', 'Version'),
+    )
+    Version = db.Column(db.Integer, primary_key=True)
+    Entity = db.Column(db.String(30), nullable=False)  # contract/payment/invoice/cost/fixed_cost/reconciliation/client/supplier
+    EntityID = db.Column(db.Integer, nullable=False)
+    Action = db.Column(db.String(10), nullable=False)  # upsert 或 delete
+    ChangedDate = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChangeLog {self.Version} {self.Action} {self.Entity} {self.EntityID}>'
+
+# 正在写变更日志的事务：写入第一条日志前在独立连接上登记（已提交、其他连接可见），事务结束后删除，
+# FloorVersion 为登记时已分配的最大版本号减一，该事务的版本号都大于它；增量同步据此判断版本号缺口是否可能尚未提交
+class ChangeLogWriter(db.Model):
+    __tablename__ = 'ChangeLogWriters'
+    WriterID = db.Column(db.Integer, primary_key=True)
+    FloorVersion = db.Column(db.Integer, nullable=False)
+    StartedDate = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChangeLogWriter {self.WriterID} > {self.FloorVersion}>'
+
+# 后台任务：分摊、导出、重建汇总表、批量导入在任务线程中执行，见 app/jobs.py
+class Job(db.Model):
+    __tablename__ = 'Jobs'
+    __table_args__ = (
+        db.Index('IX_Jobs_Status', 'Status', 'HeartbeatDate'),
+    )
+    JobID = db.Column(db.Integer, primary_key=True)
+    JobType = db.Column(db.String(50), nullable=False)
+    Status = db.Column(db.String(20), nullable=False, default='queued')  # queued/running/succeeded/failed/cancelled/orphaned
+    Params = db.Column(db.Text)  # JSON: 提交时的参数
+    Progress = db.Column(db.Integer, nullable=False, default=0)
+    Total = db.Column(db.Integer)  # 总量未知时为空
+    Message = db.Column(db.String(500))
+    Result = db.Column(db.Text)  # JSON
+    ResultFile = db.Column(db.String(500))  # 导出任务生成的文件
+    Error = db.Column(db.Text)
+    CancelRequested = db.Column(db.Boolean, nullable=False, default=False)
+    Worker = db.Column(db.String(100))  # 主机名:进程号
+    CreatedDate = db.Column(db.DateTime, default=datetime.utcnow)
+    StartedDate = db.Column(db.DateTime)
+    FinishedDate = db.Column(db.DateTime)
+    HeartbeatDate = db.Column(db.DateTime, default=datetime.utcnow)  # 执行进程定期更新，长时间未更新视为进程已退出
+
+    def __repr__(self):
+        return f'<Job {self.JobID} {self.JobType} {self.Status}>'
+
+# ---------- 归档表：与原表结构相同，主键沿用原值（不自增、无外键），另记归档时间 ----------
+# 批量归档合同时把合同、合同-供应商关联、付款/发票/成本流水、合同合计和月度合计原样搬到这里，见 app/contract_bulk.py；
+# 已结清合同按财年归档/恢复见 app/archive.py，合同的 FiscalYear 为结清所在的财年
+
+def _archive_table(name, source, *extra):
+    columns = [db.Column(column.name, column.type, primary_key=column.primary_key,
+                         autoincrement=False, nullable=column.nullable)
+               for column in source.columns]
+    return db.Table(name, *columns, db.Column('ArchivedDate', db.DateTime, nullable=False),
+                    *extra)
+
+archived_contracts = _archive_table('ArchivedContracts', Contract.__table__,
+                                    db.Column('FiscalYear', db.Integer),
+                                    db.Index('IX_ArchivedContracts_FiscalYear', 'FiscalYear', 'ContractID'))
+archived_contract_suppliers = _archive_table('ArchivedContractSuppliers', contract_supplier)
+archived_payments = _archive_table('ArchivedPayments', Payment.__table__,
+                                   db.Index('IX_ArchivedPayments_ContractID', 'ContractID'))
+archived_invoices = _archive_table('ArchivedInvoices', Invoice.__table__,
+                                   db.Index('IX_ArchivedInvoices_ContractID', 'ContractID'))
+archived_costs = _archive_table('ArchivedCosts', Cost.__table__,
+                                db.Index('IX_ArchivedCosts_ContractID', 'ContractID'))
+# 合计也随合同归档：include_archived 的读取直接使用归档的合同合计；月度趋势同时读取两张月度合计表，历史数据不因归档而改变
+archived_contract_totals = _archive_table('ArchivedContractTotals', ContractTotal.__table__)
+archived_monthly_totals = _archive_table('ArchivedMonthlyContractTotals', MonthlyContractTotal.__table__,
+                                         db.Index('IX_ArchivedMonthlyContractTotals_Month', 'Month', 'ContractID'))
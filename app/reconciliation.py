@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import func, extract, delete, update, and_, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Supplier, SupplierReconciliation, ReconciliationCheckpoint
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# 会话中补齐过快照的供应商 {SupplierID: 补齐前读取的对账记录版本号}，由 save_checkpoints 核对
+_VERSIONS_KEY = 'reconciliation_versions'
+
+_NET = func.coalesce(func.sum(
+    func.coalesce(SupplierReconciliation.PaymentAmount, 0) - func.coalesce(SupplierReconciliation.InvoiceAmount, 0)
+), 0)
+
+
+def _month_of(day):
+    return day.strftime('%Y-%m')
+
+
+def _month_start(month):
+    return datetime.strptime(month + '-01', '%Y-%m-%d').date()
+
+
+def _net_between(supplier_id, start=None, end=None):
+    """某供应商在 [start, end) 日期区间内的 付款-发票 合计"""
+    query = db.session.query(_NET).filter(SupplierReconciliation.SupplierID == supplier_id)
+    if start is not None:
+        query = query.filter(SupplierReconciliation.TransactionDate >= start)
+    if end is not None:
+        query = query.filter(SupplierReconciliation.TransactionDate < end)
+    return Decimal(query.scalar() or 0)
+
+
+def opening_balance_of_month(supplier_id, month):
+    """某月第一天之前的累计余额；缺少快照时从上一个快照开始按月汇总补齐（不提交）"""
+    checkpoint = db.session.get(ReconciliationCheckpoint, (supplier_id, month))
+    if checkpoint is not None:
+        return Decimal(checkpoint.OpeningBalance)
+
+    # 读取任何对账数据之前记下版本号，保存快照时核对
+    versions = db.session.info.setdefault(_VERSIONS_KEY, {})
+    if supplier_id not in versions:
+        versions[supplier_id] = (db.session.query(Supplier.ReconciliationVersion)
+                                 .filter(Supplier.SupplierID == supplier_id).scalar())
+
+    previous = (ReconciliationCheckpoint.query
+                .filter(ReconciliationCheckpoint.SupplierID == supplier_id,
+                        ReconciliationCheckpoint.Month < month)
+                .order_by(ReconciliationCheckpoint.Month.desc())
+                .first())
+    balance = Decimal(previous.OpeningBalance) if previous else Decimal(0)
+
+    year = extract('year', SupplierReconciliation.TransactionDate)
+    month_no = extract('month', SupplierReconciliation.TransactionDate)
+    query = (db.session.query(year, month_no, _NET)
+             .filter(SupplierReconciliation.SupplierID == supplier_id,
+                     SupplierReconciliation.TransactionDate < _month_start(month))
+             .group_by(year, month_no))
+    if previous is not None:
+        query = query.filter(SupplierReconciliation.TransactionDate >= _month_start(previous.Month))
+
+    for y, m, net in sorted((int(y), int(m), net) for y, m, net in query):
+        row_month = f'{y:04d}-{m:02d}'
+        if previous is None or row_month != previous.Month:
+            db.session.add(ReconciliationCheckpoint(SupplierID=supplier_id, Month=row_month, OpeningBalance=balance))
+        balance += Decimal(net or 0)
+
+    db.session.add(ReconciliationCheckpoint(SupplierID=supplier_id, Month=month, OpeningBalance=balance))
+    return balance
+
+
+def balance_before(supplier_id, day):
+    """某日期之前（不含当天）的累计余额：月初快照 + 当月已发生的部分"""
+    month = _month_of(day)
+    return opening_balance_of_month(supplier_id, month) + _net_between(supplier_id, _month_start(month), day)
+
+
+def final_balance(supplier_id):
+    """全部对账记录的最终余额"""
+    last_date = (db.session.query(func.max(SupplierReconciliation.TransactionDate))
+                 .filter(SupplierReconciliation.SupplierID == supplier_id)
+                 .scalar())
+    if last_date is None:
+        return Decimal(0)
+    return balance_before(supplier_id, last_date + timedelta(days=1))
+
+
+def save_checkpoints():
+    """提交查询过程中补齐的月初余额快照
+
+    先锁定供应商行核对版本号：补齐期间有对账记录写入（版本号已变）时放弃这些快照，下次查询重新计算。
+    写入方先加版本号再删除快照，所以核对通过后提交的快照，之后的写入也一定会删除。
+    并发补齐同一快照时忽略主键冲突。
+    """
+    versions = db.session.info.pop(_VERSIONS_KEY, {})
+    try:
+        for supplier_id, version in versions.items():
+            matched = db.session.execute(
+                update(Supplier)
+                .where(Supplier.SupplierID == supplier_id, Supplier.ReconciliationVersion == version)
+                .values(ReconciliationVersion=Supplier.ReconciliationVersion)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not matched:
+                db.session.rollback()
+                return
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+
+
+def invalidate_checkpoints(supplier_id, *days):
+    """对账记录变动后，供应商的对账版本号加一，并删除变动日期所在月份之后的所有快照（不提交）"""
+    days = [day for day in days if day is not None]
+    if not days:
+        return
+    # 先加版本号（锁定供应商行），正在补齐快照的查询提交前核对时会放弃
+    db.session.execute(
+        update(Supplier)
+        .where(Supplier.SupplierID == supplier_id)
+        .values(ReconciliationVersion=Supplier.ReconciliationVersion + 1)
+        .execution_options(synchronize_session=False)
+    )
+    month = _month_of(min(days))
+    db.session.execute(
+        delete(ReconciliationCheckpoint)
+        .where(ReconciliationCheckpoint.SupplierID == supplier_id,
+               ReconciliationCheckpoint.Month > month)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def remove_checkpoints(supplier_id):
+    """删除供应商时清理其全部快照（不提交）"""
+    db.session.execute(
+        delete(ReconciliationCheckpoint)
+        .where(ReconciliationCheckpoint.SupplierID == supplier_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def balance_through(supplier_id, day, reconciliation_id):
+    """截至某条记录（含）的累计余额：该日期之前的余额 + 当天 ID 不大于它的记录"""
+    return balance_before(supplier_id, day) + Decimal(
+        db.session.query(_NET)
+        .filter(SupplierReconciliation.SupplierID == supplier_id,
+                SupplierReconciliation.TransactionDate == day,
+                SupplierReconciliation.ReconciliationID <= reconciliation_id)
+        .scalar() or 0)
+
+
+def serialize_reconciliation(recon, balance):
+    """对账记录及其累计余额，页面和接口共用的行格式"""
+    return {
+        'ReconciliationID': recon.ReconciliationID,
+        'TransactionDate': recon.TransactionDate.strftime('%Y-%m-%d') if recon.TransactionDate else '',
+        'PaymentAmount': float(recon.PaymentAmount),
+        'InvoiceAmount': float(recon.InvoiceAmount),
+        'Balance': float(balance),
+        'Description': recon.Description,
+        'CustomField1': recon.CustomField1,
+        'CustomField2': recon.CustomField2,
+        'CustomField3': recon.CustomField3
+    }
+
+
+def encode_cursor(recon):
+    return f"{recon.TransactionDate.isoformat()}_{recon.ReconciliationID}"
+
+
+def decode_cursor(cursor):
+    try:
+        day, recon_id = cursor.split('_')
+        return datetime.strptime(day, '%Y-%m-%d').date(), int(recon_id)
+    except ValueError:
+        raise ValueError('cursor 无效')
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{name} 日期格式应为 YYYY-MM-DD')
+
+
+def reconciliation_page(supplier_id, args):
+    """按日期区间和游标分页读取对账记录，并给出每行的累计余额
+
+    参数 start_date、end_date、cursor（上一页最后一行）、limit。
+    返回 {'rows', 'opening_balance', 'closing_balance', 'next_cursor'}。
+    """
+    start_date = _parse_date(args['start_date'], 'start_date') if args.get('start_date') else None
+    end_date = _parse_date(args['end_date'], 'end_date') if args.get('end_date') else None
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('limit 必须是整数')
+
+    query = SupplierReconciliation.query.filter(SupplierReconciliation.SupplierID == supplier_id)
+    if start_date:
+        query = query.filter(SupplierReconciliation.TransactionDate >= start_date)
+    if end_date:
+        query = query.filter(SupplierReconciliation.TransactionDate <= end_date)
+
+    if args.get('cursor'):
+        cursor_date, cursor_id = decode_cursor(args['cursor'])
+        query = query.filter(or_(
+            SupplierReconciliation.TransactionDate > cursor_date,
+            and_(SupplierReconciliation.TransactionDate == cursor_date,
+                 SupplierReconciliation.ReconciliationID > cursor_id)
+        ))
+        opening = balance_through(supplier_id, cursor_date, cursor_id)
+    elif start_date:
+        opening = balance_before(supplier_id, start_date)
+    else:
+        opening = Decimal(0)
+
+    reconciliations = (query
+                       .order_by(SupplierReconciliation.TransactionDate, SupplierReconciliation.ReconciliationID)
+                       .limit(limit + 1)
+                       .all())
+    has_more = len(reconciliations) > limit
+    reconciliations = reconciliations[:limit]
+
+    # 计算余额
+    balance = opening
+    rows = []
+    for recon in reconciliations:
+        balance = recon.get_balance(balance)
+        rows.append(serialize_reconciliation(recon, balance))
+
+    return {
+        'rows': rows,
+        'opening_balance': float(opening),
+        'closing_balance': float(balance),
+        'next_cursor': encode_cursor(reconciliations[-1]) if has_more else None
+    }
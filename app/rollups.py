@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import update, delete, insert, select, func, extract, bindparam
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import ContractTotal, MonthlyContractTotal, Payment, Invoice, Cost
+from app.summary import compute_contract_totals
+from app.utils import chunked
+
+TOTAL_FIELDS = ('TotalPayments', 'TotalInvoices', 'TotalCosts')
+
+CENT = Decimal('0.01')
+
+
+def to_amount(value):
+    """把请求中的金额（字符串/浮点数/Decimal）转换为两位小数的 Decimal，与 Numeric(18,2) 一致"""
+    if value is None:
+        return Decimal('0.00')
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def insert_missing(model, rows, apply_row):
+    """插入缺失的合计行（不提交）
+
+    同一合同并发的首次写入会同时走到插入，后提交的一方主键冲突；冲突时回滚到保存点，
+    改为用 apply_row(row) 逐行累加到对方已插入的行上，而不是让整个写请求失败。
+    """
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(model), rows)
+    except IntegrityError:
+        for row in rows:
+            apply_row(row)
+
+
+def apply_contract_delta(contract_id, TotalPayments=0, TotalInvoices=0, TotalCosts=0):
+    """在当前事务中把增量累加到合同合计上，不提交；合计行不存在时自动创建"""
+    if contract_id is None:
+        return
+    deltas = {
+        'TotalPayments': to_amount(TotalPayments),
+        'TotalInvoices': to_amount(TotalInvoices),
+        'TotalCosts': to_amount(TotalCosts),
+    }
+    values = {
+        field: getattr(ContractTotal, field) + delta
+        for field, delta in deltas.items() if delta
+    }
+    if not values:
+        return
+
+    stmt = (update(ContractTotal)
+            .where(ContractTotal.ContractID == contract_id)
+            .values(**values)
+            .execution_options(synchronize_session=False))
+    if db.session.execute(stmt).rowcount == 0:
+        insert_missing(ContractTotal, [dict(deltas, ContractID=contract_id)],
+                       lambda row: db.session.execute(stmt))
+
+
+def _relative_update(table, keys):
+    """按主键把增量累加到合计列上的 UPDATE（x = x + 增量），参数为 key_<主键列> 和 d_<合计字段>，可批量执行
+
+    与单条写入的 apply_contract_delta 一样由数据库在行上累加，不会覆盖并发事务已提交的增量。
+    """
+    return (update(table)
+            .where(*[table.c[key] == bindparam(f'key_{key}') for key in keys])
+            .values({field: table.c[field] + bindparam(f'd_{field}') for field in TOTAL_FIELDS}))
+
+
+def _apply_deltas(table, keys, deltas, existing_keys, apply_row):
+    """已有的行批量累加增量，缺失的行批量插入（并发插入冲突时改用 apply_row 逐行累加）"""
+    updates, inserts = [], []
+    for key, fields in deltas.items():
+        if key in existing_keys:
+            updates.append(dict({f'key_{name}': value for name, value in zip(keys, key)},
+                                **{f'd_{field}': fields[field] for field in TOTAL_FIELDS}))
+        else:
+            inserts.append(dict(fields, **dict(zip(keys, key))))
+
+    if updates:
+        db.session.execute(_relative_update(table, keys), updates)
+    if inserts:
+        insert_missing(table, inserts, apply_row)
+
+
+def apply_contract_deltas(deltas):
+    """批量累加增量（不提交），deltas 格式为 {ContractID: {'TotalCosts': 金额, ...}}
+
+    先读取已有合计行的主键，再批量执行相对更新（x = x + 增量）、批量插入缺失的行，往返次数与合同数量无关。
+    """
+    deltas = {
+        contract_id: {field: to_amount(fields.get(field, 0)) for field in TOTAL_FIELDS}
+        for contract_id, fields in deltas.items() if contract_id is not None
+    }
+    if not deltas:
+        return
+
+    existing = set()
+    for ids in chunked(deltas):
+        existing.update((contract_id,) for contract_id, in
+                        db.session.query(ContractTotal.ContractID).filter(ContractTotal.ContractID.in_(ids)))
+
+    _apply_deltas(ContractTotal.__table__, ('ContractID',),
+                  {(contract_id,): fields for contract_id, fields in deltas.items()}, existing,
+                  lambda row: apply_contract_delta(row['ContractID'], **{f: row[f] for f in TOTAL_FIELDS}))
+
+
+def remove_contract_totals(contract_ids):
+    """删除/归档合同时同步删除其合计行（不提交），contract_ids 为合同ID列表"""
+    for ids in chunked(contract_ids):
+        db.session.execute(
+            delete(ContractTotal)
+            .where(ContractTotal.ContractID.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def rebuild_contract_totals(verify_only=False):
+    """从流水表重新计算全部合同合计，并与汇总表比对
+
+    返回差异列表，每项为 {'ContractID', 'Field', 'Stored', 'Actual'}。
+    verify_only 为 True 时只报告差异，否则修正汇总表并提交。
+    """
+    actual = compute_contract_totals()
+    actual.pop(None, None)  # 未关联合同的流水不计入合计
+    stored = {row.ContractID: row for row in ContractTotal.query.all()}
+
+    drift = []
+    for contract_id in sorted(set(actual) | set(stored)):
+        row = stored.get(contract_id)
+        actual_totals = actual.get(contract_id, {})
+        for field in TOTAL_FIELDS:
+            stored_value = to_amount(getattr(row, field) if row else 0)
+            actual_value = to_amount(actual_totals.get(field, 0))
+            if stored_value != actual_value:
+                drift.append({
+                    'ContractID': contract_id,
+                    'Field': field,
+                    'Stored': stored_value,
+                    'Actual': actual_value
+                })
+
+    if verify_only:
+        return drift
+
+    for contract_id, actual_totals in actual.items():
+        row = stored.pop(contract_id, None)
+        if row is None:
+            row = ContractTotal(ContractID=contract_id)
+            db.session.add(row)
+        for field in TOTAL_FIELDS:
+            setattr(row, field, to_amount(actual_totals.get(field, 0)))
+    # 已没有任何流水的合同（或已删除的合同）
+    for row in stored.values():
+        db.session.delete(row)
+
+    db.session.commit()
+    return drift
+
+
+# ---------- 合同月度合计 ----------
+
+# 各流水表对应的日期字段和合计字段
+MONTHLY_LEDGERS = (
+    (Payment, Payment.PaymentDate, 'TotalPayments'),
+    (Invoice, Invoice.InvoiceDate, 'TotalInvoices'),
+    (Cost, Cost.CostDate, 'TotalCosts'),
+)
+
+
+def month_of(value):
+    """流水日期（date/datetime 或 'YYYY-MM-DD' 字符串）所在的月份 'YYYY-MM'，没有日期时返回 None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        return value[:7]
+    return f'{value.year:04d}-{value.month:02d}'
+
+
+def apply_monthly_delta(contract_id, ledger_date, TotalPayments=0, TotalInvoices=0, TotalCosts=0):
+    """把一条流水的增量累加到所在月份的合同月度合计上（不提交）；没有日期的成本不计入月度合计"""
+    month = month_of(ledger_date)
+    if contract_id is None or month is None:
+        return
+    deltas = {
+        'TotalPayments': to_amount(TotalPayments),
+        'TotalInvoices': to_amount(TotalInvoices),
+        'TotalCosts': to_amount(TotalCosts),
+    }
+    values = {
+        field: getattr(MonthlyContractTotal, field) + delta
+        for field, delta in deltas.items() if delta
+    }
+    if not values:
+        return
+
+    stmt = (update(MonthlyContractTotal)
+            .where(MonthlyContractTotal.ContractID == contract_id, MonthlyContractTotal.Month == month)
+            .values(**values)
+            .execution_options(synchronize_session=False))
+    if db.session.execute(stmt).rowcount == 0:
+        insert_missing(MonthlyContractTotal, [dict(deltas, ContractID=contract_id, Month=month)],
+                       lambda row: db.session.execute(stmt))
+
+
+def apply_monthly_deltas(deltas):
+    """批量累加月度增量（不提交），deltas 格式为 {(ContractID, 'YYYY-MM'): {'TotalCosts': 金额, ...}}
+
+    与 apply_contract_deltas 相同：先读取已有行的主键，再批量相对更新、批量插入，往返次数与行数无关。
+    """
+    deltas = {
+        key: {field: to_amount(fields.get(field, 0)) for field in TOTAL_FIELDS}
+        for key, fields in deltas.items() if key[0] is not None and key[1] is not None
+    }
+    if not deltas:
+        return
+
+    existing = set()
+    for keys in chunked(deltas):
+        # SQL Server 不支持 (a, b) IN (...)，按两列分别筛选后在内存中匹配
+        existing.update((contract_id, month) for contract_id, month in
+                        db.session.query(MonthlyContractTotal.ContractID, MonthlyContractTotal.Month)
+                        .filter(MonthlyContractTotal.ContractID.in_({key[0] for key in keys}),
+                                MonthlyContractTotal.Month.in_({key[1] for key in keys})))
+
+    _apply_deltas(MonthlyContractTotal.__table__, ('ContractID', 'Month'), deltas, existing,
+                  lambda row: apply_monthly_delta(row['ContractID'], row['Month'],
+                                                  **{f: row[f] for f in TOTAL_FIELDS}))
+
+
+def remove_monthly_totals(contract_ids):
+    """删除/归档合同时同步删除其月度合计（不提交），contract_ids 为合同ID列表"""
+    for ids in chunked(contract_ids):
+        db.session.execute(
+            delete(MonthlyContractTotal)
+            .where(MonthlyContractTotal.ContractID.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def compute_monthly_totals():
+    """直接扫描流水表，按 合同+年+月 分组计算月度合计
+
+    返回 {(ContractID, 'YYYY-MM'): {'TotalPayments', 'TotalInvoices', 'TotalCosts'}}，
+    未关联合同的流水和没有日期的成本不计入。
+    """
+    totals = {}
+    for model, date_column, field in MONTHLY_LEDGERS:
+        year, month = extract('year', date_column), extract('month', date_column)
+        rows = db.session.execute(
+            select(model.ContractID, year, month, func.sum(model.Amount))
+            .where(model.ContractID.isnot(None), date_column.isnot(None))
+            .group_by(model.ContractID, year, month)
+        )
+        for contract_id, year_value, month_value, amount in rows:
+            key = (contract_id, f'{int(year_value):04d}-{int(month_value):02d}')
+            totals.setdefault(key, {f: Decimal(0) for f in TOTAL_FIELDS})[field] = amount or 0
+    return totals
+
+
+def rebuild_monthly_totals(verify_only=False):
+    """从流水表重新计算全部合同月度合计，并与月度合计表比对
+
+    返回差异列表，每项为 {'ContractID', 'Month', 'Field', 'Stored', 'Actual'}。
+    verify_only 为 True 时只报告差异，否则以批量语句修正月度合计表并提交。
+    """
+    actual = compute_monthly_totals()
+    stored = {
+        (contract_id, month): dict(zip(TOTAL_FIELDS, values))
+        for contract_id, month, *values in db.session.execute(
+            select(MonthlyContractTotal.ContractID, MonthlyContractTotal.Month,
+                   *[getattr(MonthlyContractTotal, f) for f in TOTAL_FIELDS]))
+    }
+
+    drift, inserts, updates = [], [], []
+    for key in sorted(set(actual) | set(stored)):
+        row = stored.get(key)
+        actual_totals = actual.get(key, {})
+        changed = False
+        for field in TOTAL_FIELDS:
+            stored_value = to_amount(row[field] if row else 0)
+            actual_value = to_amount(actual_totals.get(field, 0))
+            if stored_value != actual_value:
+                changed = True
+                drift.append({'ContractID': key[0], 'Month': key[1], 'Field': field,
+                              'Stored': stored_value, 'Actual': actual_value})
+        if changed and key in actual:
+            values = {field: to_amount(actual_totals.get(field, 0)) for field in TOTAL_FIELDS}
+            (updates if row else inserts).append(dict(values, ContractID=key[0], Month=key[1]))
+
+    if verify_only:
+        return drift
+
+    # 已没有任何流水的月份（或已删除的合同）
+    removed = [{'key_contract': contract_id, 'key_month': month}
+               for contract_id, month in stored if (contract_id, month) not in actual]
+    table = MonthlyContractTotal.__table__
+    for rows in chunked(removed):
+        db.session.execute(delete(table).where(table.c.ContractID == bindparam('key_contract'),
+                                               table.c.Month == bindparam('key_month')), rows)
+    for rows in chunked(updates):
+        db.session.execute(update(MonthlyContractTotal), rows)
+    for rows in chunked(inserts):
+        db.session.execute(insert(MonthlyContractTotal), rows)
+    db.session.commit()
+    return drift
@@ -1,49 +1,70 @@
 # -*- coding: utf-8 -*-
-from flask import render_template, request, jsonify, redirect, url_for
+from flask import render_template, request, jsonify, redirect, url_for, Response, stream_with_context, abort, send_file
 from app import db
-from app.models import Supplier, Client, Contract, Payment, Invoice, Cost, FixedCost, SupplierReconciliation  # 添加 FixedCost 导入
+from app.models import Supplier, Client, Contract, Payment, Invoice, Cost, FixedCost, SupplierReconciliation, AllocationRun, Job  # 添加 FixedCost 导入
+from app.summary import contract_rows, client_summaries, contract_source, archived_requested, INDEX_FIELDS, CONTRACT_LIST_FIELDS, CLIENT_CONTRACT_FIELDS, SUPPLIER_CONTRACT_FIELDS
+from app.encoding import parse_fields, parse_format, list_response
+from app.rollups import apply_contract_delta, apply_monthly_delta, to_amount
+from app.contract_bulk import resolve_contract_ids, remove_contracts
+from app.changes import read_changes, DEFAULT_LIMIT as CHANGES_DEFAULT_LIMIT, MAX_LIMIT as CHANGES_MAX_LIMIT
+from app.live import event_broker, publish_change, ledger_change, record_row, render_row, contract_snapshot, client_snapshots
+from app.contract_list import paginate_contracts, contract_stats, has_supplier
+from app.loaders import contract_loader, contract_query
+from app.search import supplier_index, client_index, parse_limit
+from app.reconciliation import (reconciliation_page, final_balance, balance_through, serialize_reconciliation,
+                                invalidate_checkpoints, remove_checkpoints, save_checkpoints)
+from app.export import export_stream
+from app.jobs import job_runner, serialize_job, JobQueueFull, ACTIVE as JOB_ACTIVE
+from app.archive import (current_fiscal_year, archive_summary, archived_contract_rows, archived_contract,
+                         archived_contract_ids)
+from app.ledger_import import import_records, read_upload, invalidate_import_caches
+from app.cache import response_cache, contract_tags, contract_object_tags
+from app.aging import aging_report, parse_as_of
+from app.trends import month_range, company_trend, entity_trend, group_trends
+from app.allocation import parse_months, parse_cost_types, allocate_fixed_costs as run_allocation, allocation_response, delete_allocation_run, serialize_run, AllocationConflict
 import os
-from sqlalchemy.orm import joinedload
+import json
 from datetime import datetime
 from flask import session,flash
 
+def _async_requested():
+    """分摊/导出/导入接口带 async=1 时以后台任务方式执行"""
+    return request.args.get('async', '') in ('1', 'true')
+
+
+# /api/salary_costs 可选择的字段
+SALARY_COST_FIELDS = ('FixedCostID', 'Month', 'Amount', 'Description', 'CostDate')
 
 
 def init_routes(app):
     # 主页面路由
     @app.route('/')
     def index():
-        contracts = Contract.query.options(
-            joinedload(Contract.suppliers),
-            joinedload(Contract.client)
-        ).all()
-
-        contract_data = []
-        
-        for contract in contracts:
-            total_payments = sum([p.Amount for p in contract.payments]) if contract.payments else 0
-            total_invoices = sum([i.Amount for i in contract.invoices]) if contract.invoices else 0
-            total_costs = sum([c.Amount for c in contract.costs]) if contract.costs else 0
-            
-            # 处理 CompletionRate 可能为 None 的情况
-            completion_rate = float(contract.CompletionRate) if contract.CompletionRate is not None else 0.0
-            
-            contract_data.append({
-                'ContractID': contract.ContractID,
-                'ProjectName': contract.ProjectName,
-                'ContractNumber': contract.ContractNumber,
-                'TotalAmount': float(contract.TotalAmount),
-                'Supplier': ', '.join([s.SupplierName for s in contract.suppliers]) if contract.suppliers else '',
-                'Client': contract.client.ClientName if contract.client else '',
-                'TotalPayments': float(total_payments),
-                'TotalInvoices': float(total_invoices),
-                'TotalCosts': float(total_costs),
-                'IsOverBudget': total_costs > contract.TotalAmount,
-                'SignDate': contract.SignDate.isoformat() if contract.SignDate else None,
-                'CompletionRate': completion_rate  # 添加完工率
-            })
-        
-        return render_template('index.html', contracts=contract_data)
+        # 分页、排序、筛选都在服务器端完成，只渲染当前页
+        filters = request.args.to_dict()
+        filters.pop('cursor', None)
+        try:
+            contract_data, next_cursor = paginate_contracts(
+                request.args,
+                INDEX_FIELDS,
+                options=contract_loader('list')
+            )
+            stats = contract_stats(request.args)
+            error = None
+        except ValueError as e:
+            contract_data, next_cursor, error = [], None, str(e)
+            stats = {'Count': 0, 'TotalAmount': 0, 'TotalPayments': 0, 'OverBudgetCount': 0}
+        
+        next_url = url_for('index', cursor=next_cursor, **filters) if next_cursor else None
+        first_url = url_for('index', **filters) if request.args.get('cursor') else None
+        
+        return render_template('index.html',
+                               contracts=contract_data,
+                               stats=stats,
+                               filters=filters,
+                               next_url=next_url,
+                               first_url=first_url,
+                               error=error)
     @app.route('/login', methods=['GET', 'POST'])
     def login():
         if request.method == 'POST':
@@ -71,7 +92,7 @@ def init_routes(app):
     @app.before_request
     def require_login():
         # 允许访问的无需登录的路由
-        allowed_routes = ['login', 'static']
+        allowed_routes = ['login', 'static', 'metrics']  # /metrics 自行校验登录状态或 METRICS_TOKEN
         if request.endpoint not in allowed_routes and not session.get('logged_in'):
             return redirect(url_for('login'))
 
@@ -79,55 +100,42 @@ def init_routes(app):
     @app.route('/api/suppliers/search/<string:term>')
     @app.route('/api/suppliers/search/')
     def search_suppliers(term=''):
-        if not term:
-            suppliers = Supplier.query.all()
-        else:
-            suppliers = Supplier.query.filter(Supplier.SupplierName.ilike(f'%{term}%')).all()
-        return jsonify([{'id': s.SupplierID, 'text': s.SupplierName} for s in suppliers])
+        # 使用内存索引搜索（支持拼音首字母），按匹配程度排序并限制条数
+        supplier_index.sync()
+        results = supplier_index.search(term, parse_limit(request.args.get('limit')))
+        return jsonify([{'id': supplier_id, 'text': name} for supplier_id, name in results])
 
     # 搜索客户接口
     @app.route('/api/clients/search/<string:term>')
     @app.route('/api/clients/search/')
     def search_clients(term=''):
-        if not term:
-            clients = Client.query.all()
-        else:
-            clients = Client.query.filter(Client.ClientName.ilike(f'%{term}%')).all()
-        return jsonify([{'id': c.ClientID, 'text': c.ClientName} for c in clients])
+        # 使用内存索引搜索（支持拼音首字母），按匹配程度排序并限制条数
+        client_index.sync()
+        results = client_index.search(term, parse_limit(request.args.get('limit')))
+        return jsonify([{'id': client_id, 'text': name} for client_id, name in results])
     
     # 合同管理接口（查询/创建）
     @app.route('/api/contracts', methods=['GET', 'POST'])
+    @response_cache.cached('contracts')
     def contracts():
         if request.method == 'GET':
-            contracts = Contract.query.all()
-            result = []
-            
-            for contract in contracts:
-                total_payments = sum([p.Amount for p in contract.payments]) if contract.payments else 0
-                total_invoices = sum([i.Amount for i in contract.invoices]) if contract.invoices else 0
-                total_costs = sum([c.Amount for c in contract.costs]) if contract.costs else 0
-                
-                # 处理 CompletionRate 可能为 None 的情况
-                completion_rate = float(contract.CompletionRate) if contract.CompletionRate is not None else 0.0
-                
-                result.append({
-                    'ContractID': contract.ContractID,
-                    'ProjectName': contract.ProjectName,
-                    'ContractNumber': contract.ContractNumber,
-                    'TotalAmount': float(contract.TotalAmount),
-                    'Supplier': ', '.join([s.SupplierName for s in contract.suppliers]) if contract.suppliers else '',
-                    'Client': contract.client.ClientName if contract.client else '',
-                    'ClientID': contract.ClientID,  # 添加客户ID
-                    'SignDate': contract.SignDate.isoformat() if contract.SignDate else None,
-                    'CompletionRate': completion_rate,  # 添加完工率
-                    'TotalPayments': float(total_payments),
-                    'TotalInvoices': float(total_invoices),
-                    'TotalCosts': float(total_costs),
-                    'RemainingAmount': float(contract.TotalAmount) - float(total_payments),
-                    'IsOverBudget': total_costs > contract.TotalAmount
-                })
+            # fields 选择字段（只读取用到的列），format=columns 按列返回，客户/供应商名称字典编码；
+            # include_archived=1 时包括归档的合同
+            try:
+                fields = parse_fields(request.args.get('fields'), CONTRACT_LIST_FIELDS)
+                format = parse_format(request.args)
+                result, next_cursor = paginate_contracts(request.args, fields, columns=True)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            return jsonify(result)
+            response = list_response(result, fields, format, dictionary=('Client', 'Supplier'))
+            # 下一页游标放在响应头中，响应体保持原来的数组格式
+            if next_cursor:
+                args = request.args.to_dict()
+                args['cursor'] = next_cursor
+                response.headers['X-Next-Cursor'] = next_cursor
+                response.headers['Link'] = f'<{url_for("contracts", **args)}>; rel="next"'
+            return response
         
         elif request.method == 'POST':
             data = request.json
@@ -158,17 +166,20 @@ def init_routes(app):
             
             db.session.add(new_contract)
             db.session.commit()
+            response_cache.invalidate(*contract_object_tags(new_contract))
             
-            return jsonify({
-                'message': '合同创建成功', 
-                'id': new_contract.ContractID
-            })
+            row, html = contract_snapshot(new_contract.ContractID)
+            change = publish_change('contract', 'created', new_contract.ContractID, row=row, html=html,
+                                    clients=client_snapshots(new_contract.ClientID))
+            return jsonify(dict(change, message='合同创建成功'))
     
     # 合同编辑 - 重命名为 update_contract 以避免冲突
     @app.route('/api/contracts/<int:contract_id>', methods=['PUT'])
     def update_contract(contract_id):
-        contract = Contract.query.get_or_404(contract_id)
+        contract = contract_query('detail').get_or_404(contract_id)
         data = request.json
+        stale_tags = contract_object_tags(contract)
+        old_client_id = contract.ClientID
         
         # 客户处理
         if data.get('Client'):
@@ -193,23 +204,57 @@ def init_routes(app):
         contract.CompletionRate = data.get('CompletionRate', contract.CompletionRate or 0)  # 新增完工率字段
         
         db.session.commit()
+        response_cache.invalidate(*stale_tags, *contract_object_tags(contract))
         
-        return jsonify({'message': '合同更新成功'})
+        row, html = contract_snapshot(contract_id)
+        change = publish_change('contract', 'updated', contract_id, row=row, html=html,
+                                clients=client_snapshots(old_client_id, contract.ClientID))
+        return jsonify(dict(change, message='合同更新成功'))
     
     # 合同删除
     @app.route('/api/contracts/<int:contract_id>', methods=['DELETE'])
     def delete_contract(contract_id):
-        contract = Contract.query.get_or_404(contract_id)
+        contract = contract_query('detail').get_or_404(contract_id)
+        stale_tags = contract_object_tags(contract)
+        client_id = contract.ClientID
         
-        # 删除相关记录
-        Payment.query.filter_by(ContractID=contract_id).delete()
-        Invoice.query.filter_by(ContractID=contract_id).delete()
-        Cost.query.filter_by(ContractID=contract_id).delete()
-        
-        db.session.delete(contract)
+        # 相关流水、合计和供应商关联用集合语句删除，不逐条载入
+        remove_contracts([contract_id])
         db.session.commit()
+        response_cache.invalidate(*stale_tags)
         
-        return jsonify({'message': '合同删除成功'})
+        change = publish_change('contract', 'deleted', contract_id, clients=client_snapshots(client_id))
+        return jsonify(dict(change, message='合同删除成功'))
+    
+    # 批量删除/归档合同：{"ids": [...]} 或 {"filters": {...}}（筛选参数同合同列表）
+    @app.route('/api/contracts/bulk_delete', methods=['POST'])
+    @app.route('/api/contracts/bulk_archive', methods=['POST'])
+    def bulk_remove_contracts():
+        archive = request.path.endswith('bulk_archive')
+        try:
+            contract_ids = resolve_contract_ids(request.json or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not contract_ids:
+            return jsonify({'error': '没有符合条件的合同'}), 404
+        
+        stale_tags = contract_tags(contract_ids)
+        try:
+            counts = remove_contracts(contract_ids, archive=archive)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': f'{"归档" if archive else "删除"}失败: {str(e)}'}), 500
+        response_cache.invalidate(*stale_tags)
+        
+        # 一次批量操作只推送一条变更，ids 为全部合同ID
+        client_ids = [int(tag.split(':', 1)[1]) for tag in stale_tags if tag.startswith('client:')]
+        change = publish_change('contract', 'deleted', None, ids=contract_ids,
+                                clients=client_snapshots(*client_ids))
+        return jsonify(dict(change,
+                            message=f'已{"归档" if archive else "删除"} {counts["contracts"]} 个合同',
+                            contract_ids=contract_ids,
+                            **counts))
     
     # 供应商管理
     @app.route('/suppliers')
@@ -226,13 +271,17 @@ def init_routes(app):
         )
         db.session.add(new_supplier)
         db.session.commit()
+        supplier_index.changed(new_supplier.SupplierID, new_supplier.SupplierName)
         return jsonify({'message': '供应商添加成功', 'id': new_supplier.SupplierID})
     
     @app.route('/api/suppliers/<int:supplier_id>', methods=['DELETE'])
     def delete_supplier(supplier_id):
         supplier = Supplier.query.get_or_404(supplier_id)
+        remove_checkpoints(supplier_id)
         db.session.delete(supplier)
         db.session.commit()
+        supplier_index.changed(supplier_id)
+        response_cache.invalidate('contracts', f'supplier:{supplier_id}')
         return jsonify({'message': '供应商删除成功'})
     
     @app.route('/api/suppliers/<int:supplier_id>', methods=['PUT'])
@@ -242,13 +291,17 @@ def init_routes(app):
         supplier.SupplierName = data.get('SupplierName', supplier.SupplierName)
         supplier.ContactInfo = data.get('ContactInfo', supplier.ContactInfo)
         db.session.commit()
+        supplier_index.changed(supplier.SupplierID, supplier.SupplierName)
+        response_cache.invalidate('contracts')
         return jsonify({'message': '供应商更新成功'})
     
     # 客户管理
     @app.route('/clients')
     def clients():
         clients = Client.query.all()
-        return render_template('clients.html', clients=clients)
+        # 每个客户的合同数、欠款、欠票，一条分组查询
+        summaries = client_summaries()
+        return render_template('clients.html', clients=clients, summaries=summaries)
     
     @app.route('/api/clients', methods=['POST'])
     def add_client():
@@ -259,14 +312,21 @@ def init_routes(app):
         )
         db.session.add(new_client)
         db.session.commit()
-        return jsonify({'message': '客户添加成功', 'id': new_client.ClientID})
+        client_index.changed(new_client.ClientID, new_client.ClientName)
+        response_cache.invalidate('clients')
+        change = publish_change('client', 'created', new_client.ClientID, row=record_row(new_client),
+                                html=render_row('client_row', new_client, None))
+        return jsonify(dict(change, message='客户添加成功'))
     
     @app.route('/api/clients/<int:client_id>', methods=['DELETE'])
     def delete_client(client_id):
         client = Client.query.get_or_404(client_id)
         db.session.delete(client)
         db.session.commit()
-        return jsonify({'message': '客户删除成功'})
+        client_index.changed(client_id)
+        response_cache.invalidate('contracts', 'clients', f'client:{client_id}')
+        change = publish_change('client', 'deleted', client_id)
+        return jsonify(dict(change, message='客户删除成功'))
     
     @app.route('/api/clients/<int:client_id>', methods=['PUT'])
     def update_client(client_id):
@@ -275,12 +335,17 @@ def init_routes(app):
         client.ClientName = data.get('ClientName', client.ClientName)
         client.ContactInfo = data.get('ContactInfo', client.ContactInfo)
         db.session.commit()
-        return jsonify({'message': '客户更新成功'})
+        client_index.changed(client.ClientID, client.ClientName)
+        response_cache.invalidate('contracts', 'clients', f'client:{client_id}')
+        summary = client_snapshots(client_id).get(client_id)
+        change = publish_change('client', 'updated', client_id, row=record_row(client),
+                                html=render_row('client_row', client, summary))
+        return jsonify(dict(change, message='客户更新成功'))
     
     # 成本管理页面
     @app.route('/costs')
     def costs():
-        contracts = Contract.query.all()
+        contracts = contract_query('ledger').all()
         return render_template('costs.html', 
                          contracts=contracts, 
                          contract=None, 
@@ -295,21 +360,21 @@ def init_routes(app):
     # 合同付款页面
     @app.route('/contract/<int:contract_id>/payments')
     def contract_payments(contract_id):
-        contract = Contract.query.get_or_404(contract_id)
+        contract = contract_query('ledger').get_or_404(contract_id)
         payments = Payment.query.filter_by(ContractID=contract_id).all()
         return render_template('payments.html', contract=contract, payments=payments)
     
     # 合同发票页面
     @app.route('/contract/<int:contract_id>/invoices')
     def contract_invoices(contract_id):
-        contract = Contract.query.get_or_404(contract_id)
+        contract = contract_query('ledger').get_or_404(contract_id)
         invoices = Invoice.query.filter_by(ContractID=contract_id).all()
         return render_template('invoices.html', contract=contract, invoices=invoices)
     
     # 合同成本页面
     @app.route('/contract/<int:contract_id>/costs')
     def contract_costs(contract_id):
-        contract = Contract.query.get_or_404(contract_id)
+        contract = contract_query('ledger').get_or_404(contract_id)
         costs = Cost.query.filter_by(ContractID=contract_id).all()
         total_costs = sum([cost.Amount for cost in costs]) if costs else 0
         is_over_budget = total_costs > contract.TotalAmount
@@ -325,8 +390,11 @@ def init_routes(app):
         data = request.json
         new_payment = Payment(** data)
         db.session.add(new_payment)
+        apply_contract_delta(new_payment.ContractID, TotalPayments=new_payment.Amount)
+        apply_monthly_delta(new_payment.ContractID, new_payment.PaymentDate, TotalPayments=new_payment.Amount)
         db.session.commit()
-        return jsonify({'message': '付款记录添加成功', 'id': new_payment.PaymentID})
+        response_cache.invalidate(*contract_tags([new_payment.ContractID]))
+        return jsonify(dict(ledger_change('payment', 'created', new_payment), message='付款记录添加成功'))
     
     # 发票记录接口
     @app.route('/api/invoices', methods=['POST'])
@@ -334,8 +402,11 @@ def init_routes(app):
         data = request.json
         new_invoice = Invoice(**data)
         db.session.add(new_invoice)
+        apply_contract_delta(new_invoice.ContractID, TotalInvoices=new_invoice.Amount)
+        apply_monthly_delta(new_invoice.ContractID, new_invoice.InvoiceDate, TotalInvoices=new_invoice.Amount)
         db.session.commit()
-        return jsonify({'message': '发票记录添加成功', 'id': new_invoice.InvoiceID})
+        response_cache.invalidate(*contract_tags([new_invoice.ContractID]))
+        return jsonify(dict(ledger_change('invoice', 'created', new_invoice), message='发票记录添加成功'))
     
     # 成本记录接口
     @app.route('/api/costs', methods=['POST'])
@@ -343,105 +414,290 @@ def init_routes(app):
         data = request.json
         new_cost = Cost(** data)
         db.session.add(new_cost)
+        apply_contract_delta(new_cost.ContractID, TotalCosts=new_cost.Amount)
+        apply_monthly_delta(new_cost.ContractID, new_cost.CostDate, TotalCosts=new_cost.Amount)
         db.session.commit()
-        return jsonify({'message': '成本记录添加成功', 'id': new_cost.CostID})
+        # 客户/供应商合同接口不包含成本，只影响合同列表
+        response_cache.invalidate('contracts')
+        return jsonify(dict(ledger_change('cost', 'created', new_cost), message='成本记录添加成功'))
     
     # 删除付款记录
     @app.route('/api/payments/<int:id>', methods=['DELETE'])
     def delete_payment(id):
         payment = Payment.query.get_or_404(id)
+        previous = record_row(payment)
         db.session.delete(payment)
+        apply_contract_delta(payment.ContractID, TotalPayments=-payment.Amount)
+        apply_monthly_delta(payment.ContractID, payment.PaymentDate, TotalPayments=-payment.Amount)
         db.session.commit()
-        return jsonify({'message': '付款记录删除成功'})
+        response_cache.invalidate(*contract_tags([payment.ContractID]))
+        return jsonify(dict(ledger_change('payment', 'deleted', payment, previous=previous), message='付款记录删除成功'))
+    
+    # 修改付款记录：旧金额从原日期所在月份扣除，新金额计入新日期所在月份
+    @app.route('/api/payments/<int:id>', methods=['PUT'])
+    def update_payment(id):
+        payment = Payment.query.get_or_404(id)
+        data = request.json
+        previous = record_row(payment)
+        old_date, old_amount = payment.PaymentDate, payment.Amount
+        payment.PaymentDate = data.get('PaymentDate', payment.PaymentDate)
+        payment.Amount = data.get('Amount', payment.Amount)
+        payment.PaymentType = data.get('PaymentType', payment.PaymentType)
+        apply_contract_delta(payment.ContractID, TotalPayments=to_amount(payment.Amount) - old_amount)
+        apply_monthly_delta(payment.ContractID, old_date, TotalPayments=-old_amount)
+        apply_monthly_delta(payment.ContractID, payment.PaymentDate, TotalPayments=payment.Amount)
+        db.session.commit()
+        response_cache.invalidate(*contract_tags([payment.ContractID]))
+        return jsonify(dict(ledger_change('payment', 'updated', payment, previous=previous), message='付款记录更新成功'))
     
     # 删除发票记录
     @app.route('/api/invoices/<int:id>', methods=['DELETE'])
     def delete_invoice(id):
         invoice = Invoice.query.get_or_404(id)
+        previous = record_row(invoice)
         db.session.delete(invoice)
+        apply_contract_delta(invoice.ContractID, TotalInvoices=-invoice.Amount)
+        apply_monthly_delta(invoice.ContractID, invoice.InvoiceDate, TotalInvoices=-invoice.Amount)
+        db.session.commit()
+        response_cache.invalidate(*contract_tags([invoice.ContractID]))
+        return jsonify(dict(ledger_change('invoice', 'deleted', invoice, previous=previous), message='发票记录删除成功'))
+    
+    # 修改发票记录：旧金额从原日期所在月份扣除，新金额计入新日期所在月份
+    @app.route('/api/invoices/<int:id>', methods=['PUT'])
+    def update_invoice(id):
+        invoice = Invoice.query.get_or_404(id)
+        data = request.json
+        previous = record_row(invoice)
+        old_date, old_amount = invoice.InvoiceDate, invoice.Amount
+        invoice.InvoiceDate = data.get('InvoiceDate', invoice.InvoiceDate)
+        invoice.Amount = data.get('Amount', invoice.Amount)
+        invoice.InvoiceType = data.get('InvoiceType', invoice.InvoiceType)
+        apply_contract_delta(invoice.ContractID, TotalInvoices=to_amount(invoice.Amount) - old_amount)
+        apply_monthly_delta(invoice.ContractID, old_date, TotalInvoices=-old_amount)
+        apply_monthly_delta(invoice.ContractID, invoice.InvoiceDate, TotalInvoices=invoice.Amount)
         db.session.commit()
-        return jsonify({'message': '发票记录删除成功'})
+        response_cache.invalidate(*contract_tags([invoice.ContractID]))
+        return jsonify(dict(ledger_change('invoice', 'updated', invoice, previous=previous), message='发票记录更新成功'))
     
     # 删除成本记录
     @app.route('/api/costs/<int:id>', methods=['DELETE'])
     def delete_cost(id):
         cost = Cost.query.get_or_404(id)
+        previous = record_row(cost)
         db.session.delete(cost)
+        apply_contract_delta(cost.ContractID, TotalCosts=-cost.Amount)
+        apply_monthly_delta(cost.ContractID, cost.CostDate, TotalCosts=-cost.Amount)
         db.session.commit()
-        return jsonify({'message': '成本记录删除成功'})
+        response_cache.invalidate('contracts')
+        return jsonify(dict(ledger_change('cost', 'deleted', cost, previous=previous), message='成本记录删除成功'))
     
-    # 客户合同查询接口
+    # 修改成本记录：旧金额从原日期所在月份扣除，新金额计入新日期所在月份
+    @app.route('/api/costs/<int:id>', methods=['PUT'])
+    def update_cost(id):
+        cost = Cost.query.get_or_404(id)
+        data = request.json
+        previous = record_row(cost)
+        old_date, old_amount = cost.CostDate, cost.Amount
+        cost.CostDate = data.get('CostDate', cost.CostDate)
+        cost.Amount = data.get('Amount', cost.Amount)
+        cost.CostType = data.get('CostType', cost.CostType)
+        cost.Description = data.get('Description', cost.Description)
+        apply_contract_delta(cost.ContractID, TotalCosts=to_amount(cost.Amount) - old_amount)
+        apply_monthly_delta(cost.ContractID, old_date, TotalCosts=-old_amount)
+        apply_monthly_delta(cost.ContractID, cost.CostDate, TotalCosts=cost.Amount)
+        db.session.commit()
+        # 客户/供应商合同接口不包含成本，只影响合同列表
+        response_cache.invalidate('contracts')
+        return jsonify(dict(ledger_change('cost', 'updated', cost, previous=previous), message='成本记录更新成功'))
+    
+    def _import_response(ledger, records, contract_id, skip_invalid):
+        if _async_requested():
+            return _submit_job('import', {'ledger': ledger, 'records': records,
+                                          'contract_id': contract_id, 'skip_invalid': skip_invalid})
+        if contract_id not in (None, ''):
+            try:
+                contract_id = int(contract_id)
+            except ValueError:
+                return jsonify({'error': 'contract_id 必须是整数'}), 400
+        else:
+            contract_id = None
+        try:
+            result = import_records(ledger, records, contract_id, skip_invalid)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if result['errors'] and not result['inserted'] and not skip_invalid:
+            return jsonify(dict(result, error='数据校验失败，未导入任何记录')), 400
+        invalidate_import_caches(ledger, result)
+        return jsonify(dict(result, message=f"成功导入 {result['inserted']} 条记录"))
+    
+    # 批量导入付款/发票/成本（JSON）：数组，或 {"records": [...], "contract_id": 默认合同, "skip_invalid": false}
+    @app.route('/api/<any(payments, invoices, costs):ledger>/batch', methods=['POST'])
+    def import_ledger_batch(ledger):
+        data = request.get_json(silent=True)
+        if isinstance(data, list):
+            data = {'records': data}
+        if not isinstance(data, dict) or not isinstance(data.get('records'), list):
+            return jsonify({'error': '请求体应为记录数组或包含 records 数组的对象'}), 400
+        return _import_response(ledger, data['records'], data.get('contract_id'), bool(data.get('skip_invalid')))
+    
+    # 批量导入付款/发票/成本（上传 CSV/XLSX 文件，表头可使用字段名或导出文件的中文列名）
+    @app.route('/api/<any(payments, invoices, costs):ledger>/import', methods=['POST'])
+    def import_ledger_file(ledger):
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'error': '请上传文件'}), 400
+        try:
+            records = read_upload(upload)
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({'error': f'文件读取失败: {e}'}), 400
+        skip_invalid = request.form.get('skip_invalid', '') in ('1', 'true')
+        return _import_response(ledger, records, request.form.get('contract_id'), skip_invalid)
+    
+    # 客户合同查询接口（include_archived=1 时包括归档的合同，下同）
     @app.route('/api/clients/<int:client_id>/contracts')
+    @response_cache.cached('client:{client_id}')
     def client_contracts(client_id):
-        contracts = Contract.query.filter_by(ClientID=client_id).all()
-        result = []
-        
-        for contract in contracts:
-            total_payments = sum([p.Amount for p in contract.payments]) if contract.payments else 0
-            total_invoices = sum([i.Amount for i in contract.invoices]) if contract.invoices else 0
-            
-            # 处理 CompletionRate 可能为 None 的情况
-            completion_rate = float(contract.CompletionRate) if contract.CompletionRate is not None else 0.0
-            
-            result.append({
-                'ContractID': contract.ContractID,
-                'ProjectName': contract.ProjectName,
-                'ContractNumber': contract.ContractNumber,
-                'TotalAmount': float(contract.TotalAmount),
-                'TotalPayments': float(total_payments),
-                'TotalInvoices': float(total_invoices),
-                'RemainingPayment': float(contract.TotalAmount) - float(total_payments),
-                'RemainingInvoice': float(contract.TotalAmount) - float(total_invoices),
-                'SignDate': contract.SignDate.isoformat() if contract.SignDate else None,
-                'CompletionRate': completion_rate  # 添加完工率
-            })
-        
-        return jsonify(result)
+        try:
+            fields = parse_fields(request.args.get('fields'), CLIENT_CONTRACT_FIELDS)
+            format = parse_format(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        source = contract_source(archived_requested(request.args))
+        result = contract_rows(fields, source.contracts.c.ClientID == client_id, source=source)
+        
+        return list_response(result, fields, format)
+    
+    # 客户汇总接口：合同数、欠款、欠票合计，以及每个合同的明细
+    @app.route('/api/clients/<int:client_id>/summary')
+    @response_cache.cached('client:{client_id}')
+    def client_summary(client_id):
+        source = contract_source(archived_requested(request.args))
+        summary = client_summaries([client_id], include_contracts=True, source=source).get(client_id)
+        if summary is None:
+            abort(404)
+        return jsonify(summary)
+    
+    # 批量客户汇总接口：GET /api/clients/summary?ids=1,2,3（不指定时返回全部客户），contracts=1 时附带合同明细
+    @app.route('/api/clients/summary')
+    @response_cache.cached('contracts', 'clients')
+    def client_summaries_api():
+        ids = None
+        if request.args.get('ids'):
+            try:
+                ids = sorted({int(value) for value in request.args['ids'].split(',') if value.strip()})
+            except ValueError:
+                return jsonify({'error': 'ids 应为逗号分隔的客户ID'}), 400
+        summaries = client_summaries(ids, include_contracts=request.args.get('contracts') == '1',
+                                     source=contract_source(archived_requested(request.args)))
+        return jsonify(list(summaries.values()))
     
     # 供应商合同查询接口
     @app.route('/api/suppliers/<int:supplier_id>/contracts')
+    @response_cache.cached('supplier:{supplier_id}')
     def supplier_contracts(supplier_id):
         supplier = Supplier.query.get_or_404(supplier_id)
-        contracts = Contract.query.filter(Contract.suppliers.any(SupplierID=supplier_id)).all()
-        
-        result = []
-        
-        for contract in contracts:
-            total_payments = sum([p.Amount for p in contract.payments]) if contract.payments else 0
-            total_invoices = sum([i.Amount for i in contract.invoices]) if contract.invoices else 0
-            
-            # 处理 CompletionRate 可能为 None 的情况
-            completion_rate = float(contract.CompletionRate) if contract.CompletionRate is not None else 0.0
-            
-            result.append({
-                'ContractID': contract.ContractID,
-                'ProjectName': contract.ProjectName,
-                'ContractNumber': contract.ContractNumber,
-                'TotalAmount': float(contract.TotalAmount),
-                'TotalPayments': float(total_payments),
-                'TotalInvoices': float(total_invoices),
-                'SignDate': contract.SignDate.isoformat() if contract.SignDate else None,
-                'CompletionRate': completion_rate  # 添加完工率
-            })
-        
-        return jsonify(result)
+        try:
+            fields = parse_fields(request.args.get('fields'), SUPPLIER_CONTRACT_FIELDS)
+            format = parse_format(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        source = contract_source(archived_requested(request.args))
+        result = contract_rows(fields, has_supplier(Supplier.SupplierID == supplier_id, source), source=source)
+        
+        return list_response(result, fields, format)
+    
+    # 欠款/欠票账龄仪表盘
+    @app.route('/aging')
+    @response_cache.cached('contracts')
+    def aging_dashboard():
+        try:
+            report = aging_report(parse_as_of(request.args.get('as_of')),
+                                  include_archived=archived_requested(request.args))
+            error = None
+        except ValueError as e:
+            report, error = aging_report(include_archived=archived_requested(request.args)), str(e)
+        return render_template('aging.html', report=report, error=error)
+    
+    # 账龄汇总API：GET /api/aging?as_of=YYYY-MM-DD，include_archived=1 时计入归档的合同
+    @app.route('/api/aging')
+    @response_cache.cached('contracts')
+    def aging_summary_api():
+        try:
+            as_of = parse_as_of(request.args.get('as_of'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(aging_report(as_of, by=(), include_archived=archived_requested(request.args)))
+    
+    # 按客户/供应商分组的账龄API：GET /api/aging/clients、/api/aging/suppliers
+    @app.route('/api/aging/<any(clients, suppliers):group>')
+    @response_cache.cached('contracts')
+    def aging_group_api(group):
+        try:
+            as_of = parse_as_of(request.args.get('as_of'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        report = aging_report(as_of, by=(group,), include_archived=archived_requested(request.args))
+        return jsonify({'as_of': report['as_of'], 'buckets': report['buckets'], 'rows': report[group]})
+    
+    # 月度趋势API（回款/开票/成本/毛利）：GET /api/trends?start=YYYY-MM&end=YYYY-MM
+    @app.route('/api/trends')
+    @response_cache.cached('contracts', 'salary_costs')
+    def trends_api():
+        try:
+            months = month_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(company_trend(months))
+    
+    # 单个合同/客户/供应商的月度趋势：GET /api/trends/clients/3?start=...&end=...
+    @app.route('/api/trends/<any(contracts, clients, suppliers):group>/<int:entity_id>')
+    @response_cache.cached('contracts')
+    def entity_trend_api(group, entity_id):
+        model = {'contracts': Contract, 'clients': Client, 'suppliers': Supplier}[group]
+        # 已归档合同的月度合计仍在趋势中，也可以查询
+        if db.session.get(model, entity_id) is None and not (
+                group == 'contracts' and archived_contract_ids(contract_ids=[entity_id])):
+            abort(404)
+        try:
+            months = month_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(entity_trend(group, entity_id, months))
+    
+    # 按客户/供应商分组的月度趋势（月 × 客户、月 × 供应商）：GET /api/trends/clients
+    @app.route('/api/trends/<any(clients, suppliers):group>')
+    @response_cache.cached('contracts')
+    def group_trends_api(group):
+        try:
+            months = month_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(group_trends(group, months))
     
     # 获取工资薪金记录API
     @app.route('/api/salary_costs', methods=['GET'])
+    @response_cache.cached('salary_costs')
     def get_salary_costs():
-        salary_costs = FixedCost.query.filter_by(CostType="工资薪金").all()
+        try:
+            fields = parse_fields(request.args.get('fields'), SALARY_COST_FIELDS)
+            format = parse_format(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # 只读取请求的列，不载入 FixedCost 对象
+        salary_costs = (db.session.query(*(getattr(FixedCost, field) for field in fields))
+                        .filter(FixedCost.CostType == "工资薪金")
+                        .order_by(FixedCost.FixedCostID))
         result = []
         
         for cost in salary_costs:
-            result.append({
-                'FixedCostID': cost.FixedCostID,
-                'Month': cost.Month,
-                'Amount': float(cost.Amount),
-                'Description': cost.Description,
-                'CostDate': cost.CostDate.isoformat() if cost.CostDate else None
-            })
-        
-        return jsonify(result)
+            row = dict(zip(fields, cost))
+            if 'Amount' in row:
+                row['Amount'] = float(row['Amount'])
+            if 'CostDate' in row:
+                row['CostDate'] = row['CostDate'].isoformat() if row['CostDate'] else None
+            result.append(row)
+        
+        return list_response(result, fields, format, dictionary=('Month',))
     
     # 添加工资薪金记录API
     @app.route('/api/salary_costs', methods=['POST'])
@@ -456,6 +712,7 @@ def init_routes(app):
         )
         db.session.add(new_salary_cost)
         db.session.commit()
+        response_cache.invalidate('salary_costs')
         return jsonify({'message': '工资薪金记录添加成功', 'id': new_salary_cost.FixedCostID})
     
     # 删除工资薪金记录API
@@ -464,113 +721,111 @@ def init_routes(app):
         salary_cost = FixedCost.query.get_or_404(id)
         db.session.delete(salary_cost)
         db.session.commit()
+        response_cache.invalidate('salary_costs')
         return jsonify({'message': '工资薪金记录删除成功'})
     
     # 固定成本分摊计算API
     @app.route('/api/allocate_fixed_costs', methods=['POST'])
     def allocate_fixed_costs():
+        # 支持 month / months / start_month+end_month 以及 cost_type / cost_types，一次请求完成多月多类型分摊
         data = request.json
-        month = data['month']  # 格式: YYYY-MM
-        fixed_cost_type = data.get('cost_type', '工资薪金')
-        
-        # 获取当月固定成本总额
-        fixed_costs = FixedCost.query.filter(
-            FixedCost.Month == month,
-            FixedCost.CostType == fixed_cost_type
-        ).all()
-        
-        total_fixed_cost = sum([fc.Amount for fc in fixed_costs]) if fixed_costs else 0
-        
-        if total_fixed_cost == 0:
-            return jsonify({'error': f'当月没有{fixed_cost_type}记录'}), 400
-        
-        # 获取所有合同及其完工率
-        contracts = Contract.query.filter(Contract.CompletionRate > 0).all()
-        
-        if not contracts:
-            return jsonify({'error': '没有找到有完工率的合同'}), 400
-        
-        # 计算权重和总权重
-        weights = []
-        total_weight = 0
-        
-        for contract in contracts:
-            # 处理 CompletionRate 可能为 None 的情况
-            completion_rate = float(contract.CompletionRate) if contract.CompletionRate is not None else 0.0
-            weight = float(contract.TotalAmount) * completion_rate / 100
-            weights.append({
-                'contract_id': contract.ContractID,
-                'contract_name': contract.ProjectName,
-                'amount': float(contract.TotalAmount),
-                'completion_rate': completion_rate,
-                'weight': weight
-            })
-            total_weight += weight
-        
-        if total_weight == 0:
-            return jsonify({'error': '总权重为0，无法分摊成本'}), 400
-        
-        # 计算分配率
-        allocation_rate = total_fixed_cost / total_weight
-        
-        # 分配成本并保存到数据库
-        results = []
-        for weight_info in weights:
-            allocated_cost = allocation_rate * weight_info['weight']
-            
-            # 创建成本记录
-            new_cost = Cost(
-                ContractID=weight_info['contract_id'],
-                CostType=f"固定成本分摊-{fixed_cost_type}",
-                Amount=allocated_cost,
-                CostDate=datetime.strptime(month + '-01', '%Y-%m-%d').date(),
-                Description=f"{month}月份{fixed_cost_type}分摊"
-            )
-            db.session.add(new_cost)
-            
-            results.append({
-                'contract_id': weight_info['contract_id'],
-                'contract_name': weight_info['contract_name'],
-                'amount': weight_info['amount'],
-                'completion_rate': weight_info['completion_rate'],
-                'weight': weight_info['weight'],
-                'allocated_cost': allocated_cost
-            })
+        if _async_requested():
+            return _submit_job('allocate_fixed_costs', data)
+        try:
+            months = parse_months(data)
+            cost_types = parse_cost_types(data)
+            batches, skipped = run_allocation(months, cost_types)
+        except AllocationConflict as e:
+            return jsonify({'error': str(e)}), 409
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         db.session.commit()
-        
-        return jsonify({
-            'total_fixed_cost': total_fixed_cost,
-            'total_weight': total_weight,
-            'allocation_rate': allocation_rate,
-            'results': results
-        })
+        response_cache.invalidate('contracts')
+        return jsonify(allocation_response(batches, skipped))
+    
+    # 固定成本分摊批次查询API
+    @app.route('/api/allocation_runs', methods=['GET'])
+    def get_allocation_runs():
+        query = AllocationRun.query
+        if request.args.get('month'):
+            query = query.filter(AllocationRun.Month == request.args['month'])
+        if request.args.get('cost_type'):
+            query = query.filter(AllocationRun.CostType == request.args['cost_type'])
+        runs = query.order_by(AllocationRun.Month, AllocationRun.CostType).all()
+        return jsonify([serialize_run(run) for run in runs])
+    
+    # 撤销固定成本分摊批次API
+    @app.route('/api/allocation_runs/<int:run_id>', methods=['DELETE'])
+    def delete_allocation_run_api(run_id):
+        run = AllocationRun.query.get_or_404(run_id)
+        try:
+            delete_allocation_run(run)
+        except AllocationConflict as e:
+            return jsonify({'error': str(e)}), 409
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        db.session.commit()
+        response_cache.invalidate('contracts')
+        return jsonify({'message': '分摊批次已撤销'})
     @app.route('/supplier/<int:supplier_id>/reconciliation')
     def supplier_reconciliation(supplier_id):
         supplier = Supplier.query.get_or_404(supplier_id)
-        reconciliations = SupplierReconciliation.query.filter_by(SupplierID=supplier_id).order_by(SupplierReconciliation.TransactionDate).all()
         
-        # 计算余额
-        balance = 0
-        reconciliation_data = []
-        for recon in reconciliations:
-            balance = recon.get_balance(balance)
-            reconciliation_data.append({
-                'ReconciliationID': recon.ReconciliationID,
-                'TransactionDate': recon.TransactionDate.strftime('%Y-%m-%d') if recon.TransactionDate else '',
-                'PaymentAmount': float(recon.PaymentAmount),
-                'InvoiceAmount': float(recon.InvoiceAmount),
-                'Balance': float(balance),
-                'Description': recon.Description,
-                'CustomField1': recon.CustomField1,
-                'CustomField2': recon.CustomField2,
-                'CustomField3': recon.CustomField3
-            })
+        # 只读取当前页/日期区间的记录，余额由月初快照推算
+        filters = request.args.to_dict()
+        filters.pop('cursor', None)
+        try:
+            page = reconciliation_page(supplier_id, request.args)
+            error = None
+        except ValueError as e:
+            page = {'rows': [], 'opening_balance': 0, 'closing_balance': 0, 'next_cursor': None}
+            error = str(e)
+        balance = final_balance(supplier_id)
+        save_checkpoints()
+        
+        next_url = url_for('supplier_reconciliation', supplier_id=supplier_id,
+                           cursor=page['next_cursor'], **filters) if page['next_cursor'] else None
+        first_url = url_for('supplier_reconciliation', supplier_id=supplier_id,
+                            **filters) if request.args.get('cursor') else None
         
         return render_template('reconciliation.html', 
                             supplier=supplier, 
-                            reconciliations=reconciliation_data,
-                            balance=balance)
+                            reconciliations=page['rows'],
+                            opening_balance=page['opening_balance'],
+                            balance=float(balance),
+                            filters=filters,
+                            next_url=next_url,
+                            first_url=first_url,
+                            error=error)
+
+    # 对账记录查询API（分页/日期区间，带累计余额）
+    @app.route('/api/suppliers/<int:supplier_id>/reconciliation', methods=['GET'])
+    def get_supplier_reconciliation(supplier_id):
+        Supplier.query.get_or_404(supplier_id)
+        try:
+            page = reconciliation_page(supplier_id, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        page['final_balance'] = float(final_balance(supplier_id))
+        save_checkpoints()
+        return jsonify(page)
+    
+    def reconciliation_change(action, reconciliation, previous=None):
+        # 变更行的累计余额和供应商最终余额；计算中补齐的月初快照随后提交
+        supplier_id = reconciliation.SupplierID
+        row = html = None
+        if action != 'deleted':
+            balance = balance_through(supplier_id, reconciliation.TransactionDate, reconciliation.ReconciliationID)
+            row = serialize_reconciliation(reconciliation, balance)
+            html = render_row('reconciliation_row', row)
+        if previous is not None:
+            previous.pop('Balance', None)
+        supplier = {'SupplierID': supplier_id, 'FinalBalance': float(final_balance(supplier_id))}
+        save_checkpoints()
+        return publish_change('reconciliation', action,
+                              previous['ReconciliationID'] if previous else row['ReconciliationID'],
+                              row=row, previous=previous, html=html, supplier=supplier)
 
     # 添加对账记录API
     @app.route('/api/supplier_reconciliation', methods=['POST'])
@@ -587,22 +842,27 @@ def init_routes(app):
             CustomField3=data.get('CustomField3', '')
         )
         db.session.add(new_reconciliation)
+        invalidate_checkpoints(new_reconciliation.SupplierID, new_reconciliation.TransactionDate)
         db.session.commit()
-        return jsonify({'message': '对账记录添加成功', 'id': new_reconciliation.ReconciliationID})
+        return jsonify(dict(reconciliation_change('created', new_reconciliation), message='对账记录添加成功'))
 
     # 删除对账记录API
     @app.route('/api/supplier_reconciliation/<int:id>', methods=['DELETE'])
     def delete_supplier_reconciliation(id):
         reconciliation = SupplierReconciliation.query.get_or_404(id)
+        previous = serialize_reconciliation(reconciliation, 0)
         db.session.delete(reconciliation)
+        invalidate_checkpoints(reconciliation.SupplierID, reconciliation.TransactionDate)
         db.session.commit()
-        return jsonify({'message': '对账记录删除成功'})
+        return jsonify(dict(reconciliation_change('deleted', reconciliation, previous), message='对账记录删除成功'))
 
     # 更新对账记录API
     @app.route('/api/supplier_reconciliation/<int:id>', methods=['PUT'])
     def update_supplier_reconciliation(id):
         reconciliation = SupplierReconciliation.query.get_or_404(id)
         data = request.json
+        old_date = reconciliation.TransactionDate
+        previous = serialize_reconciliation(reconciliation, 0)
         
         reconciliation.TransactionDate = datetime.strptime(data['TransactionDate'], '%Y-%m-%d').date()
         reconciliation.PaymentAmount = data.get('PaymentAmount', 0)
@@ -611,9 +871,151 @@ def init_routes(app):
         reconciliation.CustomField1 = data.get('CustomField1', '')
         reconciliation.CustomField2 = data.get('CustomField2', '')
         reconciliation.CustomField3 = data.get('CustomField3', '')
+        invalidate_checkpoints(reconciliation.SupplierID, old_date, reconciliation.TransactionDate)
         
         db.session.commit()
-        return jsonify({'message': '对账记录更新成功'})
+        return jsonify(dict(reconciliation_change('updated', reconciliation, previous), message='对账记录更新成功'))
+    
+    # 增量同步：返回版本号 since 之后的新增/修改（当前行）和删除（墓碑），客户端保存返回的 version 供下次使用
+    @app.route('/api/changes')
+    def changes_api():
+        try:
+            since = max(int(request.args.get('since', 0)), 0)
+            limit = min(max(int(request.args.get('limit', CHANGES_DEFAULT_LIMIT)), 1), CHANGES_MAX_LIMIT)
+        except ValueError:
+            return jsonify({'error': 'since 和 limit 必须是整数'}), 400
+        return jsonify(read_changes(since, limit, app.config.get('CHANGE_FEED_WRITER_TIMEOUT', 3600)))
+    
+    # 实时推送：写接口产生的变更（server-sent events），页面用 EventSource 订阅
+    @app.route('/api/events')
+    def events():
+        subscriber = event_broker.subscribe()
+        if subscriber is None:
+            return jsonify({'error': '实时推送连接数已满'}), 503
+        # 响应体在请求结束后才逐条发送，不使用数据库连接
+        return Response(event_broker.stream(subscriber), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    # 后台任务：提交后返回 202 和任务状态，按 Location 轮询进度（见 app/jobs.py）
+    def _submit_job(job_type, params):
+        try:
+            job = job_runner.submit(job_type, params)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except JobQueueFull as e:
+            return jsonify({'error': str(e)}), 503
+        response = jsonify(serialize_job(job))
+        response.status_code = 202
+        response.headers['Location'] = url_for('job_status', job_id=job.JobID)
+        return response
+    
+    @app.route('/api/jobs', methods=['GET', 'POST'])
+    def jobs_api():
+        if request.method == 'POST':
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict) or not data.get('type'):
+                return jsonify({'error': '请求体应为 {"type": 任务类型, "params": {...}}'}), 400
+            if not isinstance(data.get('params') or {}, dict):
+                return jsonify({'error': 'params 应为对象'}), 400
+            return _submit_job(data['type'], data.get('params'))
+        
+        # 最近的任务，可按 status、type 筛选
+        try:
+            limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        except ValueError:
+            return jsonify({'error': 'limit 必须是整数'}), 400
+        query = Job.query
+        if request.args.get('status'):
+            query = query.filter(Job.Status == request.args['status'])
+        if request.args.get('type'):
+            query = query.filter(Job.JobType == request.args['type'])
+        jobs = query.order_by(Job.JobID.desc()).limit(limit).all()
+        return jsonify([serialize_job(job) for job in jobs])
+    
+    @app.route('/api/jobs/<int:job_id>')
+    def job_status(job_id):
+        job = job_runner.get(job_id)
+        if job is None:
+            abort(404)
+        return jsonify(serialize_job(job))
+    
+    @app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+    def cancel_job(job_id):
+        job = job_runner.get(job_id)
+        if job is None:
+            abort(404)
+        if job.Status not in JOB_ACTIVE:
+            return jsonify(dict(serialize_job(job), error='任务已结束，不能取消')), 409
+        return jsonify(serialize_job(job_runner.cancel(job)))
+    
+    @app.route('/api/jobs/<int:job_id>/result')
+    def job_result(job_id):
+        job = job_runner.get(job_id)
+        if job is None:
+            abort(404)
+        if job.Status in JOB_ACTIVE:
+            return jsonify(dict(serialize_job(job), error='任务尚未完成')), 409
+        if job.ResultFile:
+            if not os.path.exists(job.ResultFile):
+                return jsonify({'error': '结果文件已删除'}), 410
+            result = json.loads(job.Result)
+            return send_file(job.ResultFile, mimetype=result['mimetype'], as_attachment=True,
+                             download_name=result['filename'])
+        if job.Result is None:
+            return jsonify(dict(serialize_job(job), error='任务没有结果')), 409
+        # 失败的任务也可能有结果（如导入的校验错误），状态码与同步接口一致
+        return Response(job.Result, status=200 if job.Status == 'succeeded' else 400,
+                        mimetype='application/json')
+    
+    # 已结清合同的归档（见 app/archive.py）：默认查询只读取流水表，归档数据通过以下接口明确读取
+    @app.route('/api/archive', methods=['GET', 'POST'])
+    def archive_summary_api():
+        if request.method == 'POST':
+            # 归档 {"through_year": 财年（默认上一个财年）, "dry_run": false}，以后台任务执行
+            return _submit_job('archive_contracts', request.get_json(silent=True) or {})
+        return jsonify({'current_fiscal_year': current_fiscal_year(), 'fiscal_years': archive_summary()})
+    
+    # 恢复归档的合同：{"fiscal_year": 财年} 或 {"ids": [...]}，以后台任务执行
+    @app.route('/api/archive/restore', methods=['POST'])
+    def restore_archive_api():
+        return _submit_job('restore_contracts', request.get_json(silent=True) or {})
+    
+    # 归档合同列表：fiscal_year、client_id、cursor、limit，下一页游标放在 X-Next-Cursor 响应头中
+    @app.route('/api/archive/contracts')
+    def archived_contracts_api():
+        try:
+            result, next_cursor = archived_contract_rows(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response = jsonify(result)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = str(next_cursor)
+        return response
+    
+    # 一个归档合同及其全部付款/发票/成本
+    @app.route('/api/archive/contracts/<int:contract_id>')
+    def archived_contract_api(contract_id):
+        result = archived_contract(contract_id)
+        if result is None:
+            abort(404)
+        return jsonify(result)
+    
+    # 数据导出：/export/<contracts|payments|invoices|costs|fixed_costs|reconciliation>?format=csv|xlsx
+    @app.route('/export/<string:dataset>')
+    def export_data(dataset):
+        if _async_requested():
+            args = {key: value for key, value in request.args.items() if key not in ('format', 'async')}
+            return _submit_job('export', {'dataset': dataset, 'format': request.args.get('format', 'csv'),
+                                          'args': args})
+        try:
+            mimetype, filename, stream = export_stream(dataset, request.args.get('format', 'csv'), request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # 边查询边输出，不在内存中生成整个文件
+        response = Response(stream_with_context(stream), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        return response
     
     # 测试路由
     @app.route('/test')
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""数据库结构版本管理
+
+迁移脚本放在 app/migrations/ 下，文件名为 "四位版本号_说明.py"，按版本号顺序执行。
+每个脚本提供 upgrade(connection) 函数，执行成功后在 SchemaVersions 表记录版本号，
+同一个脚本只会执行一次。迁移只由命令 flask --app run.py upgrade-db 执行，
+应用启动时只读取一次当前版本号。
+"""
+import importlib
+import os
+import re
+from sqlalchemy import func, inspect, text
+from sqlalchemy.exc import DBAPIError
+from app import db
+from app.models import SchemaVersion
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+_FILE_PATTERN = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+
+def available_migrations():
+    """按版本号排序的 [(版本号, 名称, 模块)]"""
+    migrations = []
+    for file_name in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = _FILE_PATTERN.match(file_name)
+        if match:
+            module = importlib.import_module(f'app.migrations.{file_name[:-3]}')
+            migrations.append((int(match.group(1)), match.group(2), module))
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError('迁移脚本版本号重复')
+    return migrations
+
+
+def head_version():
+    """最新的迁移版本号，只读取文件名，不导入脚本"""
+    versions = [int(match.group(1)) for match in map(_FILE_PATTERN.match, os.listdir(MIGRATIONS_DIR)) if match]
+    return max(versions, default=0)
+
+
+def current_version():
+    """数据库当前版本号，一条查询；还没有版本表时返回 0"""
+    try:
+        return db.session.query(func.max(SchemaVersion.Version)).scalar() or 0
+    except DBAPIError:
+        db.session.rollback()
+        # 只有版本表确实不存在时才视为版本 0，连接失败等错误照常抛出
+        if inspect(db.engine).has_table(SchemaVersion.__tablename__):
+            raise
+        return 0
+
+
+def _lock(connection):
+    """SQL Server 上用应用锁保证同一时间只有一个进程执行迁移，锁随事务释放"""
+    if connection.dialect.name == 'mssql':
+        connection.execute(text(
+            "EXEC sp_getapplock @Resource = 'SchemaVersions', @LockMode = 'Exclusive', "
+            "@LockOwner = 'Transaction', @LockTimeout = 600000"
+        ))
+
+
+def upgrade(target=None, echo=print):
+    """依次执行未执行过的迁移脚本，每个脚本与其版本记录在同一事务中提交
+
+    target 为 None 时升级到最新版本。返回本次执行的版本号列表。
+    """
+    migrations = available_migrations()
+    SchemaVersion.__table__.create(db.engine, checkfirst=True)
+
+    applied = []
+    for version, name, module in migrations:
+        if target is not None and version > target:
+            break
+        connection = db.session.connection()
+        _lock(connection)
+        # 加锁后再读版本，其他进程可能刚执行完同一个脚本
+        if db.session.get(SchemaVersion, version) is not None:
+            db.session.commit()
+            continue
+        echo(f"执行迁移 {version:04d}_{name} ...")
+        try:
+            module.upgrade(connection)
+            db.session.add(SchemaVersion(Version=version, Name=name))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def check_schema_version(echo=print):
+    """启动时的版本检查：只读取一次版本号，落后时提示执行迁移命令，不修改数据库"""
+    version, head = current_version(), head_version()
+    if version < head:
+        echo(f"数据库结构版本 {version}，最新版本 {head}，请运行 flask --app run.py upgrade-db")
+    elif version > head:
+        echo(f"数据库结构版本 {version} 比当前代码的 {head} 新，请更新代码")
+    else:
+        echo(f"数据库结构版本 {version}（最新）")
+    return version, head
+
+
+# ---------- 迁移脚本使用的工具函数 ----------
+
+def create_tables(connection, *table_names):
+    """按模型定义创建尚不存在的表（连同表上定义的索引），不指定表名时创建全部"""
+    tables = [db.metadata.tables[name] for name in table_names] if table_names else None
+    db.metadata.create_all(connection, tables=tables, checkfirst=True)
+
+
+def add_column(connection, table_name, column_name, ddl):
+    """表中没有该字段时执行 ALTER TABLE ... ADD <ddl>，已有的库重复执行不会出错"""
+    columns = {column['name'] for column in inspect(connection).get_columns(table_name)}
+    if column_name not in columns:
+        connection.execute(text(f"ALTER TABLE {table_name} ADD {ddl}"))
+
+
+def create_index(connection, table_name, index_name):
+    """按模型中定义的同名索引创建索引（已存在时跳过）"""
+    existing = {index['name'] for index in inspect(connection).get_indexes(table_name)}
+    if index_name not in existing:
+        index = next(index for index in db.metadata.tables[table_name].indexes if index.name == index_name)
+        index.create(connection)
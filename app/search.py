@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import heapq
+import threading
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 未安装 pypinyin 时使用 GB2312 编码区间推算首字母
+    lazy_pinyin = None
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# GB2312 一级汉字按拼音排序，各首字母的起始编码
+_GB2312_INITIALS = (
+    (45217, 'a'), (45253, 'b'), (45761, 'c'), (46318, 'd'), (46826, 'e'),
+    (47010, 'f'), (47297, 'g'), (47614, 'h'), (48119, 'j'), (49062, 'k'),
+    (49324, 'l'), (49896, 'm'), (50371, 'n'), (50614, 'o'), (50622, 'p'),
+    (50906, 'q'), (51387, 'r'), (51446, 's'), (52218, 't'), (52698, 'w'),
+    (52980, 'x'), (53689, 'y'), (54481, 'z'),
+)
+_GB2312_END = 55290
+
+
+def _char_initial(char):
+    """单个字符的拼音首字母，字母数字原样返回，无法识别的字符返回空串"""
+    if char.isascii():
+        return char if char.isalnum() else ''
+    try:
+        encoded = char.encode('gb2312')
+    except UnicodeEncodeError:
+        return ''
+    if len(encoded) != 2:
+        return ''
+    code = encoded[0] << 8 | encoded[1]
+    if code < _GB2312_INITIALS[0][0] or code >= _GB2312_END:
+        return ''
+    initial = ''
+    for start, letter in _GB2312_INITIALS:
+        if code < start:
+            break
+        initial = letter
+    return initial
+
+
+def pinyin_initials(text):
+    """名称的拼音首字母串，例如 "华为供应" -> "hwgy" """
+    if lazy_pinyin is not None:
+        return ''.join(p[0] for p in lazy_pinyin(text, style=Style.FIRST_LETTER) if p and p[0].isalnum()).lower()
+    return ''.join(_char_initial(char) for char in text.lower())
+
+
+def normalize(text):
+    return (text or '').strip().casefold()
+
+
+def _grams(text):
+    """单字和相邻两字的 n-gram"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _shared_versions():
+    from app.cache import response_cache
+    return response_cache.backend
+
+
+class NameIndex:
+    """名称模糊搜索索引：n-gram 倒排表 + 拼音首字母，进程内维护
+
+    每个进程各自维护一份索引，启动时由 refresh 载入。写接口提交后调用 changed：本进程增量更新，
+    同时把共享版本号（与响应缓存的标签版本同一后端，多进程部署时为 Redis）加一；
+    其他进程搜索前由 sync 发现版本号变化，从数据库重新载入。
+    """
+
+    def __init__(self, tag, load):
+        self.tag = tag          # 共享版本号的标签
+        self._load = load       # 返回 (id, 名称) 序列的函数
+        self.version = None     # 载入时的共享版本号
+        self._lock = threading.Lock()
+        self._names = {}     # id -> 原始名称
+        self._keys = {}      # id -> (规范化名称, 拼音首字母)
+        self._postings = {}  # n-gram -> {id}
+
+    def __len__(self):
+        return len(self._names)
+
+    def _add(self, item_id, name):
+        key = normalize(name)
+        initials = pinyin_initials(key)
+        self._names[item_id] = name
+        self._keys[item_id] = (key, initials)
+        for gram in _grams(key) | _grams(initials):
+            self._postings.setdefault(gram, set()).add(item_id)
+
+    def _remove(self, item_id):
+        keys = self._keys.pop(item_id, None)
+        self._names.pop(item_id, None)
+        if keys is None:
+            return
+        key, initials = keys
+        for gram in _grams(key) | _grams(initials):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def rebuild(self, items):
+        """用 (id, 名称) 序列重建整个索引"""
+        with self._lock:
+            self._names, self._keys, self._postings = {}, {}, {}
+            for item_id, name in items:
+                self._add(item_id, name)
+
+    def upsert(self, item_id, name):
+        with self._lock:
+            self._remove(item_id)
+            self._add(item_id, name)
+
+    def remove(self, item_id):
+        with self._lock:
+            self._remove(item_id)
+
+    def refresh(self):
+        """从数据库重新载入；先读版本号再读数据，载入期间的修改会在下次 sync 时再次载入"""
+        version, = _shared_versions().get_versions([self.tag])
+        self.rebuild(self._load())
+        self.version = version
+
+    def sync(self):
+        """其他进程修改过名称时重新载入，每次搜索前调用"""
+        version, = _shared_versions().get_versions([self.tag])
+        if version != self.version:
+            self.refresh()
+
+    def changed(self, item_id, name=None):
+        """写操作提交后调用：name 为 None 表示已删除"""
+        if name is None:
+            self.remove(item_id)
+        else:
+            self.upsert(item_id, name)
+        version, = _shared_versions().bump([self.tag])
+        with self._lock:
+            # 版本号只比载入时多一，说明期间没有其他进程的修改，本进程的索引已是最新
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+
+    def _candidates(self, term):
+        grams = [term] if len(term) == 1 else [term[i:i + 2] for i in range(len(term) - 1)]
+        postings = [self._postings.get(gram) for gram in grams]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        return set.intersection(*postings)
+
+    @staticmethod
+    def _rank(term, key, initials):
+        """匹配等级，越小越靠前；不匹配返回 None"""
+        if key == term:
+            return 0
+        if key.startswith(term):
+            return 1
+        if initials.startswith(term):
+            return 2
+        if term in key:
+            return 3
+        if term in initials:
+            return 4
+        return None
+
+    def search(self, term, limit=DEFAULT_LIMIT):
+        """返回按匹配程度排序的 [(id, 名称)]，最多 limit 条；空关键字按名称返回前 limit 条"""
+        term = normalize(term)
+        with self._lock:
+            if not term:
+                return heapq.nsmallest(limit, self._names.items(), key=lambda item: item[1])
+
+            ranked = []
+            for item_id in self._candidates(term):
+                key, initials = self._keys[item_id]
+                rank = self._rank(term, key, initials)
+                if rank is not None:
+                    ranked.append((rank, len(key), key, item_id))
+            ranked.sort()
+            return [(item_id, self._names[item_id]) for _, _, _, item_id in ranked[:limit]]
+
+
+def _load_suppliers():
+    from app import db
+    from app.models import Supplier
+    return db.session.query(Supplier.SupplierID, Supplier.SupplierName)
+
+
+def _load_clients():
+    from app import db
+    from app.models import Client
+    return db.session.query(Client.ClientID, Client.ClientName)
+
+
+supplier_index = NameIndex('search:suppliers', _load_suppliers)
+client_index = NameIndex('search:clients', _load_clients)
+
+
+def rebuild_search_indexes():
+    """从数据库重建供应商/客户搜索索引（只读取ID和名称两列）"""
+    supplier_index.refresh()
+    client_index.refresh()
+
+
+def parse_limit(value):
+    """解析 limit 参数，非法值使用默认值"""
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
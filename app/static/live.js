@@ -0,0 +1,75 @@
+// 写操作的增量更新：写接口的响应和 /api/events 推送的是同一种"变更"（见 app/live.py），
+// 页面据此就地替换/插入/删除表格行，不再整页刷新
+(function (window, $) {
+    // 每个页面一个标识，写请求都带上；推送回来的变更中 origin 相同的是自己发起的，已经按响应处理过
+    const clientId = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+    $.ajaxSetup({ headers: { 'X-Client-ID': clientId } });
+
+    function rowSelector(id) {
+        return `tr[data-id="${id}"]`;
+    }
+
+    const Live = {
+        clientId: clientId,
+
+        // 按 data-id 替换表格行，不存在时插入（默认追加到末尾，prepend 为 true 时插入到开头）
+        upsertRow: function (tbody, id, html, prepend) {
+            const $tbody = $(tbody);
+            const $row = $($.parseHTML(html.trim()));
+            const $old = $tbody.children(rowSelector(id));
+            if ($old.length) {
+                $old.replaceWith($row);
+            } else if (prepend) {
+                $tbody.prepend($row);
+            } else {
+                $tbody.append($row);
+            }
+            return $row;
+        },
+
+        // 只替换页面上已有的行（行不在当前页/筛选结果中时不插入）
+        replaceRow: function (tbody, id, html) {
+            const $old = $(tbody).children(rowSelector(id));
+            if (!$old.length) return null;
+            const $row = $($.parseHTML(html.trim()));
+            $old.replaceWith($row);
+            return $row;
+        },
+
+        removeRow: function (tbody, id) {
+            $(tbody).children(rowSelector(id)).remove();
+        },
+
+        // 按变更更新一行：删除时移除，否则替换/插入变更中的 html
+        applyRow: function (tbody, change, prepend) {
+            if (change.action === 'deleted') {
+                Live.removeRow(tbody, change.id);
+                return null;
+            }
+            return Live.upsertRow(tbody, change.id, change.html, prepend);
+        },
+
+        money: function (value) {
+            return '¥' + (Number(value) || 0).toFixed(2);
+        },
+
+        // 与模板过滤器 number_format 相同：千分位、两位小数
+        numberFormat: function (value) {
+            return (Number(value) || 0).toLocaleString('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 });
+        },
+
+        // 订阅其他页面的变更；连接数已满或浏览器不支持时静默放弃，页面照常工作
+        subscribe: function (handler) {
+            if (!window.EventSource) return null;
+            const source = new EventSource('/api/events');
+            source.addEventListener('change', function (event) {
+                const change = JSON.parse(event.data);
+                if (change.origin === clientId) return;
+                handler(change);
+            });
+            return source;
+        }
+    };
+
+    window.Live = Live;
+})(window, jQuery);
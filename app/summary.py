@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from types import SimpleNamespace
+from sqlalchemy import func, select, union_all
+from app import db
+from app.models import (Client, Supplier, Contract, Payment, Invoice, Cost, ContractTotal, contract_supplier,
+                        archived_contracts, archived_contract_totals, archived_contract_suppliers)
+from app.utils import chunked
+
+# 各页面/接口返回的合同字段（与原先逐个合同计算时的字段保持一致）
+INDEX_FIELDS = (
+    'ContractID', 'ProjectName', 'ContractNumber', 'TotalAmount', 'Supplier', 'Client',
+    'TotalPayments', 'TotalInvoices', 'TotalCosts', 'IsOverBudget', 'SignDate', 'CompletionRate'
+)
+CONTRACT_LIST_FIELDS = (
+    'ContractID', 'ProjectName', 'ContractNumber', 'TotalAmount', 'Supplier', 'Client', 'ClientID',
+    'SignDate', 'CompletionRate', 'TotalPayments', 'TotalInvoices', 'TotalCosts',
+    'RemainingAmount', 'IsOverBudget'
+)
+CLIENT_CONTRACT_FIELDS = (
+    'ContractID', 'ProjectName', 'ContractNumber', 'TotalAmount', 'TotalPayments', 'TotalInvoices',
+    'RemainingPayment', 'RemainingInvoice', 'SignDate', 'CompletionRate'
+)
+SUPPLIER_CONTRACT_FIELDS = (
+    'ContractID', 'ProjectName', 'ContractNumber', 'TotalAmount', 'TotalPayments', 'TotalInvoices',
+    'SignDate', 'CompletionRate'
+)
+
+_EMPTY_TOTALS = {'TotalPayments': 0, 'TotalInvoices': 0, 'TotalCosts': 0}
+
+# 合同数据的来源：(合同表, 合同合计表, 合同-供应商关联表)，按列读取的查询都通过它取列
+ContractSource = namedtuple('ContractSource', 'contracts totals suppliers')
+HOT_CONTRACTS = ContractSource(Contract.__table__, ContractTotal.__table__, contract_supplier)
+
+
+def archived_requested(args):
+    """查询参数 include_archived=1 时同时读取归档的合同（见 app/archive.py）"""
+    return args.get('include_archived', '') in ('1', 'true')
+
+
+def _with_archived(table, archived, alias):
+    """流水表和归档表 UNION ALL 成列名相同的子查询（归档表多出的 ArchivedDate 等列不读取）"""
+    names = [column.name for column in table.columns]
+    return union_all(select(table), select(*[archived.c[name] for name in names])).subquery(alias)
+
+
+def contract_source(include_archived=False):
+    """合同数据的来源，include_archived 为 True 时三张表都是流水表与归档表的 UNION ALL"""
+    if not include_archived:
+        return HOT_CONTRACTS
+    return ContractSource(_with_archived(Contract.__table__, archived_contracts, 'AllContracts'),
+                          _with_archived(ContractTotal.__table__, archived_contract_totals, 'AllContractTotals'),
+                          _with_archived(contract_supplier, archived_contract_suppliers, 'AllContractSuppliers'))
+
+
+# 字段名 -> 取值函数(合同, 合计)，只计算请求的字段，避免触发不需要的关系加载
+_FIELD_GETTERS = {
+    'ContractID': lambda c, t: c.ContractID,
+    'ProjectName': lambda c, t: c.ProjectName,
+    'ContractNumber': lambda c, t: c.ContractNumber,
+    'TotalAmount': lambda c, t: float(c.TotalAmount),
+    'Supplier': lambda c, t: ', '.join([s.SupplierName for s in c.suppliers]) if c.suppliers else '',
+    'Client': lambda c, t: c.client.ClientName if c.client else '',
+    'ClientID': lambda c, t: c.ClientID,
+    'SignDate': lambda c, t: c.SignDate.isoformat() if c.SignDate else None,
+    # 处理 CompletionRate 可能为 None 的情况
+    'CompletionRate': lambda c, t: float(c.CompletionRate) if c.CompletionRate is not None else 0.0,
+    'TotalPayments': lambda c, t: float(t['TotalPayments']),
+    'TotalInvoices': lambda c, t: float(t['TotalInvoices']),
+    'TotalCosts': lambda c, t: float(t['TotalCosts']),
+    'RemainingAmount': lambda c, t: float(c.TotalAmount) - float(t['TotalPayments']),
+    'RemainingPayment': lambda c, t: float(c.TotalAmount) - float(t['TotalPayments']),
+    'RemainingInvoice': lambda c, t: float(c.TotalAmount) - float(t['TotalInvoices']),
+    'IsOverBudget': lambda c, t: t['TotalCosts'] > c.TotalAmount,
+}
+
+
+# 按列读取时各字段需要的合同列和合计列（Client/Supplier 另行处理），见 select_contracts
+_FIELD_COLUMNS = {
+    'ProjectName': ('ProjectName',),
+    'ContractNumber': ('ContractNumber',),
+    'TotalAmount': ('TotalAmount',),
+    'ClientID': ('ClientID',),
+    'SignDate': ('SignDate',),
+    'CompletionRate': ('CompletionRate',),
+    'RemainingAmount': ('TotalAmount',),
+    'RemainingPayment': ('TotalAmount',),
+    'RemainingInvoice': ('TotalAmount',),
+    'IsOverBudget': ('TotalAmount',),
+}
+_FIELD_TOTALS = {
+    'TotalPayments': ('TotalPayments',),
+    'TotalInvoices': ('TotalInvoices',),
+    'TotalCosts': ('TotalCosts',),
+    'RemainingAmount': ('TotalPayments',),
+    'RemainingPayment': ('TotalPayments',),
+    'RemainingInvoice': ('TotalInvoices',),
+    'IsOverBudget': ('TotalCosts',),
+}
+
+
+def _sum_by_contract(model, contract_ids=None):
+    """按合同分组汇总某张流水表的金额"""
+    query = db.session.query(model.ContractID, func.sum(model.Amount)).group_by(model.ContractID)
+    if contract_ids is not None:
+        query = query.filter(model.ContractID.in_(contract_ids))
+    return {contract_id: total or 0 for contract_id, total in query}
+
+
+def compute_contract_totals(contract_ids=None):
+    """直接扫描流水表，用三条分组聚合查询计算合同的付款/发票/成本合计
+
+    contract_ids 可以是合同ID列表或返回 ContractID 的子查询，为 None 时统计全部合同。
+    返回 {ContractID: {'TotalPayments': Decimal, 'TotalInvoices': Decimal, 'TotalCosts': Decimal}}
+    """
+    columns = (
+        ('TotalPayments', Payment),
+        ('TotalInvoices', Invoice),
+        ('TotalCosts', Cost),
+    )
+    totals = {}
+    for key, model in columns:
+        for contract_id, amount in _sum_by_contract(model, contract_ids).items():
+            totals.setdefault(contract_id, dict(_EMPTY_TOTALS))[key] = amount
+    return totals
+
+
+def get_contract_totals(contract_ids=None):
+    """从 ContractTotals 汇总表读取合同合计，一条查询，不扫描流水表
+
+    参数和返回值与 compute_contract_totals 相同。
+    """
+    query = db.session.query(
+        ContractTotal.ContractID,
+        ContractTotal.TotalPayments,
+        ContractTotal.TotalInvoices,
+        ContractTotal.TotalCosts
+    )
+    if contract_ids is not None:
+        query = query.filter(ContractTotal.ContractID.in_(contract_ids))
+    return {
+        contract_id: {
+            'TotalPayments': payments,
+            'TotalInvoices': invoices,
+            'TotalCosts': costs,
+        }
+        for contract_id, payments, invoices, costs in query
+    }
+
+
+def serialize_contract(contract, totals, fields):
+    """把合同和它的合计数据转换为字典，只包含 fields 中的字段"""
+    contract_totals = totals.get(contract.ContractID, _EMPTY_TOTALS)
+    return {field: _FIELD_GETTERS[field](contract, contract_totals) for field in fields}
+
+
+def summarize_contracts(fields, *criteria, options=()):
+    """查询满足条件的合同并附带合计，查询次数与合同数量无关"""
+    contracts = Contract.query.options(*options).filter(*criteria).all()
+    contract_ids = select(Contract.ContractID).where(*criteria) if criteria else None
+    totals = get_contract_totals(contract_ids)
+    return [serialize_contract(contract, totals, fields) for contract in contracts]
+
+
+# ---------- 客户汇总（欠款/欠票） ----------
+
+def _client_headers(client_ids=None, source=HOT_CONTRACTS):
+    """按客户分组汇总合同数、合同金额、已付款、已开票，一条分组查询（每 1000 个客户一条）
+
+    欠款 = 合同金额 - 已付款，欠票 = 合同金额 - 已开票，与客户合同明细的 RemainingPayment/RemainingInvoice 一致。
+    没有合同的客户各项为 0。client_ids 为 None 时汇总全部客户。
+    """
+    contracts, totals = source.contracts.c, source.totals.c
+    payments = func.coalesce(func.sum(totals.TotalPayments), 0)
+    invoices = func.coalesce(func.sum(totals.TotalInvoices), 0)
+    amount = func.coalesce(func.sum(contracts.TotalAmount), 0)
+    stmt = (select(Client.ClientID, Client.ClientName, func.count(contracts.ContractID), amount, payments, invoices)
+            .join(source.contracts, contracts.ClientID == Client.ClientID, isouter=True)
+            .join(source.totals, totals.ContractID == contracts.ContractID, isouter=True)
+            .group_by(Client.ClientID, Client.ClientName)
+            .order_by(Client.ClientID))
+
+    batches = [None] if client_ids is None else chunked(client_ids)
+    headers = {}
+    for ids in batches:
+        query = stmt if ids is None else stmt.where(Client.ClientID.in_(ids))
+        for client_id, name, count, total_amount, total_payments, total_invoices in db.session.execute(query):
+            headers[client_id] = {
+                'ClientID': client_id,
+                'ClientName': name,
+                'ContractCount': count,
+                'TotalAmount': float(total_amount),
+                'TotalPayments': float(total_payments),
+                'TotalInvoices': float(total_invoices),
+                'RemainingPayment': float(total_amount) - float(total_payments),
+                'RemainingInvoice': float(total_amount) - float(total_invoices),
+            }
+    return headers
+
+
+def _client_contract_lines(client_ids, source=HOT_CONTRACTS):
+    """客户的合同明细（字段同 CLIENT_CONTRACT_FIELDS），一条查询，返回 {ClientID: [合同]}"""
+    contracts, totals = source.contracts.c, source.totals.c
+    lines = {}
+    for ids in chunked(client_ids):
+        rows = db.session.execute(
+            select(contracts.ClientID, contracts.ContractID, contracts.ProjectName, contracts.ContractNumber,
+                   contracts.TotalAmount, totals.TotalPayments, totals.TotalInvoices,
+                   contracts.SignDate, contracts.CompletionRate)
+            .join(source.totals, totals.ContractID == contracts.ContractID, isouter=True)
+            .where(contracts.ClientID.in_(ids))
+            .order_by(contracts.ClientID, contracts.ContractID)
+        )
+        for client_id, contract_id, project, number, amount, paid, invoiced, sign_date, completion in rows:
+            amount, paid, invoiced = float(amount), float(paid or 0), float(invoiced or 0)
+            lines.setdefault(client_id, []).append({
+                'ContractID': contract_id,
+                'ProjectName': project,
+                'ContractNumber': number,
+                'TotalAmount': amount,
+                'TotalPayments': paid,
+                'TotalInvoices': invoiced,
+                'RemainingPayment': amount - paid,
+                'RemainingInvoice': amount - invoiced,
+                'SignDate': sign_date.isoformat() if sign_date else None,
+                'CompletionRate': float(completion) if completion is not None else 0.0,
+            })
+    return lines
+
+
+def client_summaries(client_ids=None, include_contracts=False, source=HOT_CONTRACTS):
+    """客户汇总：{ClientID: 汇总}，include_contracts 为 True 时每个汇总附带 contracts 合同明细
+
+    查询次数固定（客户数超过 1000 时按每 1000 个分批），与客户和合同数量无关。
+    source 为 contract_source(True) 时归档的合同也计入。
+    """
+    headers = _client_headers(client_ids, source)
+    if include_contracts and headers:
+        lines = _client_contract_lines(list(headers), source)
+        for client_id, header in headers.items():
+            header['contracts'] = lines.get(client_id, [])
+    return headers
+
+
+def select_contracts(fields, *criteria, order_by=(), limit=None, extra_columns=(), source=HOT_CONTRACTS):
+    """只读取 fields 用到的列，不载入 Contract 对象，返回 (合同行列表, 合计字典)
+
+    需要合计字段时关联 ContractTotals，需要 Client 时关联 Clients，需要 Supplier 时另用一条查询读取供应商名称；
+    只要 ContractID、ProjectName 等合同自身字段时只有一条单表查询。
+    合同行的属性与 Contract 对象同名（client/suppliers 为只有名称的简单对象），可直接交给 serialize_contract。
+    extra_columns 为额外读取的合同列名（如分页游标用到的排序列）。
+    source 为读取的合同来源（见 contract_source），criteria、order_by 应使用它的列。
+    """
+    contract_table, totals_table, links = source
+    names = ['ContractID']
+    for name in [column for field in fields for column in _FIELD_COLUMNS.get(field, ())] + list(extra_columns):
+        if name not in names:
+            names.append(name)
+    totals_names = sorted({column for field in fields for column in _FIELD_TOTALS.get(field, ())})
+
+    columns = [contract_table.c[name] for name in names]
+    columns += [totals_table.c[name].label(name) for name in totals_names]
+    if 'Client' in fields:
+        columns.append(Client.ClientName)
+    stmt = select(*columns).select_from(contract_table).where(*criteria).order_by(*order_by)
+    if totals_names:
+        stmt = stmt.outerjoin(totals_table, totals_table.c.ContractID == contract_table.c.ContractID)
+    if 'Client' in fields:
+        stmt = stmt.outerjoin(Client, Client.ClientID == contract_table.c.ClientID)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    rows = db.session.execute(stmt).all()
+
+    suppliers = {}
+    if 'Supplier' in fields and rows:
+        for ids in chunked([row.ContractID for row in rows]):
+            for contract_id, name in db.session.execute(
+                    select(links.c.contract_id, Supplier.SupplierName)
+                    .join(Supplier, Supplier.SupplierID == links.c.supplier_id)
+                    .where(links.c.contract_id.in_(ids))
+                    .order_by(links.c.contract_id, Supplier.SupplierID)):
+                suppliers.setdefault(contract_id, []).append(SimpleNamespace(SupplierName=name))
+
+    contracts, totals = [], {}
+    for row in rows:
+        values = row._asdict()
+        client_name = values.pop('ClientName', None)
+        contract = SimpleNamespace(**{name: values[name] for name in names},
+                                   client=SimpleNamespace(ClientName=client_name) if client_name is not None else None,
+                                   suppliers=suppliers.get(row.ContractID, []))
+        contracts.append(contract)
+        if totals_names:
+            totals[row.ContractID] = dict(_EMPTY_TOTALS, **{name: values[name] or 0 for name in totals_names})
+    return contracts, totals
+
+
+def contract_rows(fields, *criteria, source=HOT_CONTRACTS):
+    """满足条件的合同，只读取 fields 需要的列（供 JSON 接口的 fields 参数使用）"""
+    contracts, totals = select_contracts(fields, *criteria, order_by=(source.contracts.c.ContractID,),
+                                         source=source)
+    return [serialize_contract(contract, totals, fields) for contract in contracts]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from jinja2 import TemplateSyntaxError
+
+
+def compile_templates(app, echo=print):
+    """编译全部 HTML 模板并放入 Jinja 缓存，同时检查 UTF-8 编码和模板语法
+
+    启动时和 check-templates 命令各执行一次，之后的请求直接使用缓存中已编译的模板；
+    只有开发模式（TEMPLATES_AUTO_RELOAD 或 debug）下 Jinja 才会按修改时间重新加载。
+    返回有问题的模板 [(模板名, 错误说明)]。
+    """
+    names = app.jinja_env.list_templates(extensions=['html'])
+    errors = []
+    for name in names:
+        try:
+            app.jinja_env.get_template(name)
+        except UnicodeDecodeError as e:
+            errors.append((name, f'编码错误 - {e}'))
+        except TemplateSyntaxError as e:
+            errors.append((name, f'第 {e.lineno} 行语法错误 - {e.message}'))
+
+    for name, error in errors:
+        echo(f"✗ {name}: {error}")
+    if any(error.startswith('编码错误') for _, error in errors):
+        echo("请运行 fix_encoding.py 修复编码问题")
+    if not errors:
+        echo(f"模板检查完成：{len(names)} 个模板 UTF-8 编码正常，已编译缓存")
+    return errors
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""月度趋势：回款、开票、成本和毛利
+
+只读取合同月度合计表 MonthlyContractTotals（客户/供应商维度通过合同表、合同-供应商关联表汇总）
+和按月记录的固定成本表，不扫描付款/发票/成本流水。归档合同的月度合计随合同搬到归档表
+（ArchivedMonthlyContractTotals，见 app/contract_bulk.py），历史趋势不因归档而改变，两部分以 UNION ALL 一起汇总。
+收入按回款（付款）计，毛利 = 回款 - 成本（成本中已包含固定成本分摊生成的记录），
+公司整体趋势另外列出当月录入的固定成本，仅供参考，不再从毛利中扣减。
+"""
+from datetime import date
+from sqlalchemy import func, select, union_all
+from app import db
+from app.models import (MonthlyContractTotal, Contract, Client, Supplier, FixedCost, contract_supplier,
+                        archived_monthly_totals, archived_contracts, archived_contract_suppliers)
+from app.rollups import TOTAL_FIELDS
+from app.utils import chunked
+
+DEFAULT_MONTHS = 12
+MAX_MONTHS = 120
+
+# 月度合计的来源：(月度合计表, 合同表, 合同-供应商关联表)，流水表一组、归档表一组
+_SOURCES = (
+    (MonthlyContractTotal.__table__, Contract.__table__, contract_supplier),
+    (archived_monthly_totals, archived_contracts, archived_contract_suppliers),
+)
+
+
+def _parse_month(value):
+    try:
+        year, month = value.split('-')
+        year, month = int(year), int(month)
+        if len(value) != 7 or not 1 <= month <= 12:
+            raise ValueError
+    except (AttributeError, ValueError):
+        raise ValueError(f'月份格式应为 YYYY-MM: {value}')
+    return year, month
+
+
+def month_range(args):
+    """从查询参数 start/end（YYYY-MM）解析月份列表，默认截至本月的最近 12 个月"""
+    today = date.today()
+    end = _parse_month(args['end']) if args.get('end') else (today.year, today.month)
+    if args.get('start'):
+        start = _parse_month(args['start'])
+    else:
+        index = end[0] * 12 + end[1] - DEFAULT_MONTHS
+        start = (index // 12, index % 12 + 1)
+    if end < start:
+        raise ValueError('结束月份不能早于开始月份')
+
+    months = []
+    year, month = start
+    while (year, month) <= end:
+        months.append(f'{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    if len(months) > MAX_MONTHS:
+        raise ValueError(f'一次最多查询 {MAX_MONTHS} 个月')
+    return months
+
+
+def _point(payments=0, invoices=0, costs=0):
+    payments, invoices, costs = float(payments or 0), float(invoices or 0), float(costs or 0)
+    margin = payments - costs
+    return {
+        'Payments': round(payments, 2),
+        'Invoices': round(invoices, 2),
+        'Costs': round(costs, 2),
+        'GrossMargin': round(margin, 2),
+        'GrossMarginRate': round(margin / payments * 100, 2) if payments else None,
+    }
+
+
+def _series(months, values):
+    """values 为 {月份: (回款, 开票, 成本)}，没有数据的月份补 0；返回 (逐月列表, 区间合计)"""
+    series = [dict(_point(*values.get(month, ())), Month=month) for month in months]
+    totals = _point(*[sum(values[month][i] or 0 for month in values) for i in range(len(TOTAL_FIELDS))])
+    return series, totals
+
+
+def _monthly_rows(months, group, entity_id):
+    """月份区间内的月度合计行 (Month, GroupKey, 三个合计字段)，流水表和归档表两部分 UNION ALL
+
+    group 为 clients/suppliers 时 GroupKey 为客户/供应商ID（通过各自的合同表、关联表取得），否则为合同ID；
+    指定 entity_id 时只取该合同/客户/供应商的行。
+    """
+    parts = []
+    for monthly, contracts, suppliers in _SOURCES:
+        if group == 'clients':
+            key = contracts.c.ClientID
+            joins = [(contracts, contracts.c.ContractID == monthly.c.ContractID)]
+        elif group == 'suppliers':
+            key = suppliers.c.supplier_id
+            joins = [(suppliers, suppliers.c.contract_id == monthly.c.ContractID)]
+        else:
+            key, joins = monthly.c.ContractID, []
+        stmt = select(monthly.c.Month, key.label('GroupKey'), *[monthly.c[field] for field in TOTAL_FIELDS])
+        for target, onclause in joins:
+            stmt = stmt.join(target, onclause)
+        stmt = stmt.where(monthly.c.Month >= months[0], monthly.c.Month <= months[-1])
+        if entity_id is not None:
+            stmt = stmt.where(key == entity_id)
+        parts.append(stmt)
+    return union_all(*parts).subquery()
+
+
+def _monthly_sums(months, group=None, entity_id=None, by_group=False):
+    """在月份区间内汇总月度合计，返回 {键: {月份: (回款, 开票, 成本)}}，by_group 为 False 时键为 None"""
+    rows = _monthly_rows(months, group, entity_id)
+    columns = [rows.c.Month] + ([rows.c.GroupKey] if by_group else [])
+    stmt = (select(*columns, *[func.sum(rows.c[field]) for field in TOTAL_FIELDS])
+            .group_by(*columns))
+
+    result = {}
+    for row in db.session.execute(stmt):
+        month, key, amounts = row[0], (row[1] if by_group else None), tuple(row[-len(TOTAL_FIELDS):])
+        result.setdefault(key, {})[month] = amounts
+    return result
+
+
+def _group_spec(group):
+    """客户/供应商维度：(主键列, 名称列)"""
+    if group == 'clients':
+        return Client.ClientID, Client.ClientName
+    return Supplier.SupplierID, Supplier.SupplierName
+
+
+def company_trend(months):
+    """公司整体逐月趋势，附带当月录入的固定成本"""
+    values = _monthly_sums(months).get(None, {})
+    series, totals = _series(months, values)
+    fixed_costs = dict(db.session.execute(
+        select(FixedCost.Month, func.sum(FixedCost.Amount))
+        .where(FixedCost.Month >= months[0], FixedCost.Month <= months[-1])
+        .group_by(FixedCost.Month)
+    ).all())
+    for point in series:
+        point['FixedCosts'] = round(float(fixed_costs.get(point['Month']) or 0), 2)
+    totals['FixedCosts'] = round(sum(point['FixedCosts'] for point in series), 2)
+    return {'months': months, 'series': series, 'totals': totals}
+
+
+def entity_trend(group, entity_id, months):
+    """单个合同/客户/供应商的逐月趋势"""
+    values = _monthly_sums(months, group, entity_id)
+    series, totals = _series(months, values.get(None, {}))
+    return {'months': months, 'series': series, 'totals': totals}
+
+
+def group_trends(group, months):
+    """所有客户/供应商的逐月趋势（月 × 客户、月 × 供应商），按区间回款合计从大到小排序
+
+    一个合同关联多个供应商时，合同的金额计入每个供应商。
+    """
+    id_column, name_column = _group_spec(group)
+    values = _monthly_sums(months, group, by_group=True)
+    names = {}
+    for ids in chunked([key for key in values if key is not None]):
+        names.update(db.session.execute(select(id_column, name_column).where(id_column.in_(ids))).all())
+
+    id_field = 'ClientID' if group == 'clients' else 'SupplierID'
+    name_field = 'ClientName' if group == 'clients' else 'SupplierName'
+    rows = []
+    for key, monthly in values.items():
+        series, totals = _series(months, monthly)
+        rows.append({id_field: key, name_field: names.get(key, '未指定客户' if key is None else ''),
+                     'series': series, 'totals': totals})
+    rows.sort(key=lambda row: row['totals']['Payments'], reverse=True)
+    return {'months': months, 'rows': rows}
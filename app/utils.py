@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+# SQL Server 单条语句最多 2100 个参数，IN 列表和批量写入按此分块
+CHUNK_SIZE = 1000
+
+
+def chunked(items, size=CHUNK_SIZE):
+    """把序列按 size 分块"""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from app import db
+
+
+def warm_pool(connections):
+    """预先打开若干数据库连接并放回连接池，第一批请求不用再等待建立连接"""
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(db.engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+    return len(opened)
+
+
+def warm_up(app, echo=print):
+    """进程开始处理请求之前的预热：连接池、模板编译缓存、供应商/客户搜索索引
+
+    每个工作进程在 create_app 中执行一次；连接池预热的连接数由 WARMUP_POOL_CONNECTIONS 配置。
+    """
+    from app.template_cache import compile_templates
+    from app.search import rebuild_search_indexes
+
+    connections = app.config.get('WARMUP_POOL_CONNECTIONS', 0)
+    if connections:
+        try:
+            echo(f"连接池已预热 {warm_pool(connections)} 个连接")
+        except Exception as e:
+            echo(f"连接池预热失败: {str(e)}")
+
+    # 检查模板编码并预编译模板
+    compile_templates(app, echo=echo)
+
+    # 载入供应商/客户搜索索引
+    try:
+        rebuild_search_indexes()
+        echo("搜索索引已建立")
+    except Exception as e:
+        echo(f"建立搜索索引失败: {str(e)}")
+        db.session.rollback()
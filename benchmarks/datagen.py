@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""基准测试用的合成数据：按规模生成客户、供应商、合同、流水、固定成本和对账记录
+
+同一个 seed 和规模总是生成完全相同的数据，前后两次基准结果可以直接比较。
+"""
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import insert
+from app import db
+from app.models import (Client, Supplier, Contract, Payment, Invoice, Cost, FixedCost,
+                        SupplierReconciliation, contract_supplier)
+from app.rollups import rebuild_contract_totals, rebuild_monthly_totals
+from app.utils import chunked
+
+# 各规模的数据量；*_per_contract / *_per_supplier 为平均值
+SCALES = {
+    'small': {
+        'clients': 50, 'suppliers': 50, 'contracts': 500,
+        'payments_per_contract': 4, 'invoices_per_contract': 4, 'costs_per_contract': 6,
+        'months': 12, 'reconciliations_per_supplier': 40,
+    },
+    'medium': {
+        'clients': 300, 'suppliers': 300, 'contracts': 5000,
+        'payments_per_contract': 6, 'invoices_per_contract': 6, 'costs_per_contract': 10,
+        'months': 24, 'reconciliations_per_supplier': 200,
+    },
+    'large': {
+        'clients': 2000, 'suppliers': 2000, 'contracts': 50000,
+        'payments_per_contract': 8, 'invoices_per_contract': 8, 'costs_per_contract': 12,
+        'months': 36, 'reconciliations_per_supplier': 500,
+    },
+}
+
+FIRST_MONTH = date(2022, 1, 1)
+
+_NAME_CHARS = '华为建设科技工程信达中天宏远金鑫恒通昌盛东方新世纪永安博达汇丰广源创兴泰和'
+_NAME_SUFFIXES = ('有限公司', '建设集团', '工程有限公司', '科技股份有限公司', '贸易公司')
+_PAYMENT_TYPES = ('预付款', '进度款', '结算款', '质保金')
+_INVOICE_TYPES = ('增值税专用发票', '增值税普通发票')
+_COST_TYPES = ('材料费', '人工费', '机械费', '分包费', '其他')
+_FIXED_COST_TYPES = ('工资薪金', '房租', '水电费')
+
+
+def _company_name(rng, index):
+    body = ''.join(rng.choice(_NAME_CHARS) for _ in range(rng.randint(2, 4)))
+    return f"{body}{rng.choice(_NAME_SUFFIXES)}{index}"
+
+
+def _month(offset):
+    year, month = divmod(FIRST_MONTH.month - 1 + offset, 12)
+    return date(FIRST_MONTH.year + year, month + 1, 1)
+
+
+def _amount(rng, low, high):
+    return Decimal(rng.randint(low * 100, high * 100)) / 100
+
+
+def _insert(model_or_table, rows):
+    for chunk in chunked(rows):
+        db.session.execute(insert(model_or_table), chunk)
+
+
+def generate(scale='small', seed=20250820, echo=print):
+    """向当前数据库写入一整套合成数据（要求表已建好且为空），返回各表行数"""
+    volumes = SCALES[scale]
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1)
+    days = volumes['months'] * 30
+
+    # 不指定自增主键（SQL Server 不允许直接写入 IDENTITY 列），插入后按名称/编号读回ID
+    clients = [{'ClientName': _company_name(rng, i), 'ContactInfo': '', 'CreatedDate': now}
+               for i in range(1, volumes['clients'] + 1)]
+    suppliers = [{'SupplierName': _company_name(rng, i), 'ContactInfo': '', 'CreatedDate': now}
+                 for i in range(1, volumes['suppliers'] + 1)]
+    _insert(Client, clients)
+    _insert(Supplier, suppliers)
+    client_ids = dict(db.session.query(Client.ClientName, Client.ClientID))
+    client_ids = [client_ids[row['ClientName']] for row in clients]
+    supplier_ids = dict(db.session.query(Supplier.SupplierName, Supplier.SupplierID))
+    supplier_ids = [supplier_ids[row['SupplierName']] for row in suppliers]
+
+    contracts, links = [], []
+    payments, invoices, costs = [], [], []
+    # 流水中的 ContractID 先记为合同序号，合同插入后再换成实际ID
+    for contract_id in range(1, volumes['contracts'] + 1):
+        amount = _amount(rng, 10000, 2000000)
+        sign_date = FIRST_MONTH + timedelta(days=rng.randrange(days))
+        contracts.append({
+            'ProjectName': f"项目{contract_id}",
+            'ContractNumber': f"HT{contract_id:07d}",
+            'TotalAmount': amount,
+            'ClientID': client_ids[rng.randrange(volumes['clients'])],
+            # 少量合同没有签订日期，覆盖分页中 NULL 排序的情况
+            'SignDate': sign_date if rng.random() > 0.02 else None,
+            'CompletionRate': Decimal(rng.randint(0, 100)),
+            'CreatedDate': now,
+        })
+        for supplier_id in rng.sample(supplier_ids, rng.choice((1, 1, 1, 2))):
+            links.append({'contract_id': contract_id, 'supplier_id': supplier_id})
+
+        def ledger_date():
+            return sign_date + timedelta(days=rng.randrange(max(days - (sign_date - FIRST_MONTH).days, 1)))
+
+        for _ in range(rng.randint(0, volumes['payments_per_contract'] * 2)):
+            payments.append({'ContractID': contract_id, 'PaymentDate': ledger_date(),
+                             'Amount': _amount(rng, 100, int(amount) // 8 + 100),
+                             'PaymentType': rng.choice(_PAYMENT_TYPES), 'CreatedDate': now})
+        for _ in range(rng.randint(0, volumes['invoices_per_contract'] * 2)):
+            invoices.append({'ContractID': contract_id, 'InvoiceDate': ledger_date(),
+                             'Amount': _amount(rng, 100, int(amount) // 8 + 100),
+                             'InvoiceType': rng.choice(_INVOICE_TYPES), 'CreatedDate': now})
+        for _ in range(rng.randint(0, volumes['costs_per_contract'] * 2)):
+            costs.append({'ContractID': contract_id, 'CostType': rng.choice(_COST_TYPES),
+                          'Amount': _amount(rng, 100, int(amount) // 10 + 100), 'CostDate': ledger_date(),
+                          'Description': '', 'CreatedDate': now})
+    _insert(Contract, contracts)
+    contract_ids = dict(db.session.query(Contract.ContractNumber, Contract.ContractID))
+    contract_ids = [None] + [contract_ids[row['ContractNumber']] for row in contracts]
+    for row in links:
+        row['contract_id'] = contract_ids[row['contract_id']]
+    for row in payments + invoices + costs:
+        row['ContractID'] = contract_ids[row['ContractID']]
+    _insert(contract_supplier, links)
+    _insert(Payment, payments)
+    _insert(Invoice, invoices)
+    _insert(Cost, costs)
+
+    fixed_costs = []
+    for offset in range(volumes['months']):
+        month = _month(offset)
+        for cost_type in _FIXED_COST_TYPES:
+            fixed_costs.append({'CostType': cost_type, 'Amount': _amount(rng, 20000, 200000), 'CostDate': month,
+                                'Description': '', 'Month': month.strftime('%Y-%m'), 'CreatedDate': now})
+    _insert(FixedCost, fixed_costs)
+
+    reconciliations = []
+    for supplier_id in supplier_ids:
+        for _ in range(rng.randint(0, volumes['reconciliations_per_supplier'] * 2)):
+            reconciliations.append({
+                'SupplierID': supplier_id,
+                'TransactionDate': FIRST_MONTH + timedelta(days=rng.randrange(days)),
+                'PaymentAmount': _amount(rng, 0, 50000) if rng.random() < 0.5 else Decimal(0),
+                'InvoiceAmount': _amount(rng, 0, 50000) if rng.random() < 0.5 else Decimal(0),
+                'Description': '', 'CustomField1': '', 'CustomField2': '', 'CustomField3': '',
+                'CreatedDate': now,
+            })
+    _insert(SupplierReconciliation, reconciliations)
+    db.session.commit()
+
+    rebuild_contract_totals()
+    rebuild_monthly_totals()
+
+    counts = {
+        'clients': len(clients), 'suppliers': len(suppliers), 'contracts': len(contracts),
+        'contract_suppliers': len(links), 'payments': len(payments), 'invoices': len(invoices),
+        'costs': len(costs), 'fixed_costs': len(fixed_costs), 'reconciliations': len(reconciliations),
+    }
+    echo('已生成数据: ' + ', '.join(f'{name} {count}' for name, count in counts.items()))
+    return counts
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""基准测试：生成合成数据后用 Flask 测试客户端压测主要页面和接口
+
+    python -m benchmarks.run --scale small --save benchmarks/baseline.json
+    python -m benchmarks.run --scale small --compare benchmarks/baseline.json
+
+默认使用临时 SQLite 文件代替 SQL Server（--database-uri 可指定其他数据库，要求为空库）。
+每个场景先预热一次，再请求 --iterations 次，统计延迟百分位（毫秒）和每个请求的查询次数
+（取自 X-Query-Count 响应头），最后单独用 tracemalloc 再请求一次记录内存峰值。
+--save 把结果保存为基线；--compare 与基线比较，p50/p90 变慢超过 --threshold 百分比
+或查询次数增加时列出退化项，并以退出码 1 结束（可用于 CI）。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+from config import Config
+from app import create_app, db
+from app.models import Supplier, SupplierReconciliation
+from benchmarks.datagen import SCALES, FIRST_MONTH, generate
+
+# 延迟差异小于该值（毫秒）时视为测量噪声，不算退化
+MIN_DELTA_MS = 1.0
+
+SEARCH_TERMS = ('华', '建设', '科技', 'hw', '有限公司', '东方', '1')
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    WARMUP_POOL_CONNECTIONS = 0
+    CACHE_ENABLED = False
+    # 基准数据量下慢查询日志没有意义，只看汇总结果
+    SLOW_QUERY_MS = None
+
+
+def _install_sqlite_date_compat():
+    """SQLite 的 Date/DateTime 列只接受 date 对象，而接口把 'YYYY-MM-DD' 字符串直接交给 SQL Server；
+    用 SQLite 代替时把字符串参数转换成日期，接口代码不用改动"""
+    from sqlalchemy.dialects.sqlite import base as sqlite_base
+
+    for column_type, parse in ((sqlite_base.DATE, date.fromisoformat),
+                               (sqlite_base.DATETIME, datetime.fromisoformat)):
+        original = column_type.bind_processor
+
+        def bind_processor(self, dialect, original=original, parse=parse):
+            process = original(self, dialect)
+            return lambda value: process(parse(value) if isinstance(value, str) else value)
+
+        column_type.bind_processor = bind_processor
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_scenarios(months):
+    """[(名称, 请求函数)]；请求函数接收测试客户端和序号 i，返回响应"""
+    busiest = (db.session.query(SupplierReconciliation.SupplierID)
+               .group_by(SupplierReconciliation.SupplierID)
+               .order_by(db.func.count().desc(), SupplierReconciliation.SupplierID)
+               .limit(1).scalar()) or db.session.query(db.func.min(Supplier.SupplierID)).scalar()
+    allocation_months = [f"{FIRST_MONTH.year + (FIRST_MONTH.month - 1 + offset) // 12}-"
+                         f"{(FIRST_MONTH.month - 1 + offset) % 12 + 1:02d}" for offset in range(months)]
+
+    return [
+        ('index', lambda c, i: c.get('/')),
+        ('index_over_budget', lambda c, i: c.get('/?over_budget=1')),
+        ('api_contracts', lambda c, i: c.get('/api/contracts?limit=50&sort=SignDate&order=desc')),
+        ('search_suppliers', lambda c, i: c.get(f'/api/suppliers/search/{SEARCH_TERMS[i % len(SEARCH_TERMS)]}')),
+        ('search_clients', lambda c, i: c.get(f'/api/clients/search/{SEARCH_TERMS[i % len(SEARCH_TERMS)]}')),
+        # 依次分摊不同月份；月份用完后重新分摊同一月份（走增量更新）
+        ('allocate_fixed_costs', lambda c, i: c.post('/api/allocate_fixed_costs', json={
+            'month': allocation_months[i % len(allocation_months)], 'cost_type': '工资薪金'})),
+        ('reconciliation_page', lambda c, i: c.get(f'/supplier/{busiest}/reconciliation')),
+        ('api_reconciliation', lambda c, i: c.get(f'/api/suppliers/{busiest}/reconciliation')),
+        ('aging_dashboard', lambda c, i: c.get('/aging')),
+        ('api_aging_clients', lambda c, i: c.get('/api/aging/clients')),
+    ]
+
+
+def run_scenario(client, request, iterations):
+    request(client, -1)  # 预热（模板编译、首次查询计划等不计入结果）
+    latencies, queries = [], []
+    for i in range(iterations):
+        start = time.perf_counter()
+        response = request(client, i)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f"请求失败 {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        queries.append(int(response.headers.get('X-Query-Count', 0)))
+
+    tracemalloc.start()
+    request(client, iterations)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(_percentile(latencies, 50), 2),
+        'p90_ms': round(_percentile(latencies, 90), 2),
+        'p99_ms': round(_percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'queries': int(statistics.median(queries)),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def print_results(results):
+    print(f"{'场景':<24}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'查询':>6}{'内存峰值KB':>12}")
+    for name, result in results.items():
+        print(f"{name:<24}{result['p50_ms']:>10.2f}{result['p90_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+              f"{result['max_ms']:>10.2f}{result['queries']:>6}{result['peak_kb']:>14.1f}")
+
+
+def compare(results, baseline, threshold):
+    """返回退化项说明列表：延迟超过阈值百分比（且至少慢 MIN_DELTA_MS）或查询次数增加"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        for key in ('p50_ms', 'p90_ms'):
+            if (result[key] - base[key] >= MIN_DELTA_MS
+                    and result[key] > base[key] * (1 + threshold / 100)):
+                regressions.append(f"{name} {key}: {base[key]} -> {result[key]} "
+                                   f"(+{(result[key] / base[key] - 1) * 100:.0f}%)")
+        if result['queries'] > base['queries']:
+            regressions.append(f"{name} 查询次数: {base['queries']} -> {result['queries']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='合同管理系统基准测试')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=20250820)
+    parser.add_argument('--database-uri', help='默认使用临时 SQLite 文件')
+    parser.add_argument('--cache', action='store_true', help='启用响应缓存（默认关闭，测量未命中缓存的耗时）')
+    parser.add_argument('--only', action='append', help='只运行指定场景，可重复')
+    parser.add_argument('--save', help='把结果保存为基线 JSON')
+    parser.add_argument('--compare', help='与基线 JSON 比较')
+    parser.add_argument('--threshold', type=float, default=20, help='延迟退化阈值（百分比）')
+    args = parser.parse_args(argv)
+
+    temp_dir = None
+    database_uri = args.database_uri
+    if not database_uri:
+        temp_dir = tempfile.TemporaryDirectory()
+        database_uri = 'sqlite:///' + os.path.join(temp_dir.name, 'benchmark.db')
+    if database_uri.startswith('sqlite'):
+        _install_sqlite_date_compat()
+
+    config = type('Config', (BenchmarkConfig,), {
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'CACHE_ENABLED': args.cache,
+    })
+    app = create_app(config)
+
+    with app.app_context():
+        from app.schema import upgrade
+        from app.search import rebuild_search_indexes
+
+        upgrade(echo=lambda *a: None)
+        start = time.perf_counter()
+        counts = generate(args.scale, args.seed)
+        print(f"数据生成耗时 {time.perf_counter() - start:.1f}s")
+        rebuild_search_indexes()
+        scenarios = build_scenarios(SCALES[args.scale]['months'])
+        db.session.remove()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+
+    results = {}
+    for name, request in scenarios:
+        if args.only and name not in args.only:
+            continue
+        results[name] = run_scenario(client, request, args.iterations)
+    print_results(results)
+
+    report = {
+        'meta': {
+            'scale': args.scale,
+            'seed': args.seed,
+            'iterations': args.iterations,
+            'cache': args.cache,
+            'database': database_uri.split(':', 1)[0],
+            'counts': counts,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.save}")
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline['meta']['scale'], baseline['meta']['seed']) != (args.scale, args.seed):
+            print("警告：基线的数据规模或 seed 与本次不同，比较结果仅供参考")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("性能退化：")
+            for line in regressions:
+                print(f"  ✗ {line}")
+            exit_code = 1
+        else:
+            print(f"与基线相比没有超过 {args.threshold:.0f}% 的退化")
+
+    if temp_dir is not None:
+        with app.app_context():
+            db.engine.dispose()
+        temp_dir.cleanup()
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
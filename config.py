@@ -10,4 +10,101 @@ class Config:
     
     # 使用 Windows 身份验证的连接字符串
     SQLALCHEMY_DATABASE_URI = f'mssql+pyodbc://@{SQL_SERVER}/{SQL_DATABASE}?driver={SQL_DRIVER}&trusted_connection=yes'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # 连接池：pool_size 个常驻连接，高峰时最多再临时打开 max_overflow 个；
+    # 连接使用超过 pool_recycle 秒后重建，取出前先 ping 一次，避免使用已被数据库断开的连接
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'fast_executemany': True,  # pyodbc 批量写入（executemany）时一次发送所有参数
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_pre_ping': True,
+    }
+    
+    # 启动预热时预先打开的数据库连接数（0 表示不预热连接池）
+    WARMUP_POOL_CONNECTIONS = 0
+    
+    # 只读 JSON 接口的响应缓存（见 app/cache.py）；多进程部署时配置 Redis 共享失效标签
+    CACHE_ENABLED = True
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))
+    CACHE_MAX_ENTRIES = 1024
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    
+    # 响应压缩（见 app/compression.py）：按 Accept-Encoding 使用 br（需安装 brotli）或 gzip
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    
+    # 写操作的增量推送（见 app/live.py）：每个 SSE 连接占用一个工作线程，连接数上限要小于服务器线程数
+    LIVE_EVENTS_ENABLED = True
+    LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', 4))
+    LIVE_HEARTBEAT = 15
+    
+    # 增量同步接口 /api/changes（见 app/changes.py）：登记超过此秒数仍未结束的写事务视为进程已退出，不再等待
+    CHANGE_FEED_WRITER_TIMEOUT = 3600
+    
+    # 后台任务（见 app/jobs.py）：任务线程也占用数据库连接，JOB_WORKERS 与服务器线程数之和不要超过连接池大小；
+    # 心跳超过 JOB_ORPHAN_SECONDS 秒未更新的未完成任务视为执行进程已退出；导出文件默认放在 instance/jobs
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_MAX_PENDING = 20
+    JOB_HEARTBEAT_SECONDS = 30
+    JOB_ORPHAN_SECONDS = 120
+    JOB_RESULT_DIR = os.environ.get('JOB_RESULT_DIR')
+    
+    # 财年开始的月份（1 为自然年）；已结清合同按结清所在的财年归档（见 app/archive.py）
+    FISCAL_YEAR_START_MONTH = 1
+    
+    # 请求性能统计（见 app/metrics.py）：慢查询阈值（毫秒）、慢查询日志文件（为空时只输出到控制台）
+    METRICS_ENABLED = True
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 200))
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')
+    # 监控系统读取 /metrics 的令牌（请求头 Authorization: Bearer <令牌>）；未设置时只有登录用户可以访问
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # 各端点每个 GET 请求允许的查询次数；超出时记录警告，QUERY_BUDGET_STRICT 为 True 时抛出异常（测试用）
+    QUERY_BUDGETS = {
+        'index': 4,
+        'contracts': 3,
+        'client_contracts': 2,
+        'supplier_contracts': 3,
+        'get_salary_costs': 1,
+        'supplier_reconciliation': 10,
+        'get_supplier_reconciliation': 8,
+        'aging_dashboard': 6,
+        'aging_summary_api': 3,
+        'aging_group_api': 5,
+        'trends_api': 2,
+        'entity_trend_api': 3,
+        'group_trends_api': 2,
+        'client_summary': 2,
+        'client_summaries_api': 2,
+        'clients': 2,
+        'changes_api': 12,
+        'archive_summary_api': 1,
+        'archived_contracts_api': 3,
+        'archived_contract_api': 5,
+        'jobs_api': 1,
+        'job_status': 3,
+        'job_result': 2,
+    }
+    QUERY_BUDGET_STRICT = False
+
+
+# 生产环境：python serve.py 使用的配置
+class ProductionConfig(Config):
+    DEBUG = False
+    TEMPLATES_AUTO_RELOAD = False
+    
+    # WSGI 服务器监听地址和工作线程数；线程数不要超过连接池能提供的连接数
+    SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+    SERVER_PORT = int(os.environ.get('SERVER_PORT', 8000))
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', Config.DB_POOL_SIZE))
+    
+    WARMUP_POOL_CONNECTIONS = Config.DB_POOL_SIZE
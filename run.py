@@ -10,4 +10,5 @@ if __name__ == '__main__':
         for rule in app.url_map.iter_rules():
             print(f"{rule.endpoint}: {rule.rule}")
     
+    # 开发模式（单进程、自动重载）；生产环境请使用 python serve.py
     app.run(debug=True)
\ No newline at end of file
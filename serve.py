@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""生产环境启动入口
+
+Windows：python serve.py（waitress 多线程服务器，线程数见 config.ProductionConfig.SERVER_THREADS）
+Linux：gunicorn -w 4 --threads 8 -b 0.0.0.0:8000 serve:app（每个工作进程各自完成预热后才接收请求）
+多个工作进程时须配置 CACHE_REDIS_URL：响应缓存、搜索索引的失效和实时推送经 Redis 在进程间同步，
+否则一个进程的修改其他进程看不到。
+
+与 run.py 不同，这里不开启 debug 和自动重载，模板只在启动时编译一次。
+"""
+from app import create_app
+from config import ProductionConfig
+
+app = create_app(ProductionConfig)
+
+if __name__ == '__main__':
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("请先安装 waitress：pip install waitress")
+    
+    host, port = app.config['SERVER_HOST'], app.config['SERVER_PORT']
+    print(f"生产模式启动：http://{host}:{port}，{app.config['SERVER_THREADS']} 个工作线程")
+    serve(app, host=host, port=port, threads=app.config['SERVER_THREADS'])